@@ -12,6 +12,10 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import collections
+import concurrent.futures
+import hashlib
+import json
 import logging
 import os
 import os.path
@@ -19,7 +23,14 @@ import shutil
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 
+from java_role import config
+from java_role import engine
+from java_role import facts
+from java_role import inventory
+from java_role import retry
 from java_role import utils
 from java_role import vault
 
@@ -27,12 +38,38 @@ DEFAULT_CONFIG_PATH = "/etc/java_role"
 
 CONFIG_PATH_ENV = "JAVA_ROLE_CONFIG_PATH"
 
+ENGINES = ("subprocess", "inprocess")
+
+DEFAULT_ENGINE = "subprocess"
+
+ENGINE_ENV = "JAVA_ROLE_ANSIBLE_ENGINE"
+
+CONFIG_DUMP_CACHE_ENV = "JAVA_ROLE_CONFIG_DUMP_CACHE"
+
+# Playbook used to dump configuration.
+CONFIG_DUMP_PLAYBOOK = "ansible/dump-config.yml"
+
+# Minimum number of configuration dump files to parse in a process pool.
+# Below this, the cost of starting worker processes outweighs the benefit.
+CONFIG_DUMP_POOL_THRESHOLD = 64
+
 LOG = logging.getLogger(__name__)
 
+# Playbook run between fused playbook runs, which may modify the inventory.
+REFRESH_INVENTORY_PLAYBOOK = [{
+    "name": "Refresh inventory between batched playbook runs",
+    "hosts": "all",
+    "gather_facts": False,
+    "tags": ["always"],
+    "tasks": [{"meta": "refresh_inventory"}],
+}]
+
 
 def add_args(parser):
     """Add arguments required for running Ansible playbooks to a parser."""
     default_config_path = os.getenv(CONFIG_PATH_ENV, DEFAULT_CONFIG_PATH)
+    default_engine = os.getenv(ENGINE_ENV, DEFAULT_ENGINE)
+    default_config_dump_cache = os.getenv(CONFIG_DUMP_CACHE_ENV, "").lower()
     parser.add_argument("-b", "--become", action="store_true",
                         help="run operations with become (nopasswd implied)")
     parser.add_argument("-C", "--check", action="store_true",
@@ -42,6 +79,21 @@ def add_args(parser):
                         help="path to JavaRole configuration. "
                              "(default=$%s or %s)" %
                              (CONFIG_PATH_ENV, DEFAULT_CONFIG_PATH))
+    parser.add_argument("--config-dump-cache", action="store_true",
+                        default=default_config_dump_cache in ("1", "true"),
+                        help="cache configuration dumps under the "
+                             "configuration path, and reuse them while their "
+                             "inputs are unchanged. Configuration containing "
+                             "vault-encrypted content is never cached "
+                             "(default=$%s or false)" % CONFIG_DUMP_CACHE_ENV)
+    parser.add_argument("--engine", choices=ENGINES, default=default_engine,
+                        help="how to execute playbooks: an ansible-playbook "
+                             "process per run, or in-process, avoiding "
+                             "interpreter startup and the import of Ansible "
+                             "for each run. The inventory is loaded afresh "
+                             "for every run. "
+                             "(default=$%s or %s)" %
+                             (ENGINE_ENV, DEFAULT_ENGINE))
     parser.add_argument("-e", "--extra-vars", metavar="EXTRA_VARS",
                         action="append",
                         help="set additional variables as key=value or "
@@ -64,6 +116,8 @@ def add_args(parser):
                         action="store_true",
                         help="only print names of tasks, don't run them, "
                              "note this has no affect on lordoftheflies-ansible.")
+    facts.add_args(parser)
+    retry.add_args(parser)
 
 
 def _get_inventory_path(parsed_args):
@@ -76,52 +130,83 @@ def _get_inventory_path(parsed_args):
 
 def _validate_args(parsed_args, playbooks):
     """Validate JavaRole Ansible arguments."""
-    result = utils.is_readable_dir(parsed_args.config_path)
-    if not result["result"]:
-        LOG.error("JavaRole configuration path %s is invalid: %s",
-                  parsed_args.config_path, result["message"])
+    checks = [
+        ("JavaRole configuration path", parsed_args.config_path, "dir"),
+        ("JavaRole inventory", _get_inventory_path(parsed_args), "dir"),
+    ]
+    checks += [("JavaRole playbook", playbook, "file")
+               for playbook in playbooks]
+    errors = utils.validate_paths(checks)
+    if errors:
+        LOG.error("Invalid JavaRole arguments:\n%s", "\n".join(errors))
         sys.exit(1)
 
-    inventory = _get_inventory_path(parsed_args)
-    result = utils.is_readable_dir(inventory)
-    if not result["result"]:
-        LOG.error("JavaRole inventory %s is invalid: %s",
-                  inventory, result["message"])
-        sys.exit(1)
-
-    for playbook in playbooks:
-        result = utils.is_readable_file(playbook)
-        if not result["result"]:
-            LOG.error("JavaRole playbook %s is invalid: %s",
-                      playbook, result["message"])
-            sys.exit(1)
-
 
 def _get_vars_files(config_path):
     """Return a list of JavaRole Ansible configuration variable files."""
     vars_files = []
     for vars_file in os.listdir(config_path):
         abs_path = os.path.join(config_path, vars_file)
-        if utils.is_readable_file(abs_path):
+        if utils.is_readable_file(abs_path)["result"]:
             root, ext = os.path.splitext(vars_file)
             if ext in (".yml", ".yaml", ".json"):
                 vars_files.append(abs_path)
     return vars_files
 
 
+def compile_vars(parsed_args):
+    """Compile JavaRole configuration variable files into bundles.
+
+    :returns: A list of files to pass to Ansible in place of the variable
+              files.
+    """
+    result = utils.is_readable_dir(parsed_args.config_path)
+    if not result["result"]:
+        LOG.error("JavaRole configuration path %s is invalid: %s",
+                  parsed_args.config_path, result["message"])
+        sys.exit(1)
+    vars_files = _get_vars_files(parsed_args.config_path)
+    return config.compile_vars(parsed_args.config_path, vars_files)
+
+
+def compile_inventory(parsed_args):
+    """Compile the JavaRole inventory into a single inventory file.
+
+    :returns: The path to the compiled inventory.
+    """
+    _validate_args(parsed_args, [])
+    inventory_path = _get_inventory_path(parsed_args)
+    compiled_path = inventory.compile_inventory(parsed_args.config_path,
+                                                inventory_path)
+    if not compiled_path:
+        LOG.error("JavaRole inventory %s could not be compiled",
+                  inventory_path)
+        sys.exit(1)
+    return compiled_path
+
+
 def build_args(parsed_args, playbooks,
                extra_vars=None, limit=None, tags=None, verbose_level=None,
-               check=None):
-    """Build arguments required for running Ansible playbooks."""
+               check=None, source_inventory=False):
+    """Build arguments required for running Ansible playbooks.
+
+    :param source_inventory: Whether to use the source inventory rather than
+                             a compiled one. This is required by runs which
+                             modify the inventory and then refresh it.
+    """
     cmd = ["ansible-playbook"]
     if verbose_level:
         cmd += ["-" + "v" * verbose_level]
     if parsed_args.list_tasks:
         cmd += ["--list-tasks"]
     cmd += vault.build_args(parsed_args)
-    inventory = _get_inventory_path(parsed_args)
-    cmd += ["--inventory", inventory]
     vars_files = _get_vars_files(parsed_args.config_path)
+    inventory_path = _get_inventory_path(parsed_args)
+    if not source_inventory:
+        inventory_path = inventory.get_inventory(
+            parsed_args.config_path, inventory_path, vars_files=vars_files)
+    cmd += ["--inventory", inventory_path]
+    vars_files = config.get_vars_files(parsed_args.config_path, vars_files)
     for vars_file in vars_files:
         cmd += ["-e", "@%s" % vars_file]
     if parsed_args.extra_vars:
@@ -135,7 +220,10 @@ def build_args(parsed_args, playbooks,
     if check or (parsed_args.check and check is None):
         cmd += ["--check"]
     if parsed_args.limit or limit:
-        limits = [l for l in [parsed_args.limit, limit] if l]
+        limits = [pattern for pattern in [parsed_args.limit, limit]
+                  if pattern]
+        # A limit file may only be the first element of a host pattern.
+        limits.sort(key=lambda pattern: not pattern.startswith("@"))
         cmd += ["--limit", ":&".join(limits)]
     if parsed_args.skip_tags:
         cmd += ["--skip-tags", parsed_args.skip_tags]
@@ -146,20 +234,112 @@ def build_args(parsed_args, playbooks,
     return cmd
 
 
+def build_env(parsed_args):
+    """Build environment variables required for running Ansible playbooks.
+
+    :returns: A dict of environment variables to set in addition to those of
+              the java_role process.
+    """
+    env = facts.build_env(parsed_args)
+    env.update(retry.build_env(parsed_args))
+    return env
+
+
+def _run_playbooks(parsed_args, cmd, quiet, env):
+    """Run ansible-playbook, returning its exit code."""
+    if parsed_args.engine == "inprocess":
+        return engine.run_playbooks(cmd, quiet=quiet, env=env)
+    try:
+        utils.run_command(cmd, quiet=quiet, env=dict(os.environ, **env))
+    except subprocess.CalledProcessError as e:
+        return e.returncode
+    return 0
+
+
+def _join_limits(*limits):
+    return ":&".join(pattern for pattern in limits if pattern) or None
+
+
+def _get_retry_failed_limit(parsed_args):
+    """Return a host pattern of the hosts to retry, or None.
+
+    With --retry-failed, the recorded failed hosts are resolved once per
+    command and stored in parsed_args, so that every playbook run by the
+    command is limited to the same hosts. Exits if no hosts are recorded.
+    """
+    if not getattr(parsed_args, "retry_failed", False):
+        return None
+    if not getattr(parsed_args, "retry_failed_limit", None):
+        failed_limit = retry.get_failed_hosts_limit(parsed_args.config_path)
+        if not failed_limit:
+            LOG.error("No failed hosts have been recorded to retry")
+            sys.exit(1)
+        parsed_args.retry_failed_limit = failed_limit
+    return parsed_args.retry_failed_limit
+
+
+def clear_failed_hosts(parsed_args):
+    """Clear the recorded failed hosts once a command has succeeded."""
+    retry.record_failed_hosts(parsed_args.config_path, [])
+
+
 def run_playbooks(parsed_args, playbooks,
                   extra_vars=None, limit=None, tags=None, quiet=False,
-                  verbose_level=None, check=None):
-    """Run a JavaRole Ansible playbook."""
+                  verbose_level=None, check=None, retry_hosts=True,
+                  source_inventory=False):
+    """Run a JavaRole Ansible playbook.
+
+    The hosts which fail or are unreachable are recorded, and may be retried
+    by a later command with --retry-failed. The recorded hosts are cleared
+    by clear_failed_hosts once the whole command has succeeded. With
+    --retries, a failed run is retried on those hosts after a delay which
+    doubles on each attempt.
+
+    :param retry_hosts: Whether to apply --retry-failed and --retries, and
+                        record failed hosts. This should be False for
+                        playbooks which gather information rather than
+                        change hosts, such as configuration dumps.
+    :param source_inventory: Whether to use the source inventory rather than
+                             a compiled one.
+    """
     _validate_args(parsed_args, playbooks)
-    cmd = build_args(parsed_args, playbooks,
-                     extra_vars=extra_vars, limit=limit, tags=tags,
-                     verbose_level=verbose_level, check=check)
-    try:
-        utils.run_command(cmd, quiet=quiet)
-    except subprocess.CalledProcessError as e:
-        LOG.error("JavaRole playbook(s) %s exited %d",
-                  ", ".join(playbooks), e.returncode)
-        sys.exit(e.returncode)
+    config_path = parsed_args.config_path
+    retries = getattr(parsed_args, "retries", 0)
+    failed_limit = None
+    if retry_hosts:
+        failed_limit = _get_retry_failed_limit(parsed_args)
+    env = build_env(parsed_args)
+    # Discard stale retry files of these playbooks.
+    retry.collect_failed_hosts(config_path, playbooks)
+    attempt = 0
+    while True:
+        cmd = build_args(parsed_args, playbooks,
+                         extra_vars=extra_vars,
+                         limit=_join_limits(failed_limit, limit), tags=tags,
+                         verbose_level=verbose_level, check=check,
+                         source_inventory=source_inventory)
+        returncode = _run_playbooks(parsed_args, cmd, quiet, env)
+        if not returncode:
+            return
+        hosts = retry.collect_failed_hosts(config_path, playbooks)
+        if not retry_hosts:
+            break
+        retry.record_failed_hosts(config_path, hosts)
+        failed_limit = retry.get_failed_hosts_limit(config_path)
+        if not failed_limit or attempt >= retries:
+            break
+        delay = retry.get_delay(parsed_args, attempt)
+        attempt += 1
+        LOG.warning("JavaRole playbook(s) %s failed on %s; retrying on "
+                    "these hosts in %.1fs (%d/%d)", ", ".join(playbooks),
+                    ", ".join(hosts), delay, attempt, retries)
+        time.sleep(delay)
+    LOG.error("JavaRole playbook(s) %s exited %d",
+              ", ".join(playbooks), returncode)
+    if hosts and retry_hosts:
+        LOG.error("Failed or unreachable hosts: %s. Use --retry-failed to "
+                  "run on these hosts only", ", ".join(hosts))
+    sys.exit(returncode)
 
 
 def run_playbook(parsed_args, playbook, *args, **kwargs):
@@ -167,8 +347,284 @@ def run_playbook(parsed_args, playbook, *args, **kwargs):
     return run_playbooks(parsed_args, [playbook], *args, **kwargs)
 
 
+def run_playbook_graph(parsed_args, graph, workers=1, extra_vars=None,
+                       limit=None, tags=None, quiet=False, verbose_level=None,
+                       check=None):
+    """Run JavaRole Ansible playbooks concurrently, respecting dependencies.
+
+    Each playbook is run in a separate ansible-playbook process once all of
+    the playbooks it depends on have completed successfully. At most
+    `workers` playbooks are run at once. The output of each playbook is
+    written in one piece once it completes. If a playbook fails, no playbook
+    that depends on it is started, and the command exits once running
+    playbooks have completed. The critical path through the graph is logged
+    at the end.
+
+    :param graph: a list of (playbook, dependencies) tuples, where
+                  dependencies is a list of playbooks in the graph.
+    :param workers: maximum number of playbooks to run concurrently.
+    """
+    dependencies = collections.OrderedDict(graph)
+    _validate_args(parsed_args, list(dependencies))
+    limit = _join_limits(_get_retry_failed_limit(parsed_args), limit)
+    retry.collect_failed_hosts(parsed_args.config_path, list(dependencies))
+    if parsed_args.engine == "inprocess":
+        LOG.debug("Concurrent playbooks are run using subprocesses")
+    env = dict(os.environ, **build_env(parsed_args))
+    output_lock = threading.Lock()
+
+    def _run(playbook):
+        cmd = build_args(parsed_args, [playbook], extra_vars=extra_vars,
+                         limit=limit, tags=tags, verbose_level=verbose_level,
+                         check=check)
+        start = time.time()
+        returncode = 0
+        output = None
+        try:
+            if quiet:
+                utils.run_command(cmd, quiet=True, env=env)
+            else:
+                output = utils.run_command(cmd, check_output=True,
+                                           stderr=subprocess.STDOUT, env=env)
+        except subprocess.CalledProcessError as e:
+            returncode = e.returncode
+            output = e.output
+        duration = time.time() - start
+        if output:
+            if isinstance(output, bytes):
+                output = output.decode("utf-8", "replace")
+            with output_lock:
+                sys.stdout.write("==> %s (%.1fs) <==\n" %
+                                 (playbook, duration))
+                sys.stdout.write(output)
+                sys.stdout.flush()
+        return returncode, duration
+
+    pending = collections.OrderedDict(dependencies)
+    durations = {}
+    failures = []
+    running = {}
+    start = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        while pending or running:
+            for playbook, deps in list(pending.items()):
+                if len(running) >= workers:
+                    break
+                if all(dep in durations for dep in deps):
+                    del pending[playbook]
+                    LOG.debug("Starting JavaRole playbook %s", playbook)
+                    running[pool.submit(_run, playbook)] = playbook
+            if not running:
+                break
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                playbook = running.pop(future)
+                returncode, duration = future.result()
+                if returncode:
+                    LOG.error("JavaRole playbook %s exited %d",
+                              playbook, returncode)
+                    failures.append((playbook, returncode))
+                else:
+                    durations[playbook] = duration
+
+    elapsed = time.time() - start
+    path, path_duration = _get_critical_path(dependencies, durations)
+    if path:
+        LOG.info("Critical path: %s (%.1fs of %.1fs elapsed)",
+                 " -> ".join(path), path_duration, elapsed)
+    if failures:
+        if pending:
+            LOG.error("Not running JavaRole playbook(s) %s due to failed "
+                      "dependencies", ", ".join(pending))
+        hosts = retry.collect_failed_hosts(
+            parsed_args.config_path, [playbook for playbook, _ in failures])
+        retry.record_failed_hosts(parsed_args.config_path, hosts)
+        if hosts:
+            LOG.error("Failed or unreachable hosts: %s. Use --retry-failed "
+                      "to run on these hosts only", ", ".join(hosts))
+        sys.exit(failures[0][1])
+    if pending:
+        LOG.error("Unable to run JavaRole playbook(s) %s: dependencies "
+                  "cannot be satisfied", ", ".join(pending))
+        sys.exit(1)
+
+
+def _get_critical_path(dependencies, durations):
+    """Return the longest chain of completed playbooks, and its duration.
+
+    :param dependencies: a dict mapping playbooks to their dependencies.
+    :param durations: a dict mapping completed playbooks to their durations.
+    """
+    chains = {}
+
+    def _chain(playbook):
+        if playbook not in chains:
+            best = ([], 0.0)
+            for dep in dependencies[playbook]:
+                if dep in durations:
+                    candidate = _chain(dep)
+                    if candidate[1] > best[1]:
+                        best = candidate
+            chains[playbook] = (best[0] + [playbook],
+                                best[1] + durations[playbook])
+        return chains[playbook]
+
+    critical = ([], 0.0)
+    for playbook in durations:
+        candidate = _chain(playbook)
+        if candidate[1] > critical[1]:
+            critical = candidate
+    return critical
+
+
+class PlaybookBatch(object):
+    """Fuse consecutive compatible playbook runs into a single run.
+
+    Runs are compatible if they differ only in their playbooks. Compatible
+    runs are executed as a single ansible-playbook invocation of all of their
+    playbooks in order, with the inventory refreshed between runs, since
+    earlier playbooks may modify it. This avoids repeated Ansible startup,
+    SSH connection setup and fact gathering.
+
+    Each playbook keeps its own directory. If a host fails, Ansible runs
+    the remaining plays of the current playbook on the other hosts, but
+    does not start the next playbook, so later runs are not started, as
+    with separate runs.
+    """
+
+    def __init__(self, parsed_args):
+        self.parsed_args = parsed_args
+        self._runs = []
+        self._kwargs = None
+
+    def add(self, parsed_args, playbooks, **kwargs):
+        """Add a playbook run to the batch.
+
+        Accepts the same arguments as run_playbooks. Pending runs are flushed
+        first if they are not compatible with this one.
+        """
+        if self._runs and kwargs != self._kwargs:
+            self.flush()
+        self._runs.append(list(playbooks))
+        self._kwargs = kwargs
+
+    def flush(self):
+        """Run all pending playbook runs."""
+        runs, self._runs = self._runs, []
+        if not runs:
+            return
+        if len(runs) == 1:
+            run_playbooks(self.parsed_args, runs[0], **self._kwargs)
+            return
+        refresh_dir = tempfile.mkdtemp()
+        try:
+            refresh = os.path.join(refresh_dir, "refresh-inventory.yml")
+            utils.write_yaml_file(refresh, REFRESH_INVENTORY_PLAYBOOK)
+            playbooks = list(runs[0])
+            for run in runs[1:]:
+                playbooks += [refresh] + run
+            LOG.debug("Running playbooks %s in a single batch",
+                      ", ".join(sum(runs, [])))
+            # A compiled inventory would not reflect changes made to the
+            # source inventory when it is refreshed.
+            run_playbooks(self.parsed_args, playbooks, source_inventory=True,
+                          **self._kwargs)
+        finally:
+            shutil.rmtree(refresh_dir)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+
 def config_dump(parsed_args, host=None, hosts=None, var_name=None,
-                facts=None, extra_vars=None, tags=None, verbose_level=None):
+                facts=None, extra_vars=None, tags=None, verbose_level=None,
+                cache=False, var_names=None):
+    """Dump JavaRole Ansible host variables.
+
+    :param host: Name of a single host to dump. If specified, the variables
+                 of that host are returned rather than a dict of hosts.
+    :param hosts: Host pattern of hosts to dump.
+    :param var_name: Name of a single variable to dump.
+    :param facts: Whether to gather and dump host facts.
+    :param cache: Whether to use cached results, and only dump hosts whose
+                  inputs have changed. Dumps which include facts are never
+                  cached.
+    :param var_names: List of variable projections to dump, such as
+                      "var.key[0]". Each host's result is a dict mapping
+                      projections to their values. Projections which do not
+                      resolve are omitted.
+    :returns: A dict mapping host names to their variables, or the variables
+              of a single host if host is specified.
+    """
+    _validate_projections(var_names)
+    if cache and not facts:
+        hostvars = _cached_config_dump(parsed_args, host=host, hosts=hosts,
+                                       var_name=var_name, var_names=var_names,
+                                       extra_vars=extra_vars, tags=tags,
+                                       verbose_level=verbose_level)
+    else:
+        hostvars = _run_config_dump(parsed_args, host=host, hosts=hosts,
+                                    var_name=var_name, var_names=var_names,
+                                    facts=facts, extra_vars=extra_vars,
+                                    tags=tags, verbose_level=verbose_level)
+    if host:
+        return next(iter(hostvars.values()), {})
+    return hostvars
+
+
+def _validate_projections(var_names):
+    """Validate a list of variable projections, exiting if any are invalid."""
+    for var_name in var_names or []:
+        try:
+            utils.parse_projection(var_name)
+        except ValueError as e:
+            LOG.error("%s", e)
+            sys.exit(1)
+
+
+def _get_projection_roots(var_names):
+    """Return the names of the variables referenced by some projections."""
+    roots = []
+    for var_name in var_names:
+        root = utils.parse_projection(var_name)[0]
+        if root not in roots:
+            roots.append(root)
+    return roots
+
+
+def _run_config_dump(parsed_args, **kwargs):
+    """Run the configuration dump playbook.
+
+    :returns: A dict mapping host names to their variables.
+    """
+    return dict(config_dump_iter(parsed_args, **kwargs))
+
+
+def config_dump_iter(parsed_args, host=None, hosts=None, var_name=None,
+                     facts=None, extra_vars=None, tags=None,
+                     verbose_level=None, var_names=None):
+    """Dump JavaRole Ansible host variables, one host at a time.
+
+    Each host's dump file is parsed only when it is reached, so that memory
+    usage does not grow with the number of hosts. Results are not cached.
+
+    :returns: An iterator over tuples of host name and host variables.
+    """
+    engine_name = getattr(parsed_args, "engine", DEFAULT_ENGINE)
+    if engine_name == "inprocess" and not facts:
+        hostvars = _run_config_dump_inprocess(parsed_args, host=host,
+                                              hosts=hosts, var_name=var_name,
+                                              var_names=var_names,
+                                              extra_vars=extra_vars,
+                                              verbose_level=verbose_level)
+        for item in sorted(hostvars.items()):
+            yield item
+        return
     dump_dir = tempfile.mkdtemp()
     try:
         if not extra_vars:
@@ -181,23 +637,238 @@ def config_dump(parsed_args, host=None, hosts=None, var_name=None,
         if facts is not None:
             extra_vars["dump_facts"] = facts
         # Don't use check mode for configuration dumps as we won't get any
-        # results back.
-        run_playbook(parsed_args, "ansible/dump-config.yml",
+        # results back. Configuration dumps are not limited to failed hosts,
+        # since their results may be cached.
+        run_playbook(parsed_args, CONFIG_DUMP_PLAYBOOK,
                      extra_vars=extra_vars, tags=tags, quiet=True,
-                     verbose_level=verbose_level, check=False)
-        hostvars = {}
-        for path in os.listdir(dump_dir):
+                     verbose_level=verbose_level, check=False,
+                     retry_hosts=False)
+        paths = []
+        for path in sorted(os.listdir(dump_dir)):
             LOG.debug("Found dump file %s", path)
-            inventory_hostname, ext = os.path.splitext(path)
-            if ext == ".yml":
-                hvars = utils.read_yaml_file(os.path.join(dump_dir, path))
-                if host:
-                    return hvars
-                else:
-                    hostvars[inventory_hostname] = hvars
+            if os.path.splitext(path)[1] in (".yml", ".json"):
+                paths.append(os.path.join(dump_dir, path))
             else:
                 LOG.warning("Unexpected extension on config dump file %s",
                             path)
-        return hostvars
+        for path, hvars in _parse_dump_files(paths):
+            inventory_hostname = os.path.splitext(os.path.basename(path))[0]
+            if var_names and not var_name:
+                hvars = utils.project_vars(hvars, var_names)
+            yield inventory_hostname, hvars
     finally:
         shutil.rmtree(dump_dir)
+
+
+def _parse_dump_file(path):
+    """Parse a YAML or JSON configuration dump file."""
+    if path.endswith(".json"):
+        return utils.read_json_file(path)
+    return utils.read_yaml_file(path)
+
+
+def _parse_dump_files(paths, workers=None):
+    """Parse configuration dump files, in a process pool if there are many.
+
+    At most two files per worker are parsed ahead of the consumer, to bound
+    memory usage.
+
+    :param paths: List of paths to dump files.
+    :param workers: Number of worker processes. Default is the number of
+                    CPUs.
+    :returns: An iterator over tuples of path and parsed content, in the
+              order of paths.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers < 2 or len(paths) < CONFIG_DUMP_POOL_THRESHOLD:
+        for path in paths:
+            yield path, _parse_dump_file(path)
+        return
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        pending = collections.deque()
+        for path in paths:
+            pending.append((path, executor.submit(_parse_dump_file, path)))
+            if len(pending) >= workers * 2:
+                path, future = pending.popleft()
+                yield path, future.result()
+        while pending:
+            path, future = pending.popleft()
+            yield path, future.result()
+
+
+def _run_config_dump_inprocess(parsed_args, host=None, hosts=None,
+                               var_name=None, var_names=None,
+                               extra_vars=None, verbose_level=None):
+    """Evaluate host variables in-process, without running a playbook.
+
+    :returns: A dict mapping host names to their variables.
+    """
+    _validate_args(parsed_args, [])
+    # The playbook is not run, but is required to parse the arguments.
+    cmd = build_args(parsed_args, [CONFIG_DUMP_PLAYBOOK],
+                     extra_vars=extra_vars, verbose_level=verbose_level)
+    roots = _get_projection_roots(var_names) if var_names else None
+    try:
+        hostvars = engine.dump_hostvars(cmd, hosts=host or hosts or "all",
+                                        var_name=var_name, var_names=roots,
+                                        env=build_env(parsed_args))
+    except RuntimeError as e:
+        LOG.error("%s", e)
+        sys.exit(1)
+    if var_names and not var_name:
+        hostvars = dict((h, utils.project_vars(hvars, var_names))
+                        for h, hvars in hostvars.items())
+    return hostvars
+
+
+def _get_config_dump_inputs(parsed_args):
+    """Return the paths to files which affect a configuration dump.
+
+    These are the inventory, the configuration variable files, and the
+    variables and playbook shipped with JavaRole.
+    """
+    inputs = [os.path.abspath(_get_inventory_path(parsed_args))]
+    inputs += sorted(_get_vars_files(parsed_args.config_path))
+    inputs += [os.path.abspath(os.path.join("ansible", "group_vars")),
+               os.path.abspath(CONFIG_DUMP_PLAYBOOK)]
+    return inputs
+
+
+def _has_vault_content(paths):
+    """Return whether any file under some paths contains vault content."""
+    for path in paths:
+        if os.path.isfile(path):
+            files = [path]
+        else:
+            files = [os.path.join(root, name)
+                     for root, _, names in os.walk(path) for name in names]
+        for file_path in files:
+            try:
+                content = utils.read_file(file_path, "rb")
+            except IOError:
+                continue
+            if vault.VAULT_HEADER in content:
+                LOG.debug("Found vault-encrypted content in %s", file_path)
+                return True
+    return False
+
+
+def _get_java_role_version():
+    """Return the installed version of JavaRole, or None."""
+    try:
+        from importlib import metadata
+    except ImportError:
+        # importlib.metadata is only available from Python 3.8.
+        import pkg_resources
+        try:
+            return pkg_resources.get_distribution("java_role").version
+        except pkg_resources.DistributionNotFound:
+            return None
+    try:
+        return metadata.version("java_role")
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def _get_config_dump_fingerprints(parsed_args, extra_vars):
+    """Return fingerprints of the inputs to a configuration dump.
+
+    Host variable files are fingerprinted separately for each host, so that
+    a change to them only invalidates the dump of that host.
+
+    :returns: A tuple of a fingerprint of inputs common to all hosts, and a
+              function which returns the fingerprint of a host's inputs.
+    """
+    inventory_path = _get_inventory_path(parsed_args)
+    common = utils.hash_paths(_get_config_dump_inputs(parsed_args),
+                              exclude=["host_vars"])
+    vault_args = [getattr(parsed_args, "vault_password_file", None),
+                  getattr(parsed_args, "ask_vault_pass", False)]
+    extra = json.dumps([common, parsed_args.extra_vars, extra_vars,
+                        vault_args, _get_java_role_version()],
+                       sort_keys=True)
+    common = hashlib.sha256(extra.encode("utf-8")).hexdigest()
+    host_vars_path = os.path.join(inventory_path, "host_vars")
+
+    def _host_fingerprint(host):
+        paths = [os.path.join(host_vars_path, host + ext)
+                 for ext in ("", ".yml", ".yaml", ".json")]
+        return utils.hash_paths([p for p in paths if os.path.exists(p)])
+
+    return common, _host_fingerprint
+
+
+def _cached_config_dump(parsed_args, host=None, hosts=None, var_name=None,
+                        var_names=None, extra_vars=None, tags=None,
+                        verbose_level=None):
+    """Dump configuration, reusing cached results where inputs are unchanged.
+
+    :returns: A dict mapping host names to their variables.
+    """
+    cache_dir = None
+    if _has_vault_content(_get_config_dump_inputs(parsed_args)):
+        # Never write decrypted secrets to the cache, and remove any which
+        # were written before the configuration was encrypted.
+        LOG.debug("Not caching configuration dump of vault-encrypted "
+                  "configuration")
+        shutil.rmtree(os.path.join(parsed_args.config_path, ".cache",
+                                   "config-dump"), ignore_errors=True)
+    else:
+        cache_dir = utils.get_cache_dir(parsed_args.config_path,
+                                        "config-dump")
+    if not cache_dir:
+        return _run_config_dump(parsed_args, host=host, hosts=hosts,
+                                var_name=var_name, var_names=var_names,
+                                extra_vars=extra_vars, tags=tags,
+                                verbose_level=verbose_level)
+    key = json.dumps([_get_inventory_path(parsed_args), host, hosts,
+                      var_name, var_names, tags, parsed_args.limit],
+                     sort_keys=True)
+    key = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    cache_file = os.path.join(cache_dir, key + ".json")
+    common, host_fingerprint = _get_config_dump_fingerprints(parsed_args,
+                                                             extra_vars)
+    entry = None
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file) as f:
+                entry = json.load(f)
+        except (IOError, ValueError) as e:
+            LOG.warning("Ignoring invalid config dump cache %s: %s",
+                        cache_file, e)
+    if entry and entry["fingerprint"] == common:
+        changed = sorted(h for h, cached in entry["hosts"].items()
+                         if cached["fingerprint"] != host_fingerprint(h))
+        if changed:
+            LOG.debug("Dumping configuration of changed hosts %s",
+                      ", ".join(changed))
+            hostvars = _run_config_dump(
+                parsed_args, hosts=",".join(changed), var_name=var_name,
+                var_names=var_names, extra_vars=extra_vars, tags=tags,
+                verbose_level=verbose_level)
+            for h in changed:
+                entry["hosts"].pop(h)
+            for h, hvars in hostvars.items():
+                entry["hosts"][h] = {"fingerprint": host_fingerprint(h),
+                                     "vars": hvars}
+        else:
+            LOG.debug("Using cached configuration dump %s", cache_file)
+    else:
+        hostvars = _run_config_dump(parsed_args, host=host, hosts=hosts,
+                                    var_name=var_name, var_names=var_names,
+                                    extra_vars=extra_vars, tags=tags,
+                                    verbose_level=verbose_level)
+        entry = {
+            "fingerprint": common,
+            "hosts": dict((h, {"fingerprint": host_fingerprint(h),
+                               "vars": hvars})
+                          for h, hvars in hostvars.items()),
+        }
+        changed = True
+    if changed:
+        try:
+            utils.write_file_atomic(cache_file, json.dumps(entry), mode=0o600)
+        except (IOError, OSError, TypeError, ValueError) as e:
+            LOG.warning("Failed to write config dump cache %s: %s",
+                        cache_file, e)
+    return dict((h, cached["vars"]) for h, cached in entry["hosts"].items())
@@ -12,22 +12,137 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import contextlib
+import getpass
 import json
+import os
 import sys
+import time
 
 from cliff.command import Command
 
 from java_role import ansible
+from java_role import facts
 from java_role import lordoftheflies_ansible
+from java_role import runbook
+from java_role import stages
 from java_role import utils
 from java_role import vault
 
 
+# Dependencies between host configuration playbooks. Playbooks not listed
+# here depend on all playbooks that precede them.
+PLAYBOOK_DEPENDENCIES = {
+    "ip-allocation": [],
+    "ssh-known-host": ["ip-allocation"],
+    "java_role-ansible-user": ["ssh-known-host"],
+    "java_role-target-venv": ["java_role-ansible-user"],
+    "wipe-disks": ["java_role-target-venv"],
+    "users": ["java_role-target-venv"],
+    "yum": ["java_role-target-venv"],
+    # Package installation holds the package manager lock.
+    "dev-tools": ["yum"],
+    "sysctl": ["java_role-target-venv"],
+    "ip-routing": ["network"],
+    "snat": ["network"],
+    "disable-glean": ["network"],
+    "ntp": ["dev-tools"],
+    "lvm": ["ntp", "wipe-disks"],
+    "seed-hypervisor-libvirt-host": ["network", "ntp"],
+}
+
+# Playbooks which may reboot hosts or interrupt their connectivity. No other
+# playbook runs concurrently with these: they depend on all playbooks before
+# them, and all playbooks after them depend on them.
+PLAYBOOK_BARRIERS = ("disable-selinux", "network")
+
+
 def _build_playbook_list(*playbooks):
     """Return a list of names of playbook files given their basenames."""
     return ["ansible/%s.yml" % playbook for playbook in playbooks]
 
 
+def _build_playbook_graph(*playbooks):
+    """Return a playbook dependency graph given playbook basenames.
+
+    The graph is a list of (playbook, dependencies) tuples, suitable for use
+    with java_role.ansible.run_playbook_graph. Dependencies on playbooks not
+    in the list are ignored. Barrier playbooks depend on all playbooks before
+    them, and playbooks after a barrier depend on it.
+    """
+    graph = []
+    barrier = 0
+    for i, playbook in enumerate(playbooks):
+        if playbook in PLAYBOOK_BARRIERS:
+            deps = playbooks[:i]
+        else:
+            deps = PLAYBOOK_DEPENDENCIES.get(playbook, playbooks[:i])
+        # Dependencies before the last barrier are implied by it.
+        deps = [dep for dep in deps if dep in playbooks[barrier:i]]
+        if barrier:
+            deps.insert(0, playbooks[barrier - 1])
+        graph.append((_build_playbook_list(playbook)[0],
+                      _build_playbook_list(*deps)))
+        if playbook in PLAYBOOK_BARRIERS:
+            barrier = i + 1
+    return graph
+
+
+def _write_hostvars_stream(hostvars, stream, output_format="json"):
+    """Write host variables to a stream one host at a time.
+
+    :param hostvars: An iterator over tuples of host name and host variables.
+    :param stream: File-like object to write to.
+    :param output_format: "ndjson" to write one JSON object per host per
+                          line, or "json" to write a single JSON object
+                          mapping host names to their variables.
+    """
+    if output_format == "ndjson":
+        for host, hvars in hostvars:
+            stream.write(json.dumps({host: hvars}, sort_keys=True))
+            stream.write("\n")
+            stream.flush()
+        return
+    stream.write("{")
+    separator = "\n"
+    for host, hvars in hostvars:
+        hvars = json.dumps(hvars, sort_keys=True, indent=4)
+        stream.write("%s    %s: %s" % (separator, json.dumps(host),
+                                       hvars.replace("\n", "\n    ")))
+        stream.flush()
+        separator = ",\n"
+    stream.write("\n}" if separator != "\n" else "}")
+
+
+def _get_var_name_args(var_names):
+    """Return config dump arguments for a list of --var-name arguments.
+
+    A single plain variable name is dumped as its value, for compatibility.
+    Otherwise, a list of projections is dumped.
+
+    :returns: A tuple of var_name and var_names.
+    """
+    if not var_names:
+        return None, None
+    if len(var_names) == 1:
+        try:
+            if utils.parse_projection(var_names[0]) == var_names:
+                return var_names[0], None
+        except ValueError:
+            # Invalid projections are reported by config_dump.
+            pass
+    return None, var_names
+
+
+def _add_playbook_workers_arg(group):
+    """Add an argument for the number of concurrent playbook workers."""
+    group.add_argument("--playbook-workers", type=int, default=1,
+                       metavar="WORKERS",
+                       help="maximum number of independent host "
+                            "configuration playbooks to run concurrently "
+                            "(default 1)")
+
+
 class VaultMixin(object):
     """Mixin class for commands requiring Ansible vault."""
 
@@ -50,6 +165,15 @@ class JavaRoleAnsibleMixin(object):
     def add_java_role_ansible_args(self, group):
         ansible.add_args(group)
 
+    def run(self, parsed_args):
+        self._ran_playbooks = False
+        result = super(JavaRoleAnsibleMixin, self).run(parsed_args)
+        # Failed hosts are only cleared once the whole command has
+        # succeeded, so that --retry-failed applies to all of its playbooks.
+        if self._ran_playbooks:
+            ansible.clear_failed_hosts(parsed_args)
+        return result
+
     def _get_verbosity_args(self):
         """Add quietness and verbosity level arguments."""
         # Cliff's default verbosity level is 1, 0 means quiet.
@@ -63,16 +187,106 @@ class JavaRoleAnsibleMixin(object):
 
     def run_java_role_playbooks(self, *args, **kwargs):
         kwargs.update(self._get_verbosity_args())
+        self._ran_playbooks = True
+        batch = getattr(self, "_playbook_batch", None)
+        if batch:
+            return batch.add(*args, **kwargs)
         return ansible.run_playbooks(*args, **kwargs)
 
-    def run_java_role_playbook(self, *args, **kwargs):
+    def run_java_role_playbook(self, parsed_args, playbook, *args, **kwargs):
+        return self.run_java_role_playbooks(parsed_args, [playbook], *args,
+                                            **kwargs)
+
+    @contextlib.contextmanager
+    def java_role_playbook_batch(self, parsed_args):
+        """Fuse compatible playbook runs made within the context.
+
+        See java_role.ansible.PlaybookBatch.
+        """
+        with ansible.PlaybookBatch(parsed_args) as batch:
+            self._playbook_batch = batch
+            try:
+                yield batch
+            finally:
+                self._playbook_batch = None
+
+    def run_java_role_playbook_graph(self, *args, **kwargs):
         kwargs.update(self._get_verbosity_args())
-        return ansible.run_playbook(*args, **kwargs)
+        self._ran_playbooks = True
+        return ansible.run_playbook_graph(*args, **kwargs)
+
+    def run_java_role_host_playbooks(self, parsed_args, playbooks, **kwargs):
+        """Run host configuration playbooks given their basenames.
+
+        If more than one playbook worker was requested, independent playbooks
+        are run concurrently.
+        """
+        workers = getattr(parsed_args, "playbook_workers", 1)
+        if workers > 1:
+            graph = _build_playbook_graph(*playbooks)
+            return self.run_java_role_playbook_graph(parsed_args, graph,
+                                                     workers=workers,
+                                                     **kwargs)
+        playbooks = _build_playbook_list(*playbooks)
+        return self.run_java_role_playbooks(parsed_args, playbooks, **kwargs)
 
     def run_java_role_config_dump(self, *args, **kwargs):
         kwargs.update(self._get_verbosity_args())
+        kwargs.setdefault("cache",
+                          getattr(args[0], "config_dump_cache", False))
         return ansible.config_dump(*args, **kwargs)
 
+    def run_java_role_config_dump_iter(self, *args, **kwargs):
+        kwargs.update(self._get_verbosity_args())
+        return ansible.config_dump_iter(*args, **kwargs)
+
+
+class StageMixin(object):
+    """Mixin class for commands made up of stages which may be resumed.
+
+    Stages which complete are recorded along with a fingerprint of the
+    command's inputs. With --resume, stages which completed in a previous
+    run with identical inputs are skipped.
+    """
+
+    def get_parser(self, prog_name):
+        parser = super(StageMixin, self).get_parser(prog_name)
+        group = parser.add_argument_group("Stages")
+        group.add_argument("--resume", action="store_true",
+                           help="skip stages which completed in a previous "
+                                "run of the command with identical inputs")
+        return parser
+
+    def start_stages(self, parsed_args):
+        """Load the state of stages of this command."""
+        self._stage_file = stages.get_state_file(parsed_args.config_path,
+                                                 self.__class__.__name__)
+        self._stage_fingerprint = None
+        self._completed_stages = []
+        if self._stage_file:
+            self._stage_fingerprint = stages.get_fingerprint(parsed_args)
+            if parsed_args.resume:
+                self._completed_stages = stages.read_completed(
+                    self._stage_file, self._stage_fingerprint)
+        if not parsed_args.resume:
+            stages.clear(self._stage_file)
+
+    def run_stage(self, name, func, *args, **kwargs):
+        """Run a stage, unless it completed in a previous run."""
+        if name in self._completed_stages:
+            self.app.LOG.info("Skipping stage %s, which completed in a "
+                              "previous run", name)
+            return
+        self.app.LOG.debug("Running stage %s", name)
+        func(*args, **kwargs)
+        self._completed_stages.append(name)
+        stages.write_completed(self._stage_file, self._stage_fingerprint,
+                               self._completed_stages)
+
+    def finish_stages(self):
+        """Clear the state of stages of this command once all completed."""
+        stages.clear(self._stage_file)
+
 
 class KollaAnsibleMixin(object):
     """Mixin class for commands running Kolla Ansible."""
@@ -109,6 +323,18 @@ class KollaAnsibleMixin(object):
         kwargs.update(self._get_verbosity_args())
         return lordoftheflies_ansible.run_seed(*args, **kwargs)
 
+    def run_lordoftheflies_ansible_prechecks(self, *args, **kwargs):
+        kwargs.update(self._get_verbosity_args())
+        return lordoftheflies_ansible.run_prechecks(*args, **kwargs)
+
+    def run_lordoftheflies_ansible_genconfig(self, *args, **kwargs):
+        kwargs.update(self._get_verbosity_args())
+        return lordoftheflies_ansible.run_genconfig(*args, **kwargs)
+
+    def run_lordoftheflies_ansible_concurrent(self, *args, **kwargs):
+        kwargs.update(self._get_verbosity_args())
+        return lordoftheflies_ansible.run_concurrent(*args, **kwargs)
+
 
 class ControlHostBootstrap(JavaRoleAnsibleMixin, VaultMixin, Command):
     """Bootstrap the JavaRole control environment.
@@ -163,23 +389,129 @@ class ConfigurationDump(JavaRoleAnsibleMixin, VaultMixin, Command):
         group.add_argument("--hosts",
                            help="name of hosts and/or groups to dump config "
                                 "for")
-        group.add_argument("--var-name",
-                           help="name of a variable to dump")
+        group.add_argument("--var-name", action="append",
+                           help="name of a variable to dump. May be a "
+                                "projection such as var.key[0], and may be "
+                                "specified multiple times, in which case "
+                                "each host's variables are output as an "
+                                "object keyed by projection")
+        group.add_argument("--no-cache", action="store_false", dest="cache",
+                           help="do not use cached configuration dumps, "
+                                "even if --config-dump-cache is specified")
+        group.add_argument("--output-format", default="json",
+                           choices=["json", "ndjson"],
+                           help="format of the output. ndjson outputs one "
+                                "JSON object per host per line, and implies "
+                                "--stream (default=json)")
+        group.add_argument("--stream", action="store_true",
+                           help="output each host as soon as its "
+                                "configuration has been dumped, rather than "
+                                "collecting the configuration of all hosts "
+                                "first. The cache is not used")
         return parser
 
     def take_action(self, parsed_args):
         self.app.LOG.debug("Dumping Ansible configuration")
-        hostvars = self.run_java_role_config_dump(
-            parsed_args, host=parsed_args.host, hosts=parsed_args.hosts,
-            facts=parsed_args.dump_facts, var_name=parsed_args.var_name)
+        stream = parsed_args.stream or parsed_args.output_format == "ndjson"
+        var_name, var_names = _get_var_name_args(parsed_args.var_name)
         try:
-            json.dump(hostvars, sys.stdout, sort_keys=True, indent=4)
+            if stream and not parsed_args.host:
+                hostvars = self.run_java_role_config_dump_iter(
+                    parsed_args, hosts=parsed_args.hosts,
+                    facts=parsed_args.dump_facts, var_name=var_name,
+                    var_names=var_names)
+                _write_hostvars_stream(hostvars, sys.stdout,
+                                       parsed_args.output_format)
+            else:
+                hostvars = self.run_java_role_config_dump(
+                    parsed_args, host=parsed_args.host,
+                    hosts=parsed_args.hosts, facts=parsed_args.dump_facts,
+                    var_name=var_name, var_names=var_names,
+                    cache=parsed_args.cache and parsed_args.config_dump_cache)
+                if parsed_args.output_format == "ndjson":
+                    json.dump(hostvars, sys.stdout, sort_keys=True)
+                    sys.stdout.write("\n")
+                else:
+                    json.dump(hostvars, sys.stdout, sort_keys=True, indent=4)
         except TypeError as e:
             self.app.LOG.error("Failed to JSON encode configuration: %s",
                                repr(e))
             sys.exit(1)
 
 
+class ConfigurationCompile(JavaRoleAnsibleMixin, VaultMixin, Command):
+    """Compile JavaRole configuration.
+
+    Merges the JavaRole configuration variable files into bundles which are
+    passed to Ansible in place of the individual files. Bundles are also
+    compiled automatically when they are missing or out of date.
+    """
+
+    def take_action(self, parsed_args):
+        self.app.LOG.debug("Compiling JavaRole configuration")
+        files = ansible.compile_vars(parsed_args)
+        self.app.LOG.info("Compiled configuration into %d file(s): %s",
+                          len(files), ", ".join(files))
+
+
+class FactsRefresh(JavaRoleAnsibleMixin, VaultMixin, Command):
+    """Refresh cached host facts.
+
+    Removes cached facts for the selected hosts, or all hosts if --limit is
+    not specified, then gathers and caches facts for those hosts. Requires
+    the fact cache to be enabled.
+    """
+
+    def take_action(self, parsed_args):
+        self.app.LOG.debug("Refreshing cached host facts")
+        if not parsed_args.fact_cache_timeout:
+            self.app.LOG.error("Facts cannot be refreshed, since the fact "
+                               "cache is disabled. Set "
+                               "--fact-cache-timeout or $%s",
+                               facts.FACT_CACHE_TIMEOUT_ENV)
+            sys.exit(1)
+        if parsed_args.limit:
+            # Determine which hosts match the limit.
+            hostvars = self.run_java_role_config_dump(
+                parsed_args, var_name="inventory_hostname", tags="dump-config")
+            facts.invalidate(parsed_args.config_path, list(hostvars))
+        else:
+            facts.invalidate(parsed_args.config_path)
+        # With an empty cache, dumping configuration will gather facts.
+        self.run_java_role_config_dump(
+            parsed_args, var_name="inventory_hostname", facts=True,
+            tags="dump-config")
+
+
+class FactsPrune(JavaRoleAnsibleMixin, VaultMixin, Command):
+    """Remove expired host facts from the fact cache.
+
+    Facts which are older than the fact cache timeout are removed. Unless
+    --all is specified, this requires the fact cache to be enabled.
+    """
+
+    def get_parser(self, prog_name):
+        parser = super(FactsPrune, self).get_parser(prog_name)
+        group = parser.add_argument_group("Fact Cache")
+        group.add_argument("--all", action="store_true",
+                           help="remove all cached facts")
+        return parser
+
+    def take_action(self, parsed_args):
+        self.app.LOG.debug("Pruning cached host facts")
+        if parsed_args.all:
+            removed = facts.invalidate(parsed_args.config_path)
+        elif not parsed_args.fact_cache_timeout:
+            self.app.LOG.error("Facts cannot be pruned, since the fact cache "
+                               "is disabled. Set --fact-cache-timeout or $%s, "
+                               "or use --all", facts.FACT_CACHE_TIMEOUT_ENV)
+            sys.exit(1)
+        else:
+            removed = facts.prune(parsed_args.config_path,
+                                  parsed_args.fact_cache_timeout)
+        self.app.LOG.info("Removed cached facts for %d host(s)", len(removed))
+
+
 class PlaybookRun(JavaRoleAnsibleMixin, VaultMixin, Command):
     """Run a JavaRole Ansible playbook.
 
@@ -196,6 +528,318 @@ class PlaybookRun(JavaRoleAnsibleMixin, VaultMixin, Command):
         self.run_java_role_playbooks(parsed_args, parsed_args.playbook)
 
 
+class InventoryCompile(JavaRoleAnsibleMixin, VaultMixin, Command):
+    """Compile the JavaRole inventory.
+
+    Converts the JavaRole inventory directory, including its group and host
+    variables, into a single JSON inventory file which is passed to Ansible
+    in its place. The compiled inventory is also updated automatically when
+    the inventory changes.
+    """
+
+    def take_action(self, parsed_args):
+        self.app.LOG.debug("Compiling JavaRole inventory")
+        compiled_path = ansible.compile_inventory(parsed_args)
+        self.app.LOG.info("Compiled inventory to %s", compiled_path)
+
+
+class RunbookRun(Command):
+    """Run a runbook of JavaRole commands in a single process.
+
+    A runbook is a YAML file containing a list of steps, each of which is a
+    JavaRole command, such as 'overcloud host configure --limit
+    controllers'. Steps share a process, and therefore in-process caches.
+    Progress is checkpointed after each step, and --resume skips the steps
+    which completed in a previous run of an unchanged runbook. A summary of
+    the time taken by each step is printed.
+    """
+
+    def get_parser(self, prog_name):
+        parser = super(RunbookRun, self).get_parser(prog_name)
+        group = parser.add_argument_group("Runbook")
+        default_config_path = os.getenv(ansible.CONFIG_PATH_ENV,
+                                        ansible.DEFAULT_CONFIG_PATH)
+        group.add_argument("--config-path", default=default_config_path,
+                           help="path to JavaRole configuration, under "
+                                "which checkpoints are stored. "
+                                "(default=$%s or %s)" %
+                                (ansible.CONFIG_PATH_ENV,
+                                 ansible.DEFAULT_CONFIG_PATH))
+        group.add_argument("--resume", action="store_true",
+                           help="skip steps which completed in a previous "
+                                "run of the runbook")
+        group.add_argument("plan", help="path to the runbook")
+        return parser
+
+    def take_action(self, parsed_args):
+        self.app.LOG.debug("Running runbook %s", parsed_args.plan)
+        try:
+            steps = runbook.load_plan(parsed_args.plan)
+        except ValueError as e:
+            self.app.LOG.error("%s", e)
+            sys.exit(1)
+        fingerprint = runbook.get_fingerprint(steps)
+        checkpoint_file = runbook.get_checkpoint_file(parsed_args.config_path,
+                                                      parsed_args.plan)
+        completed = 0
+        if parsed_args.resume:
+            completed = runbook.read_checkpoint(checkpoint_file, fingerprint)
+        summary = []
+        result = 0
+        for index, step in enumerate(steps):
+            if index < completed:
+                summary.append((step["name"], "skipped", None))
+                continue
+            self.app.LOG.info("Running step %d/%d: %s", index + 1,
+                              len(steps), step["name"])
+            start = time.time()
+            try:
+                result = self.app.run_subcommand(step["argv"])
+            except SystemExit as e:
+                result = e.code if isinstance(e.code, int) else 1
+            elapsed = time.time() - start
+            if result:
+                summary.append((step["name"], "failed", elapsed))
+                break
+            summary.append((step["name"], "ok", elapsed))
+            runbook.write_checkpoint(checkpoint_file, fingerprint, index + 1)
+        self._write_summary(summary)
+        if result:
+            self.app.LOG.error("Runbook failed at step %d: %s. Rerun with "
+                               "--resume to continue from this step",
+                               len(summary), summary[-1][0])
+            sys.exit(result)
+        runbook.clear_checkpoint(checkpoint_file)
+
+    def _write_summary(self, summary):
+        """Write a summary of the time taken by each runbook step."""
+        width = max(len(name) for name, _, _ in summary)
+        total = 0
+        for name, status, elapsed in summary:
+            total += elapsed or 0
+            elapsed = "%.1fs" % elapsed if elapsed is not None else "-"
+            self.app.stdout.write("%-*s  %-7s  %8s\n" %
+                                  (width, name, status, elapsed))
+        self.app.stdout.write("%-*s  %-7s  %8s\n" %
+                              (width, "total", "", "%.1fs" % total))
+
+
+class Shell(VaultMixin, Command):
+    """Start an interactive JavaRole shell.
+
+    Commands run in the shell share a single process, avoiding interpreter
+    startup and imports for each command, and with the in-process engine,
+    for each playbook run. Inventories and variables are still loaded
+    afresh by each command. If a vault password is specified or prompted
+    for, it is served to the commands in the session by a vault agent, so
+    it is only requested once.
+    """
+
+    def get_parser(self, prog_name):
+        parser = super(Shell, self).get_parser(prog_name)
+        group = parser.add_argument_group("Shell")
+        group.add_argument("--engine", choices=ansible.ENGINES,
+                           help="default engine for commands in the "
+                                "session")
+        return parser
+
+    def take_action(self, parsed_args):
+        self.app.LOG.debug("Starting interactive shell")
+        with contextlib.ExitStack() as stack:
+            if parsed_args.engine:
+                stack.callback(self._restore_env, ansible.ENGINE_ENV,
+                               os.environ.get(ansible.ENGINE_ENV))
+                os.environ[ansible.ENGINE_ENV] = parsed_args.engine
+            if parsed_args.ask_vault_pass or parsed_args.vault_password_file:
+                password = vault.get_password(parsed_args)
+                stack.enter_context(vault.agent_session(
+                    password.decode("utf-8")))
+            interactive_mode = self.app.interactive_mode
+            self.app.interactive_mode = True
+            try:
+                self.app.interact()
+            finally:
+                self.app.interactive_mode = interactive_mode
+
+    @staticmethod
+    def _restore_env(name, value):
+        """Restore an environment variable to its value before the shell."""
+        if value is None:
+            os.environ.pop(name, None)
+        else:
+            os.environ[name] = value
+
+
+class VaultAgent(Command):
+    """Run an agent holding the Ansible vault password in memory.
+
+    The agent serves the vault password on a UNIX socket which is only
+    accessible to the current user, until its time to live expires. While it
+    is running, other JavaRole commands read the password from the agent via
+    java_role-vault-password-helper, rather than prompting for it. The
+    password is read from $%s if set, and is prompted for otherwise.
+    """ % vault.VAULT_PASSWORD_ENV
+
+    def get_parser(self, prog_name):
+        parser = super(VaultAgent, self).get_parser(prog_name)
+        group = parser.add_argument_group("Vault Agent")
+        group.add_argument("--socket", metavar="PATH",
+                           default=vault.get_agent_socket_path(),
+                           help="path to the agent's UNIX socket, in a "
+                                "directory private to the current user "
+                                "(default $%s, or a per-user path in "
+                                "$XDG_RUNTIME_DIR or the temporary "
+                                "directory)" %
+                                vault.VAULT_AGENT_SOCKET_ENV)
+        group.add_argument("--ttl", type=int, default=vault.DEFAULT_AGENT_TTL,
+                           help="number of seconds after which the agent "
+                                "exits (default %d)" %
+                                vault.DEFAULT_AGENT_TTL)
+        group.add_argument("--stop", action="store_true",
+                           help="stop a running agent")
+        return parser
+
+    def take_action(self, parsed_args):
+        if parsed_args.stop:
+            self.app.LOG.debug("Stopping vault agent")
+            if not vault.stop_agent(parsed_args.socket):
+                self.app.LOG.error("No vault agent is listening on %s",
+                                   parsed_args.socket)
+                sys.exit(1)
+            return
+        self.app.LOG.debug("Starting vault agent")
+        password = os.getenv(vault.VAULT_PASSWORD_ENV)
+        if not password:
+            password = getpass.getpass("Vault password: ")
+        try:
+            vault.run_agent(password, parsed_args.socket, parsed_args.ttl)
+        except (OSError, RuntimeError) as e:
+            self.app.LOG.error("Failed to run vault agent: %s", e)
+            sys.exit(1)
+
+
+class VaultFilesMixin(VaultMixin):
+    """Mixin class for commands operating on vault-encrypted files."""
+
+    # Past tense of the action, for reporting.
+    action_done = None
+
+    def get_parser(self, prog_name):
+        parser = super(VaultFilesMixin, self).get_parser(prog_name)
+        group = parser.add_argument_group("Vault Files")
+        group.add_argument("--workers", type=int, metavar="WORKERS",
+                           help="number of worker processes (default number "
+                                "of CPUs)")
+        group.add_argument("paths", nargs="+", metavar="PATH",
+                           help="files, or directories to search for files")
+        return parser
+
+    def process_vault_files(self, parsed_args, action, new_password=None):
+        """Apply a vault action to files and report the results.
+
+        :returns: An iterator over tuples of path and decrypted content for
+                  the view action.
+        """
+        password = vault.get_password(parsed_args)
+        paths = vault.find_files(parsed_args.paths)
+        processed = 0
+        failed = False
+        for path, done, result in vault.process_files(
+                action, paths, password, new_password=new_password,
+                workers=parsed_args.workers):
+            if isinstance(result, Exception):
+                self.app.LOG.error("Failed to %s %s: %s", action, path,
+                                   result)
+                failed = True
+            elif done:
+                processed += 1
+                yield path, result
+        self.app.LOG.info("%s %d of %d file(s)", self.action_done, processed,
+                          len(paths))
+        if failed:
+            sys.exit(1)
+
+
+class VaultDecrypt(VaultFilesMixin, Command):
+    """Decrypt vault-encrypted files in place."""
+
+    action_done = "Decrypted"
+
+    def take_action(self, parsed_args):
+        self.app.LOG.debug("Decrypting vault files")
+        list(self.process_vault_files(parsed_args, "decrypt"))
+
+
+class VaultEncrypt(VaultFilesMixin, Command):
+    """Encrypt files in place with Ansible vault.
+
+    Files which are already vault-encrypted are skipped.
+    """
+
+    action_done = "Encrypted"
+
+    def take_action(self, parsed_args):
+        self.app.LOG.debug("Encrypting vault files")
+        list(self.process_vault_files(parsed_args, "encrypt"))
+
+
+class VaultRekey(VaultFilesMixin, Command):
+    """Re-encrypt vault-encrypted files in place with a new password."""
+
+    action_done = "Rekeyed"
+
+    def get_parser(self, prog_name):
+        parser = super(VaultRekey, self).get_parser(prog_name)
+        group = parser.add_argument_group("Vault Rekey")
+        group.add_argument("--new-vault-password-file",
+                           metavar="VAULT_PASSWORD_FILE",
+                           help="new vault password file (default prompt "
+                                "for new vault password)")
+        return parser
+
+    def take_action(self, parsed_args):
+        self.app.LOG.debug("Rekeying vault files")
+        if parsed_args.new_vault_password_file:
+            new_password = vault.read_password_file(
+                parsed_args.new_vault_password_file)
+        else:
+            new_password = getpass.getpass("New vault password: ")
+            if getpass.getpass("Confirm new vault password: ") != \
+                    new_password:
+                self.app.LOG.error("New vault passwords do not match")
+                sys.exit(1)
+            new_password = new_password.encode("utf-8")
+        list(self.process_vault_files(parsed_args, "rekey",
+                                      new_password=new_password))
+
+
+class VaultView(VaultFilesMixin, Command):
+    """Display the decrypted content of vault-encrypted files."""
+
+    action_done = "Viewed"
+
+    def take_action(self, parsed_args):
+        self.app.LOG.debug("Viewing vault files")
+        for path, content in self.process_vault_files(parsed_args, "view"):
+            if len(parsed_args.paths) > 1 or os.path.isdir(
+                    parsed_args.paths[0]):
+                self.app.stdout.write("==> %s <==\n" % path)
+            try:
+                self.app.stdout.write(content.decode("utf-8"))
+            except UnicodeDecodeError:
+                self._write_binary(path, content)
+
+    def _write_binary(self, path, content):
+        """Write binary decrypted content to the underlying byte stream."""
+        buffer = getattr(self.app.stdout, "buffer", None)
+        if buffer is None:
+            self.app.LOG.error("Cannot display binary content of %s", path)
+            sys.exit(1)
+        self.app.stdout.flush()
+        buffer.write(content)
+        buffer.flush()
+
+
 class KollaAnsibleRun(KollaAnsibleMixin, VaultMixin, Command):
     """Run a Kolla Ansible command.
 
@@ -205,15 +849,28 @@ class KollaAnsibleRun(KollaAnsibleMixin, VaultMixin, Command):
     def add_lordoftheflies_ansible_args(self, group):
         super(KollaAnsibleRun, self).add_lordoftheflies_ansible_args(group)
         group.add_argument("--lordoftheflies-inventory-filename", default="overcloud",
-                           choices=["seed", "overcloud"],
+                           choices=["seed", "overcloud", "all"],
                            help="name of the lordoftheflies-ansible inventory file, "
-                                "one of seed or overcloud (default "
+                                "one of seed or overcloud, or all to run "
+                                "against both concurrently (default "
                                 "overcloud)")
         group.add_argument("command",
                            help="name of the lordoftheflies-ansible command to run")
 
     def take_action(self, parsed_args):
         self.app.LOG.debug("Running Kolla Ansible command")
+        if parsed_args.lordoftheflies_inventory_filename == "all":
+            if parsed_args.lordoftheflies_inventory:
+                # Both runs would use the same inventory.
+                self.app.LOG.error("--lordoftheflies-inventory-filename all "
+                                   "cannot be used with "
+                                   "--lordoftheflies-inventory")
+                sys.exit(1)
+            runs = [{"command": parsed_args.command,
+                     "inventory_filename": inventory_filename}
+                    for inventory_filename in ("seed", "overcloud")]
+            self.run_lordoftheflies_ansible_concurrent(parsed_args, runs)
+            return
         self.run_lordoftheflies_ansible(parsed_args, parsed_args.command,
                                         parsed_args.lordoftheflies_inventory_filename)
 
@@ -273,6 +930,13 @@ class SeedHypervisorHostConfigure(KollaAnsibleMixin, JavaRoleAnsibleMixin,
     * Configure the host as a libvirt hypervisor.
     """
 
+    def get_parser(self, prog_name):
+        parser = super(SeedHypervisorHostConfigure, self).get_parser(
+            prog_name)
+        group = parser.add_argument_group("Host Configuration")
+        _add_playbook_workers_arg(group)
+        return parser
+
     def take_action(self, parsed_args):
         self.app.LOG.debug("Configuring seed hypervisor host OS")
         # Explicitly request the dump-config tag to ensure this play runs even
@@ -284,12 +948,12 @@ class SeedHypervisorHostConfigure(KollaAnsibleMixin, JavaRoleAnsibleMixin,
             self.app.LOG.error("Could not determine java_role_ansible_user "
                                "variable for seed hypervisor host")
             sys.exit(1)
-        playbooks = _build_playbook_list(
+        playbooks = [
             "ip-allocation", "ssh-known-host", "java_role-ansible-user",
             "java_role-target-venv", "users", "yum", "dev-tools", "network",
-            "sysctl", "ntp", "seed-hypervisor-libvirt-host")
-        self.run_java_role_playbooks(parsed_args, playbooks,
-                                     limit="seed-hypervisor")
+            "sysctl", "ntp", "seed-hypervisor-libvirt-host"]
+        self.run_java_role_host_playbooks(parsed_args, playbooks,
+                                          limit="seed-hypervisor")
 
 
 class SeedHypervisorHostUpgrade(JavaRoleAnsibleMixin, VaultMixin, Command):
@@ -369,6 +1033,7 @@ class SeedHostConfigure(KollaAnsibleMixin, JavaRoleAnsibleMixin, VaultMixin,
                            help="wipe partition and LVM data from all disks "
                                 "that are not mounted. Warning: this can "
                                 "result in the loss of data")
+        _add_playbook_workers_arg(group)
         return parser
 
     def take_action(self, parsed_args):
@@ -377,12 +1042,15 @@ class SeedHostConfigure(KollaAnsibleMixin, JavaRoleAnsibleMixin, VaultMixin,
         # Query some java_role ansible variables.
         # Explicitly request the dump-config tag to ensure this play runs even
         # if the user specified tags.
+        var_names = ["java_role_ansible_user", "ansible_python_interpreter",
+                     "lordoftheflies_ansible_target_venv"]
         hostvars = self.run_java_role_config_dump(parsed_args, hosts="seed",
+                                                  var_names=var_names,
                                                   tags="dump-config")
         if not hostvars:
             self.app.LOG.error("No hosts in the seed group")
             sys.exit(1)
-        hostvars = hostvars.values()[0]
+        hostvars = list(hostvars.values())[0]
         ansible_user = hostvars.get("java_role_ansible_user")
         if not ansible_user:
             self.app.LOG.error("Could not determine java_role_ansible_user "
@@ -392,15 +1060,16 @@ class SeedHostConfigure(KollaAnsibleMixin, JavaRoleAnsibleMixin, VaultMixin,
         lordoftheflies_target_venv = hostvars.get("lordoftheflies_ansible_target_venv")
 
         # Run java_role playbooks.
-        playbooks = _build_playbook_list(
+        playbooks = [
             "ip-allocation", "ssh-known-host", "java_role-ansible-user",
-            "java_role-target-venv")
+            "java_role-target-venv"]
         if parsed_args.wipe_disks:
-            playbooks += _build_playbook_list("wipe-disks")
-        playbooks += _build_playbook_list(
+            playbooks += ["wipe-disks"]
+        playbooks += [
             "users", "yum", "dev-tools", "disable-selinux", "network",
-            "sysctl", "ip-routing", "snat", "disable-glean", "ntp", "lvm")
-        self.run_java_role_playbooks(parsed_args, playbooks, limit="seed")
+            "sysctl", "ip-routing", "snat", "disable-glean", "ntp", "lvm"]
+        self.run_java_role_host_playbooks(parsed_args, playbooks,
+                                          limit="seed")
         playbooks = _build_playbook_list("lordoftheflies-ansible")
         self.run_java_role_playbooks(parsed_args, playbooks, tags="config")
 
@@ -533,17 +1202,19 @@ class OvercloudInventoryDiscover(JavaRoleAnsibleMixin, VaultMixin, Command):
 
     def take_action(self, parsed_args):
         self.app.LOG.debug("Discovering overcloud inventory")
-        # Run the inventory discovery playbook separately, else the discovered
-        # hosts will not be present in the following playbooks in which they
-        # are used to populate other inventories.
-        self.run_java_role_playbook(parsed_args,
-                                    "ansible/overcloud-inventory-discover.yml")
-        # If necessary, allocate IP addresses for the discovered hosts.
-        self.run_java_role_playbook(parsed_args,
-                                    "ansible/ip-allocation.yml")
-        # Now populate the Kolla Ansible and Bifrost inventories.
-        self.run_java_role_playbook(parsed_args,
-                                    "ansible/lordoftheflies-bifrost-hostvars.yml")
+        # Run the inventory discovery playbook as a separate run, else the
+        # discovered hosts will not be present in the following playbooks in
+        # which they are used to populate other inventories. The batch
+        # refreshes the inventory between runs.
+        with self.java_role_playbook_batch(parsed_args):
+            self.run_java_role_playbook(
+                parsed_args, "ansible/overcloud-inventory-discover.yml")
+            # If necessary, allocate IP addresses for the discovered hosts.
+            self.run_java_role_playbook(parsed_args,
+                                        "ansible/ip-allocation.yml")
+            # Now populate the Kolla Ansible and Bifrost inventories.
+            self.run_java_role_playbook(
+                parsed_args, "ansible/lordoftheflies-bifrost-hostvars.yml")
         self.run_java_role_playbook(parsed_args, "ansible/lordoftheflies-ansible.yml",
                                     tags="config")
 
@@ -661,6 +1332,7 @@ class OvercloudHostConfigure(KollaAnsibleMixin, JavaRoleAnsibleMixin, VaultMixin
                            help="wipe partition and LVM data from all disks "
                                 "that are not mounted. Warning: this can "
                                 "result in the loss of data")
+        _add_playbook_workers_arg(group)
         return parser
 
     def take_action(self, parsed_args):
@@ -669,12 +1341,15 @@ class OvercloudHostConfigure(KollaAnsibleMixin, JavaRoleAnsibleMixin, VaultMixin
         # Query some java_role ansible variables.
         # Explicitly request the dump-config tag to ensure this play runs even
         # if the user specified tags.
+        var_names = ["java_role_ansible_user", "ansible_python_interpreter",
+                     "lordoftheflies_ansible_target_venv"]
         hostvars = self.run_java_role_config_dump(parsed_args, hosts="overcloud",
+                                                  var_names=var_names,
                                                   tags="dump-config")
         if not hostvars:
             self.app.LOG.error("No hosts in the overcloud group")
             sys.exit(1)
-        hostvars = hostvars.values()[0]
+        hostvars = list(hostvars.values())[0]
         ansible_user = hostvars.get("java_role_ansible_user")
         if not ansible_user:
             self.app.LOG.error("Could not determine java_role_ansible_user "
@@ -684,15 +1359,16 @@ class OvercloudHostConfigure(KollaAnsibleMixin, JavaRoleAnsibleMixin, VaultMixin
         lordoftheflies_target_venv = hostvars.get("lordoftheflies_ansible_target_venv")
 
         # JavaRole playbooks.
-        playbooks = _build_playbook_list(
+        playbooks = [
             "ip-allocation", "ssh-known-host", "java_role-ansible-user",
-            "java_role-target-venv")
+            "java_role-target-venv"]
         if parsed_args.wipe_disks:
-            playbooks += _build_playbook_list("wipe-disks")
-        playbooks += _build_playbook_list(
+            playbooks += ["wipe-disks"]
+        playbooks += [
             "users", "yum", "dev-tools", "disable-selinux", "network",
-            "sysctl", "disable-glean", "ntp", "lvm")
-        self.run_java_role_playbooks(parsed_args, playbooks, limit="overcloud")
+            "sysctl", "disable-glean", "ntp", "lvm"]
+        self.run_java_role_host_playbooks(parsed_args, playbooks,
+                                          limit="overcloud")
         playbooks = _build_playbook_list("lordoftheflies-ansible")
         self.run_java_role_playbooks(parsed_args, playbooks, tags="config")
 
@@ -757,6 +1433,14 @@ class OvercloudServiceConfigurationGenerate(JavaRoleAnsibleMixin,
                                 "the remote node (required)")
         group.add_argument("--skip-prechecks", action='store_true',
                            help="skip the lordoftheflies-ansible prechecks command")
+        group.add_argument("--force-prechecks", action='store_true',
+                           help="run the lordoftheflies-ansible prechecks "
+                                "command even if its inputs are unchanged "
+                                "since prechecks last passed")
+        group.add_argument("--incremental", action='store_true',
+                           help="generate configuration only for services "
+                                "whose inputs changed since configuration "
+                                "was last generated")
         return parser
 
     def take_action(self, parsed_args):
@@ -771,14 +1455,20 @@ class OvercloudServiceConfigurationGenerate(JavaRoleAnsibleMixin,
 
         # Run lordoftheflies-ansible prechecks before deployment.
         if not parsed_args.skip_prechecks:
-            self.run_lordoftheflies_ansible_overcloud(parsed_args, "prechecks")
+            self.run_lordoftheflies_ansible_prechecks(
+                parsed_args, "overcloud", force=parsed_args.force_prechecks)
 
         # Generate the configuration.
         extra_vars = {}
         if parsed_args.node_config_dir:
             extra_vars["node_config_directory"] = parsed_args.node_config_dir
-        self.run_lordoftheflies_ansible_overcloud(parsed_args, "genconfig",
-                                                  extra_vars=extra_vars)
+        if parsed_args.incremental:
+            self.run_lordoftheflies_ansible_genconfig(
+                parsed_args, "overcloud", incremental=True,
+                extra_vars=extra_vars)
+        else:
+            self.run_lordoftheflies_ansible_overcloud(parsed_args, "genconfig",
+                                                      extra_vars=extra_vars)
 
 
 class OvercloudServiceConfigurationSave(JavaRoleAnsibleMixin, VaultMixin,
@@ -815,8 +1505,8 @@ class OvercloudServiceConfigurationSave(JavaRoleAnsibleMixin, VaultMixin,
                                      extra_vars=extra_vars)
 
 
-class OvercloudServiceDeploy(KollaAnsibleMixin, JavaRoleAnsibleMixin, VaultMixin,
-                             Command):
+class OvercloudServiceDeploy(StageMixin, KollaAnsibleMixin,
+                             JavaRoleAnsibleMixin, VaultMixin, Command):
     """Deploy the overcloud services.
 
     * Configure lordoftheflies-ansible.
@@ -836,44 +1526,59 @@ class OvercloudServiceDeploy(KollaAnsibleMixin, JavaRoleAnsibleMixin, VaultMixin
         group = parser.add_argument_group("Service Deployment")
         group.add_argument("--skip-prechecks", action='store_true',
                            help="skip the lordoftheflies-ansible prechecks command")
+        group.add_argument("--force-prechecks", action='store_true',
+                           help="run the lordoftheflies-ansible prechecks "
+                                "command even if its inputs are unchanged "
+                                "since prechecks last passed")
+        lordoftheflies_ansible.add_shard_args(group)
         return parser
 
     def take_action(self, parsed_args):
         self.app.LOG.debug("Deploying overcloud services")
+        self.start_stages(parsed_args)
 
         # First prepare configuration.
         playbooks = _build_playbook_list("lordoftheflies-ansible")
-        self.run_java_role_playbooks(parsed_args, playbooks, tags="config")
+        self.run_stage("config", self.run_java_role_playbooks, parsed_args,
+                       playbooks, tags="config")
 
         playbooks = _build_playbook_list("lordoftheflies-openstack", "swift-setup")
-        self.run_java_role_playbooks(parsed_args, playbooks)
+        self.run_stage("openstack", self.run_java_role_playbooks, parsed_args,
+                       playbooks)
 
         # Run lordoftheflies-ansible prechecks before deployment.
         if not parsed_args.skip_prechecks:
-            self.run_lordoftheflies_ansible_overcloud(parsed_args, "prechecks")
+            self.run_stage("prechecks",
+                           self.run_lordoftheflies_ansible_prechecks,
+                           parsed_args, "overcloud",
+                           force=parsed_args.force_prechecks)
 
         # Perform the lordoftheflies-ansible deployment.
-        self.run_lordoftheflies_ansible_overcloud(parsed_args, "deploy")
+        self.run_stage("deploy", self.run_lordoftheflies_ansible_overcloud,
+                       parsed_args, "deploy", shard=True)
 
         # Deploy java_role extra services.
         playbooks = _build_playbook_list("overcloud-extras")
         extra_vars = {"action": "deploy"}
-        self.run_java_role_playbooks(parsed_args, playbooks,
-                                     extra_vars=extra_vars)
+        self.run_stage("extras", self.run_java_role_playbooks, parsed_args,
+                       playbooks, extra_vars=extra_vars)
 
         # Post-deployment configuration.
         # FIXME: Fudge to work around incorrect configuration path.
         extra_vars = {"node_config_directory": parsed_args.lordoftheflies_config_path}
-        self.run_lordoftheflies_ansible_overcloud(parsed_args, "post-deploy",
-                                                  extra_vars=extra_vars)
+        self.run_stage("post-deploy",
+                       self.run_lordoftheflies_ansible_overcloud, parsed_args,
+                       "post-deploy", extra_vars=extra_vars)
         # Create an environment file for accessing the public API as the admin
         # user.
         playbooks = _build_playbook_list("public-openrc")
-        self.run_java_role_playbooks(parsed_args, playbooks)
+        self.run_stage("openrc", self.run_java_role_playbooks, parsed_args,
+                       playbooks)
+        self.finish_stages()
 
 
-class OvercloudServiceReconfigure(KollaAnsibleMixin, JavaRoleAnsibleMixin,
-                                  VaultMixin, Command):
+class OvercloudServiceReconfigure(StageMixin, KollaAnsibleMixin,
+                                  JavaRoleAnsibleMixin, VaultMixin, Command):
     """Reconfigure the overcloud services.
 
     * Configure lordoftheflies-ansible.
@@ -893,44 +1598,59 @@ class OvercloudServiceReconfigure(KollaAnsibleMixin, JavaRoleAnsibleMixin,
         group = parser.add_argument_group("Service Reconfiguration")
         group.add_argument("--skip-prechecks", action='store_true',
                            help="skip the lordoftheflies-ansible prechecks command")
+        group.add_argument("--force-prechecks", action='store_true',
+                           help="run the lordoftheflies-ansible prechecks "
+                                "command even if its inputs are unchanged "
+                                "since prechecks last passed")
         return parser
 
     def take_action(self, parsed_args):
         self.app.LOG.debug("Reconfiguring overcloud services")
+        self.start_stages(parsed_args)
 
         # First prepare configuration.
         playbooks = _build_playbook_list("lordoftheflies-ansible")
-        self.run_java_role_playbooks(parsed_args, playbooks, tags="config")
+        self.run_stage("config", self.run_java_role_playbooks, parsed_args,
+                       playbooks, tags="config")
 
         playbooks = _build_playbook_list("lordoftheflies-openstack", "swift-setup")
-        self.run_java_role_playbooks(parsed_args, playbooks)
+        self.run_stage("openstack", self.run_java_role_playbooks, parsed_args,
+                       playbooks)
 
         # Run lordoftheflies-ansible prechecks before reconfiguration.
         if not parsed_args.skip_prechecks:
-            self.run_lordoftheflies_ansible_overcloud(parsed_args, "prechecks")
+            self.run_stage("prechecks",
+                           self.run_lordoftheflies_ansible_prechecks,
+                           parsed_args, "overcloud",
+                           force=parsed_args.force_prechecks)
 
         # Perform the lordoftheflies-ansible reconfiguration.
-        self.run_lordoftheflies_ansible_overcloud(parsed_args, "reconfigure")
+        self.run_stage("reconfigure",
+                       self.run_lordoftheflies_ansible_overcloud, parsed_args,
+                       "reconfigure")
 
         # Reconfigure java_role extra services.
         playbooks = _build_playbook_list("overcloud-extras")
         extra_vars = {"action": "reconfigure"}
-        self.run_java_role_playbooks(parsed_args, playbooks,
-                                     extra_vars=extra_vars)
+        self.run_stage("extras", self.run_java_role_playbooks, parsed_args,
+                       playbooks, extra_vars=extra_vars)
 
         # Post-deployment configuration.
         # FIXME: Fudge to work around incorrect configuration path.
         extra_vars = {"node_config_directory": parsed_args.lordoftheflies_config_path}
-        self.run_lordoftheflies_ansible_overcloud(parsed_args, "post-deploy",
-                                                  extra_vars=extra_vars)
+        self.run_stage("post-deploy",
+                       self.run_lordoftheflies_ansible_overcloud, parsed_args,
+                       "post-deploy", extra_vars=extra_vars)
         # Create an environment file for accessing the public API as the admin
         # user.
         playbooks = _build_playbook_list("public-openrc")
-        self.run_java_role_playbooks(parsed_args, playbooks)
+        self.run_stage("openrc", self.run_java_role_playbooks, parsed_args,
+                       playbooks)
+        self.finish_stages()
 
 
-class OvercloudServiceUpgrade(KollaAnsibleMixin, JavaRoleAnsibleMixin,
-                              VaultMixin, Command):
+class OvercloudServiceUpgrade(StageMixin, KollaAnsibleMixin,
+                              JavaRoleAnsibleMixin, VaultMixin, Command):
     """Upgrade the overcloud services.
 
     * Configure lordoftheflies-ansible.
@@ -949,27 +1669,39 @@ class OvercloudServiceUpgrade(KollaAnsibleMixin, JavaRoleAnsibleMixin,
         group = parser.add_argument_group("Service Upgrade")
         group.add_argument("--skip-prechecks", action='store_true',
                            help="skip the lordoftheflies-ansible prechecks command")
+        group.add_argument("--force-prechecks", action='store_true',
+                           help="run the lordoftheflies-ansible prechecks "
+                                "command even if its inputs are unchanged "
+                                "since prechecks last passed")
+        lordoftheflies_ansible.add_shard_args(group)
         return parser
 
     def take_action(self, parsed_args):
         self.app.LOG.debug("Upgrading overcloud services")
+        self.start_stages(parsed_args)
 
         # First prepare configuration.
         playbooks = _build_playbook_list("lordoftheflies-ansible", "lordoftheflies-openstack")
-        self.run_java_role_playbooks(parsed_args, playbooks)
+        self.run_stage("config", self.run_java_role_playbooks, parsed_args,
+                       playbooks)
 
         # Run lordoftheflies-ansible prechecks before upgrade.
         if not parsed_args.skip_prechecks:
-            self.run_lordoftheflies_ansible_overcloud(parsed_args, "prechecks")
+            self.run_stage("prechecks",
+                           self.run_lordoftheflies_ansible_prechecks,
+                           parsed_args, "overcloud",
+                           force=parsed_args.force_prechecks)
 
         # Perform the lordoftheflies-ansible upgrade.
-        self.run_lordoftheflies_ansible_overcloud(parsed_args, "upgrade")
+        self.run_stage("upgrade", self.run_lordoftheflies_ansible_overcloud,
+                       parsed_args, "upgrade", shard=True)
 
         # Upgrade java_role extra services.
         playbooks = _build_playbook_list("overcloud-extras")
         extra_vars = {"action": "upgrade"}
-        self.run_java_role_playbooks(parsed_args, playbooks,
-                                     extra_vars=extra_vars)
+        self.run_stage("extras", self.run_java_role_playbooks, parsed_args,
+                       playbooks, extra_vars=extra_vars)
+        self.finish_stages()
 
 
 class OvercloudServiceDestroy(KollaAnsibleMixin, JavaRoleAnsibleMixin,
@@ -0,0 +1,98 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import configparser
+import importlib
+import json
+import logging
+import os
+
+from cliff.commandmanager import CommandManager
+
+LOG = logging.getLogger(__name__)
+
+# Entry point namespace of JavaRole commands.
+NAMESPACE = "java_role.cli"
+
+# Path to the command index, generated from setup.cfg by
+# tools/generate-command-index.py.
+INDEX_FILE = os.path.join(os.path.dirname(__file__), "command-index.json")
+
+
+class LazyEntryPoint(object):
+    """An entry point-like object which imports its command on load."""
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def __repr__(self):
+        return "LazyEntryPoint(%r, %r)" % (self.name, self.value)
+
+    def load(self):
+        module_name, _, attr = self.value.partition(":")
+        return getattr(importlib.import_module(module_name), attr)
+
+
+def build_index(setup_cfg):
+    """Build a command index from the entry points in setup.cfg.
+
+    :param setup_cfg: Path to setup.cfg.
+    :returns: A dict mapping entry point names to module:class references.
+    """
+    parser = configparser.ConfigParser()
+    parser.read(setup_cfg)
+    entry_points = parser.get("entry_points", NAMESPACE)
+    index = {}
+    for line in entry_points.splitlines():
+        if not line.strip():
+            continue
+        name, _, value = line.partition("=")
+        index[name.strip()] = value.strip()
+    return index
+
+
+def load_index(path=INDEX_FILE):
+    """Load a command index, or return None if it is missing or invalid."""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError) as e:
+        LOG.debug("Failed to load command index %s: %s", path, e)
+        return None
+
+
+class IndexedCommandManager(CommandManager):
+    """Command manager which loads commands from a precomputed index.
+
+    Scanning entry points of installed distributions and importing command
+    modules is slow. Commands in the JavaRole namespace are instead read
+    from the command index, and their modules are imported only when a
+    command is loaded. Other namespaces, or a missing index, fall back to
+    scanning entry points.
+    """
+
+    def __init__(self, namespace=NAMESPACE, index_file=INDEX_FILE, **kwargs):
+        self.index_file = index_file
+        super(IndexedCommandManager, self).__init__(namespace, **kwargs)
+
+    def load_commands(self, namespace):
+        index = load_index(self.index_file) if namespace == NAMESPACE else None
+        if index is None:
+            return super(IndexedCommandManager, self).load_commands(namespace)
+        self.group_list.append(namespace)
+        for name, value in index.items():
+            if self.convert_underscores:
+                name = name.replace("_", " ")
+            self.commands[name] = LazyEntryPoint(name, value)
@@ -15,7 +15,9 @@
 import sys
 
 from cliff.app import App
-from cliff.commandmanager import CommandManager
+
+from java_role import utils
+from java_role.cli.manager import IndexedCommandManager
 
 
 class JavaRoleApp(App):
@@ -24,7 +26,7 @@ class JavaRoleApp(App):
         super(JavaRoleApp, self).__init__(
             description='Java Role Command Line Interface (CLI)',
             version='0.1',
-            command_manager=CommandManager('java_role.cli'),
+            command_manager=IndexedCommandManager('java_role.cli'),
             deferred_help=True,
         )
 
@@ -33,6 +35,23 @@ class JavaRoleApp(App):
 
     def prepare_to_run_command(self, cmd):
         self.LOG.debug('prepare_to_run_command %s', cmd.__class__.__name__)
+        # Paths may have changed since a previous command in this process.
+        utils.clear_path_cache()
+
+    def run_subcommand(self, argv):
+        """Run a subcommand.
+
+        Commands report failures by calling sys.exit. In interactive mode,
+        the exit code is returned instead, so that the session continues.
+        """
+        try:
+            return super(JavaRoleApp, self).run_subcommand(argv)
+        except SystemExit as e:
+            if not self.interactive_mode:
+                raise
+            code = e.code if isinstance(e.code, int) else 1
+            self.LOG.error('Command %s exited %d', ' '.join(argv), code)
+            return code
 
     def clean_up(self, cmd, result, err):
         self.LOG.debug('clean_up %s', cmd.__class__.__name__)
@@ -16,11 +16,17 @@ from __future__ import print_function
 
 import os
 
+from java_role import vault
+
 VAULT_PASSWORD_ENV = "JAVA_ROLE_VAULT_PASSWORD"
 
 
 def main():
-    """Helper script to allow specification of vault password via env."""
-    password = os.getenv(VAULT_PASSWORD_ENV)
+    """Helper script to allow specification of vault password via env.
+
+    If the password is not set in the environment, it is read from a
+    running vault agent if there is one.
+    """
+    password = os.getenv(VAULT_PASSWORD_ENV) or vault.get_agent_password()
     if password:
         print(password)
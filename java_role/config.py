@@ -0,0 +1,222 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import configparser
+import json
+import logging
+import os
+import stat
+
+from java_role import utils
+
+LOG = logging.getLogger(__name__)
+
+# Name of the cache directory holding compiled variable bundles.
+BUNDLE_CACHE = "vars"
+
+MANIFEST = "manifest.json"
+
+
+def _load_bundleable(path):
+    """Load a variables file which may be merged into a bundle.
+
+    Files which are vault-encrypted, use YAML tags such as !vault or
+    !unsafe, or contain values which cannot be represented in JSON are not
+    bundleable, and are passed to Ansible as they are.
+
+    :returns: A dict of variables, or None if the file is not bundleable.
+    """
+    import yaml
+
+    try:
+        content = utils.read_file(path)
+    except IOError:
+        return None
+    if content.lstrip().startswith("$ANSIBLE_VAULT"):
+        return None
+    try:
+        if path.endswith(".json"):
+            data = json.loads(content)
+        else:
+            data = yaml.load(content, Loader=utils.get_yaml_loader())
+        json.dumps(data)
+    except (TypeError, ValueError, yaml.YAMLError):
+        return None
+    if not isinstance(data, dict):
+        return None
+    return data
+
+
+def _read_manifest(cache_dir):
+    """Read the manifest of a bundle cache, or return None if invalid."""
+    path = os.path.join(cache_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError) as e:
+        LOG.warning("Ignoring invalid variable bundle manifest %s: %s",
+                    path, e)
+        return None
+
+
+def _is_fresh(manifest, vars_files):
+    """Return whether a bundle manifest matches a list of variable files.
+
+    Files whose modification time and size are unchanged are assumed to be
+    unchanged. Otherwise their content is compared.
+    """
+    inputs = manifest.get("inputs", [])
+    if [i["path"] for i in inputs] != list(vars_files):
+        return False
+    for i in inputs:
+        try:
+            st = os.stat(i["path"])
+        except OSError:
+            return False
+        if st.st_mtime == i["mtime"] and st.st_size == i["size"]:
+            continue
+        if utils.hash_paths([i["path"]]) != i["sha256"]:
+            return False
+    return all(os.path.exists(path) for path in manifest.get("files", []))
+
+
+def compile_vars(config_path, vars_files):
+    """Compile variable files into merged JSON bundles.
+
+    Consecutive bundleable files are merged into a single bundle, with later
+    files taking precedence as they do when passed to Ansible as separate
+    extra variables files. Files which cannot be bundled split the bundle,
+    so that precedence is preserved.
+
+    :param config_path: Path to the JavaRole configuration.
+    :param vars_files: List of variable files, in order of precedence.
+    :returns: A list of files to pass to Ansible in place of vars_files.
+    """
+    cache_dir = utils.get_cache_dir(config_path, BUNDLE_CACHE)
+    if not cache_dir:
+        return list(vars_files)
+    inputs = []
+    segments = []
+    files = []
+    current = None
+    for path in vars_files:
+        st = os.stat(path)
+        inputs.append({"path": path, "mtime": st.st_mtime,
+                       "size": st.st_size,
+                       "sha256": utils.hash_paths([path])})
+        data = _load_bundleable(path)
+        if data is None:
+            LOG.debug("Not bundling variables file %s", path)
+            current = None
+            files.append(path)
+            continue
+        if current is None:
+            current = {}
+            segments.append(current)
+            files.append(os.path.join(cache_dir,
+                                      "bundle-%d.json" % len(segments)))
+        current.update(data)
+    bundles = [f for f in files if f.startswith(cache_dir)]
+    for bundle, data in zip(bundles, segments):
+        utils.write_file_atomic(bundle, json.dumps(data), mode=0o600)
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith("bundle-") and path not in bundles:
+            os.unlink(path)
+    manifest = {"inputs": inputs, "files": files}
+    utils.write_file_atomic(os.path.join(cache_dir, MANIFEST),
+                            json.dumps(manifest), mode=0o600)
+    LOG.debug("Compiled %d variables files into %d bundles",
+              len(vars_files), len(bundles))
+    return files
+
+
+def _find_ansible_cfg():
+    """Return the path to the Ansible configuration file in use, or None.
+
+    Follows Ansible's search order: ANSIBLE_CONFIG, ansible.cfg in the
+    current directory unless it is world-writable, ~/.ansible.cfg, then
+    /etc/ansible/ansible.cfg.
+    """
+    paths = []
+    env_path = os.environ.get("ANSIBLE_CONFIG")
+    if env_path:
+        env_path = os.path.expanduser(env_path)
+        if os.path.isdir(env_path):
+            env_path = os.path.join(env_path, "ansible.cfg")
+        paths.append(env_path)
+    try:
+        cwd = os.getcwd()
+        if not os.stat(cwd).st_mode & stat.S_IWOTH:
+            paths.append(os.path.join(cwd, "ansible.cfg"))
+    except OSError:
+        pass
+    paths.append(os.path.expanduser("~/.ansible.cfg"))
+    paths.append("/etc/ansible/ansible.cfg")
+    for path in paths:
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def get_hash_behaviour():
+    """Return Ansible's hash_behaviour setting.
+
+    ANSIBLE_HASH_BEHAVIOUR takes precedence over hash_behaviour in the
+    [defaults] section of the Ansible configuration file.
+    """
+    value = os.environ.get("ANSIBLE_HASH_BEHAVIOUR")
+    if value:
+        return value
+    path = _find_ansible_cfg()
+    if not path:
+        return "replace"
+    parser = configparser.ConfigParser(interpolation=None)
+    try:
+        parser.read(path)
+        return parser.get("defaults", "hash_behaviour", fallback="replace")
+    except configparser.Error as e:
+        LOG.warning("Failed to read Ansible configuration %s: %s", path, e)
+        return "replace"
+
+
+def get_vars_files(config_path, vars_files):
+    """Return the variable files to pass to Ansible.
+
+    Uses compiled bundles if they are fresh, and compiles them otherwise.
+    Bundling is skipped if Ansible's hash_behaviour is merge, whether set
+    by ANSIBLE_HASH_BEHAVIOUR or in ansible.cfg, since bundles are merged
+    using the default replace behaviour.
+
+    :param config_path: Path to the JavaRole configuration.
+    :param vars_files: List of variable files, in order of precedence.
+    :returns: A list of files to pass to Ansible in place of vars_files.
+    """
+    if len(vars_files) < 2:
+        return list(vars_files)
+    if get_hash_behaviour() != "replace":
+        return list(vars_files)
+    cache_dir = utils.get_cache_dir(config_path, BUNDLE_CACHE)
+    if not cache_dir:
+        return list(vars_files)
+    manifest = _read_manifest(cache_dir)
+    if manifest and _is_fresh(manifest, vars_files):
+        return manifest["files"]
+    try:
+        return compile_vars(config_path, vars_files)
+    except (IOError, OSError) as e:
+        LOG.warning("Failed to compile variables files: %s", e)
+        return list(vars_files)
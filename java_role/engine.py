@@ -0,0 +1,197 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import contextlib
+import logging
+import os
+import warnings
+
+LOG = logging.getLogger(__name__)
+
+# Ansible is imported lazily, so that it is only required when the in-process
+# engine is used.
+
+
+def _reset_global_state():
+    """Reset Ansible state which is only expected to be set once a process.
+
+    The global CLI arguments are a singleton created on the first parse, and
+    extra and option variables derived from them are cached, so would
+    otherwise keep the arguments of the first run in this process. Newer
+    Ansible releases also refuse to initialise vault secrets twice.
+    """
+    from ansible.utils.context_objects import GlobalCLIArgs
+    from ansible.utils import vars as ansible_vars
+    GlobalCLIArgs._Singleton__instance = None
+    ansible_vars.load_extra_vars.extra_vars = None
+    ansible_vars.load_options_vars.options_vars = None
+    try:
+        from ansible.parsing.vault import VaultSecretsContext
+    except ImportError:
+        return
+    VaultSecretsContext._current = None
+
+
+def _get_playbook_cli_class():
+    """Return a PlaybookCLI subclass which may be run repeatedly in-process.
+
+    A fresh loader, inventory and variable manager are created for each run,
+    so that changes made by one run, such as add_host and set_fact, do not
+    affect the next. The in-process engine saves interpreter startup and the
+    import of Ansible and its plugins.
+    """
+    from ansible.cli.playbook import PlaybookCLI
+
+    class JavaRolePlaybookCLI(PlaybookCLI):
+        """PlaybookCLI that parses its arguments afresh for every run."""
+
+        def parse(self):
+            _reset_global_state()
+            super(JavaRolePlaybookCLI, self).parse()
+
+    return JavaRolePlaybookCLI
+
+
+@contextlib.contextmanager
+def _environment(env):
+    """Set environment variables, restoring their previous values on exit."""
+    env = env or {}
+    saved = dict((name, os.environ.get(name)) for name in env)
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _run(cmd):
+    """Run an ansible-playbook command line in-process.
+
+    :param cmd: ansible-playbook command line as a list of arguments.
+    :returns: The ansible-playbook return code.
+    """
+    from ansible import errors
+
+    cli_class = _get_playbook_cli_class()
+    try:
+        with warnings.catch_warnings():
+            # The collection loader is configured by the first run.
+            warnings.filterwarnings(
+                "ignore", "AnsibleCollectionFinder has already been")
+            return cli_class(cmd).run()
+    except errors.AnsibleOptionsError as e:
+        LOG.error("Invalid Ansible options: %s", e)
+        return 5
+    except errors.AnsibleParserError as e:
+        LOG.error("Failed to parse Ansible input: %s", e)
+        return 4
+    except errors.AnsibleError as e:
+        LOG.error("Ansible error: %s", e)
+        return 1
+
+
+def run_playbooks(cmd, quiet=False, env=None):
+    """Run an ansible-playbook command line in-process.
+
+    :param cmd: ansible-playbook command line as a list of arguments, as
+                returned by java_role.ansible.build_args.
+    :param quiet: Redirect output to /dev/null
+    :param env: Optional dict of environment variables to set during the
+                run. Ansible reads its configuration once per process, so
+                these should not change between runs.
+    :returns: The ansible-playbook return code.
+    """
+    LOG.debug("Running in-process: %s", " ".join(cmd))
+    with _environment(env):
+        if not quiet:
+            return _run(cmd)
+        with open(os.devnull, "w") as devnull:
+            with contextlib.redirect_stdout(devnull), \
+                    contextlib.redirect_stderr(devnull):
+                return _run(cmd)
+
+
+def _dump_hostvars(cmd, hosts, var_name, var_names):
+    """Evaluate host variables without running a playbook."""
+    from ansible import context
+    from ansible import errors
+    from ansible.template import Templar
+    from ansible.vars.hostvars import HostVars
+
+    cli = _get_playbook_cli_class()(cmd)
+    cli.parse()
+    loader, inventory, variable_manager = cli._play_prereqs()
+    # As for a playbook run, load group_vars and host_vars adjacent to the
+    # playbook, and set playbook_dir.
+    playbook = context.CLIARGS["args"][0]
+    loader.set_basedir(os.path.dirname(os.path.abspath(playbook)))
+    inventory.subset(context.CLIARGS.get("subset"))
+    # Registers itself with the variable manager, as for a playbook run.
+    HostVars(inventory=inventory, variable_manager=variable_manager,
+             loader=loader)
+    hostvars = {}
+    for host in inventory.list_hosts(hosts):
+        # Variables may reference those of other hosts via hostvars, but
+        # hostvars itself is not dumped, matching
+        # hostvars[inventory_hostname].
+        hvars = variable_manager.get_vars(host=host, include_hostvars=True)
+        templar = Templar(loader=loader, variables=hvars)
+        if var_name:
+            if var_name not in hvars:
+                raise errors.AnsibleUndefinedVariable(
+                    "'%s' is undefined for host %s" % (var_name, host.name))
+            hostvars[host.name] = templar.template(hvars[var_name])
+        elif var_names:
+            hostvars[host.name] = dict(
+                (name, templar.template(hvars[name]))
+                for name in var_names if name in hvars)
+        else:
+            hostvars[host.name] = dict(
+                (name, templar.template(value))
+                for name, value in hvars.items() if name != "hostvars")
+    return hostvars
+
+
+def dump_hostvars(cmd, hosts="all", var_name=None, var_names=None,
+                  env=None):
+    """Evaluate host variables in-process.
+
+    The inventory and variables, including group_vars and host_vars adjacent
+    to the first playbook in cmd, are loaded as they would be for a playbook
+    run, but no playbook is run and no connection is made to the hosts, so
+    facts are not available.
+
+    :param cmd: ansible-playbook command line as a list of arguments, as
+                returned by java_role.ansible.build_args.
+    :param hosts: Host pattern of hosts to evaluate.
+    :param var_name: Optional name of a single variable to evaluate.
+    :param var_names: Optional list of names of variables to evaluate.
+    :param env: Optional dict of environment variables to set.
+    :returns: A dict mapping host names to their variables, or to the value
+              of var_name if specified. If var_names is specified, only
+              those variables which are defined are included.
+    :raises: RuntimeError if the variables could not be evaluated.
+    """
+    from ansible import errors
+
+    LOG.debug("Evaluating host variables in-process: %s", " ".join(cmd))
+    with _environment(env):
+        try:
+            return _dump_hostvars(cmd, hosts, var_name, var_names)
+        except errors.AnsibleError as e:
+            raise RuntimeError("Failed to evaluate host variables: %s" % e)
@@ -0,0 +1,111 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+import os
+import time
+
+LOG = logging.getLogger(__name__)
+
+# The fact cache is disabled by default, since cached facts may be stale.
+DEFAULT_FACT_CACHE_TIMEOUT = 0
+
+FACT_CACHE_TIMEOUT_ENV = "JAVA_ROLE_FACT_CACHE_TIMEOUT"
+
+
+def add_args(parser):
+    """Add arguments required for caching Ansible facts to a parser."""
+    default_timeout = int(os.getenv(FACT_CACHE_TIMEOUT_ENV,
+                                    DEFAULT_FACT_CACHE_TIMEOUT))
+    parser.add_argument("--fact-cache-timeout", metavar="SECONDS",
+                        type=int, default=default_timeout,
+                        help="time for which gathered host facts are cached, "
+                             "or 0 to disable the fact cache "
+                             "(default=$%s or %d)" %
+                             (FACT_CACHE_TIMEOUT_ENV,
+                              DEFAULT_FACT_CACHE_TIMEOUT))
+
+
+def get_cache_path(config_path):
+    """Return the path to the fact cache for a JavaRole configuration."""
+    return os.path.join(config_path, ".cache", "facts")
+
+
+def build_env(parsed_args):
+    """Build environment variables which configure Ansible's fact cache.
+
+    Facts are cached in a jsonfile cache under the JavaRole configuration
+    path, and are only gathered for hosts without unexpired cached facts.
+    Fact gathering or caching configured in the environment is respected.
+
+    :returns: A dict of environment variables, which is empty if the fact
+              cache is disabled, the configuration path is unknown, or fact
+              gathering or caching is configured in the environment.
+    """
+    config_path = getattr(parsed_args, "config_path", None)
+    timeout = getattr(parsed_args, "fact_cache_timeout",
+                      DEFAULT_FACT_CACHE_TIMEOUT)
+    if not config_path or not timeout:
+        return {}
+    if "ANSIBLE_GATHERING" in os.environ or \
+            "ANSIBLE_CACHE_PLUGIN" in os.environ:
+        LOG.debug("Not caching facts, since Ansible fact gathering or "
+                  "caching is configured in the environment")
+        return {}
+    return {
+        "ANSIBLE_GATHERING": "smart",
+        "ANSIBLE_CACHE_PLUGIN": "jsonfile",
+        "ANSIBLE_CACHE_PLUGIN_CONNECTION": get_cache_path(config_path),
+        "ANSIBLE_CACHE_PLUGIN_PREFIX": "",
+        "ANSIBLE_CACHE_PLUGIN_TIMEOUT": str(timeout),
+    }
+
+
+def _list_cache(config_path):
+    """Return a list of (host, path) tuples for cached facts."""
+    cache_path = get_cache_path(config_path)
+    if not os.path.isdir(cache_path):
+        return []
+    return [(host, os.path.join(cache_path, host))
+            for host in sorted(os.listdir(cache_path))]
+
+
+def invalidate(config_path, hosts=None):
+    """Remove cached facts.
+
+    :param config_path: Path to the JavaRole configuration.
+    :param hosts: Optional list of hosts for which to remove facts. By
+                  default the facts of all hosts are removed.
+    :returns: A list of hosts for which facts were removed.
+    """
+    removed = []
+    for host, path in _list_cache(config_path):
+        if hosts is None or host in hosts:
+            LOG.debug("Removing cached facts for %s", host)
+            os.unlink(path)
+            removed.append(host)
+    return removed
+
+
+def prune(config_path, timeout):
+    """Remove cached facts which are older than a timeout.
+
+    :param config_path: Path to the JavaRole configuration.
+    :param timeout: Age in seconds after which cached facts are removed.
+    :returns: A list of hosts for which facts were removed.
+    """
+    now = time.time()
+    expired = [host for host, path in _list_cache(config_path)
+               if now - os.path.getmtime(path) > timeout]
+    return invalidate(config_path, expired)
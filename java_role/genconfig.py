@@ -0,0 +1,170 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+import json
+import logging
+import os
+import re
+
+from java_role import utils
+
+LOG = logging.getLogger(__name__)
+
+# Name of the cache directory holding incremental genconfig state.
+GENCONFIG_CACHE = "genconfig"
+
+
+def _parse_inventory(inventory_path):
+    """Parse the sections of an INI format Kolla inventory.
+
+    :returns: A dict mapping section names to their lines.
+    """
+    sections = {}
+    lines = None
+    with open(inventory_path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith(("#", ";")):
+                continue
+            match = re.match(r"^\[([^\]]+)\]$", line)
+            if match:
+                lines = sections.setdefault(match.group(1), [])
+            elif lines is not None:
+                lines.append(line)
+    return sections
+
+
+def _get_hosts(sections, group, seen=None):
+    """Return the hosts in an inventory group, including its children.
+
+    Host lines are returned as they appear, including any host variables.
+    """
+    seen = set() if seen is None else seen
+    if group in seen:
+        return set()
+    seen.add(group)
+    hosts = set(sections.get(group, []))
+    for child in sections.get(group + ":children", []):
+        hosts |= _get_hosts(sections, child, seen)
+    return hosts
+
+
+def _get_service(name, services):
+    """Return the service to which a group or file name belongs, or None."""
+    for service in services:
+        if name == service or name.startswith(service + "-"):
+            return service
+    return None
+
+
+def get_fingerprints(config_path, inventory_path, extra=None):
+    """Return fingerprints of the inputs to Kolla Ansible genconfig.
+
+    Services are the inventory groups defined as [<service>:children]
+    without a hyphen, such as nova. Subservice groups, such as nova-api,
+    and configuration overrides under config/ named after a service or
+    subservice belong to that service, as do the hosts to which those
+    groups resolve, so that changing the membership of a top-level group
+    such as [compute] changes the services which use it. Top-level files
+    in the Kolla configuration path, such as globals.yml and
+    passwords.yml, overrides and group variables which belong to no
+    service, and extra arguments affect all services.
+
+    :param config_path: Path to the Kolla configuration.
+    :param inventory_path: Path to the Kolla inventory file.
+    :param extra: Optional JSON-serialisable data affecting all services.
+    :returns: A tuple of a fingerprint of inputs common to all services,
+              and a dict mapping services to fingerprints.
+    """
+    sections = _parse_inventory(inventory_path)
+    services = sorted(set(
+        name.split(":")[0] for name in sections
+        if name.endswith(":children") and "-" not in name.split(":")[0]))
+    inputs = dict((service, []) for service in services)
+    common = [os.path.join(config_path, p)
+              for p in sorted(os.listdir(config_path))]
+    common = [p for p in common
+              if os.path.isfile(p) and p != inventory_path]
+    common_sections = []
+    groups = sorted(set(name.split(":")[0] for name in sections))
+    for name, lines in sorted(sections.items()):
+        service = _get_service(name.split(":")[0], services)
+        if service:
+            inputs[service].append([name, lines])
+        elif name.endswith(":vars"):
+            common_sections.append([name, lines])
+    for group in groups:
+        service = _get_service(group, services)
+        if service:
+            hosts = sorted(_get_hosts(sections, group))
+            inputs[service].append([group, hosts])
+    overrides_path = os.path.join(config_path, "config")
+    if os.path.isdir(overrides_path):
+        for name in sorted(os.listdir(overrides_path)):
+            path = os.path.join(overrides_path, name)
+            service = _get_service(os.path.splitext(name)[0], services)
+            if service:
+                inputs[service].append(utils.hash_paths([path]))
+            else:
+                common.append(path)
+    common_fingerprint = json.dumps(
+        [utils.hash_paths(common), common_sections, extra], sort_keys=True)
+    fingerprints = dict(
+        (service, _digest(json.dumps(service_inputs)))
+        for service, service_inputs in inputs.items())
+    return _digest(common_fingerprint), fingerprints
+
+
+def _digest(content):
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def get_state_file(java_role_config_path, node_config_dir):
+    """Return the path to the genconfig state file, or None."""
+    cache_dir = utils.get_cache_dir(java_role_config_path, GENCONFIG_CACHE)
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, _digest(node_config_dir or "") + ".json")
+
+
+def get_changed_services(state_file, fingerprints):
+    """Return the services whose inputs changed since the last genconfig.
+
+    :param state_file: Path to the genconfig state file.
+    :param fingerprints: Fingerprints, as returned by get_fingerprints.
+    :returns: A sorted list of changed services, or None if all services
+              must be generated.
+    """
+    common, services = fingerprints
+    if not os.path.exists(state_file):
+        return None
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (IOError, ValueError) as e:
+        LOG.warning("Ignoring invalid genconfig state %s: %s", state_file, e)
+        return None
+    if state.get("common") != common:
+        return None
+    previous = state.get("services", {})
+    return sorted(service for service, fingerprint in services.items()
+                  if previous.get(service) != fingerprint)
+
+
+def save_state(state_file, fingerprints):
+    """Record the fingerprints of a successful genconfig."""
+    common, services = fingerprints
+    state = {"common": common, "services": services}
+    utils.write_file_atomic(state_file, json.dumps(state), mode=0o600)
@@ -0,0 +1,291 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from java_role import utils
+
+LOG = logging.getLogger(__name__)
+
+# Name of the cache directory holding the compiled inventory.
+INVENTORY_CACHE = "inventory"
+
+# Name of the compiled inventory file. The extension allows it to be loaded
+# by Ansible's yaml inventory plugin.
+COMPILED_INVENTORY = "inventory.json"
+
+MANIFEST = "manifest.json"
+
+# Directories of variables alongside an inventory. These are linked next to
+# the compiled inventory rather than merged into it, since Ansible gives
+# inventory group_vars and host_vars precedence over playbook group_vars and
+# host_vars, but not variables defined in the inventory file itself.
+VARS_DIRS = ("group_vars", "host_vars")
+
+# Magic variables whose values would change if the inventory were compiled,
+# since the compiled inventory lives in the cache directory.
+INVENTORY_PATH_VARS = (b"inventory_dir", b"inventory_file")
+
+
+def _fingerprint(inventory_path):
+    """Return a fingerprint of the names, sizes and mtimes of inventory files.
+
+    This avoids reading the content of every file in the inventory on each
+    run.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(inventory_path):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            st = os.stat(path)
+            digest.update(("%s\0%d\0%d\0" % (
+                os.path.relpath(path, inventory_path), st.st_size,
+                st.st_mtime_ns)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _is_compilable(inventory_path):
+    """Return whether an inventory directory may be compiled.
+
+    Inventories containing executable files, which may be dynamic inventory
+    scripts, or vault-encrypted content cannot be compiled.
+    """
+    for root, dirs, files in os.walk(inventory_path):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.access(path, os.X_OK):
+                LOG.debug("Not compiling inventory with executable file %s",
+                          path)
+                return False
+            try:
+                content = utils.read_file(path, "rb")
+            except IOError:
+                return False
+            if b"$ANSIBLE_VAULT" in content:
+                LOG.debug("Not compiling inventory with vault-encrypted "
+                          "file %s", path)
+                return False
+            if _references_inventory_path(content):
+                LOG.debug("Not compiling inventory with file %s referencing "
+                          "inventory_dir or inventory_file", path)
+                return False
+    return True
+
+
+def _references_inventory_path(content):
+    """Return whether content references inventory_dir or inventory_file."""
+    return any(var in content for var in INVENTORY_PATH_VARS)
+
+
+def _get_ansible_inventory():
+    """Return the ansible-inventory executable of the Ansible in use.
+
+    This is the one alongside ansible-playbook, or failing that alongside
+    the Python interpreter, so that a different Ansible installation earlier
+    in PATH is not used.
+    """
+    candidates = []
+    playbook = shutil.which("ansible-playbook")
+    if playbook:
+        candidates.append(os.path.dirname(playbook))
+    candidates.append(os.path.dirname(sys.executable))
+    for bin_dir in candidates:
+        path = os.path.join(bin_dir, "ansible-inventory")
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return "ansible-inventory"
+
+
+def _build_group(name, groups, hostvars, seen_hosts):
+    """Convert a group from ansible-inventory --list output to YAML format."""
+    group = groups.get(name, {})
+    result = {}
+    if group.get("hosts"):
+        result["hosts"] = {}
+        for host in group["hosts"]:
+            # Host variables only need to be defined once.
+            if host in seen_hosts:
+                result["hosts"][host] = None
+            else:
+                result["hosts"][host] = hostvars.get(host) or None
+                seen_hosts.add(host)
+    if group.get("vars"):
+        result["vars"] = group["vars"]
+    if group.get("children"):
+        result["children"] = dict(
+            (child, _build_group(child, groups, hostvars, seen_hosts))
+            for child in group["children"])
+    return result
+
+
+def _convert(listing):
+    """Convert ansible-inventory --list --export output to YAML format.
+
+    :param listing: Parsed JSON output of ansible-inventory.
+    :returns: A dict in the format of Ansible's yaml inventory plugin.
+    """
+    hostvars = listing.get("_meta", {}).get("hostvars", {})
+    groups = dict((name, group) for name, group in listing.items()
+                  if name != "_meta")
+    return {"all": _build_group("all", groups, hostvars, set())}
+
+
+def _read_manifest(cache_dir):
+    """Read the manifest of an inventory cache, or return None if invalid."""
+    path = os.path.join(cache_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (IOError, ValueError) as e:
+        LOG.warning("Ignoring invalid inventory manifest %s: %s", path, e)
+        return None
+
+
+def _list_inventory(inventory_path):
+    """Return the parsed ansible-inventory listing of an inventory.
+
+    The listing excludes the variables in the inventory's group_vars and
+    host_vars directories, which are linked next to the compiled inventory
+    instead.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        copy_path = os.path.join(tmp_dir, "inventory")
+
+        def _ignore(path, names):
+            if os.path.abspath(path) != os.path.abspath(inventory_path):
+                return []
+            return [name for name in names if name in VARS_DIRS]
+
+        shutil.copytree(inventory_path, copy_path, ignore=_ignore)
+        cmd = [_get_ansible_inventory(), "--inventory", copy_path, "--list",
+               "--export"]
+        return json.loads(utils.run_command(cmd, check_output=True))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def _link_vars_dirs(inventory_path, cache_dir):
+    """Link an inventory's variables directories next to its compiled form."""
+    for name in VARS_DIRS:
+        link = os.path.join(cache_dir, name)
+        if os.path.islink(link):
+            os.unlink(link)
+        elif os.path.isdir(link):
+            shutil.rmtree(link)
+        source = os.path.join(os.path.abspath(inventory_path), name)
+        if os.path.isdir(source):
+            os.symlink(source, link)
+
+
+def compile_inventory(config_path, inventory_path):
+    """Compile an inventory directory into a single JSON inventory file.
+
+    The inventory's group_vars and host_vars directories are linked next to
+    the compiled inventory, preserving the precedence of their variables.
+
+    :param config_path: Path to the JavaRole configuration.
+    :param inventory_path: Path to the inventory directory.
+    :returns: The path to the compiled inventory, or None if the inventory
+              could not be compiled.
+    """
+    cache_dir = utils.get_cache_dir(config_path, INVENTORY_CACHE)
+    if not cache_dir or not os.path.isdir(inventory_path):
+        return None
+    fingerprint = _fingerprint(inventory_path)
+    manifest = {"inventory": inventory_path, "fingerprint": fingerprint,
+                "compiled": False}
+    compiled_path = os.path.join(cache_dir, COMPILED_INVENTORY)
+    if _is_compilable(inventory_path):
+        try:
+            listing = _list_inventory(inventory_path)
+        except (OSError, subprocess.CalledProcessError, ValueError) as e:
+            LOG.warning("Failed to compile inventory %s: %s",
+                        inventory_path, e)
+        else:
+            utils.write_file_atomic(compiled_path,
+                                    json.dumps(_convert(listing)),
+                                    mode=0o600)
+            _link_vars_dirs(inventory_path, cache_dir)
+            manifest["compiled"] = True
+    # Record inventories which could not be compiled, to avoid retrying
+    # until they change.
+    utils.write_file_atomic(os.path.join(cache_dir, MANIFEST),
+                            json.dumps(manifest), mode=0o600)
+    if manifest["compiled"]:
+        LOG.debug("Compiled inventory %s to %s", inventory_path,
+                  compiled_path)
+        return compiled_path
+    return None
+
+
+def _vars_reference_inventory_path(vars_files):
+    """Return whether any variables file references the inventory path."""
+    for path in vars_files:
+        try:
+            content = utils.read_file(path, "rb")
+        except IOError:
+            continue
+        if _references_inventory_path(content):
+            LOG.debug("Not using compiled inventory since %s references "
+                      "inventory_dir or inventory_file", path)
+            return True
+    return False
+
+
+def get_inventory(config_path, inventory_path, vars_files=None):
+    """Return the inventory to pass to Ansible.
+
+    Uses the compiled inventory if it is fresh, and compiles it otherwise.
+    Inventories which are not directories, or which cannot be compiled, are
+    returned unchanged. Since the compiled inventory lives in the cache
+    directory, the original inventory is also used if any inventory or
+    variables file references inventory_dir or inventory_file.
+
+    :param config_path: Path to the JavaRole configuration.
+    :param inventory_path: Path to the inventory.
+    :param vars_files: Optional list of extra variables files.
+    :returns: The path to the inventory to use.
+    """
+    if not os.path.isdir(inventory_path):
+        return inventory_path
+    if vars_files and _vars_reference_inventory_path(vars_files):
+        return inventory_path
+    cache_dir = utils.get_cache_dir(config_path, INVENTORY_CACHE)
+    if not cache_dir:
+        return inventory_path
+    compiled_path = os.path.join(cache_dir, COMPILED_INVENTORY)
+    manifest = _read_manifest(cache_dir)
+    fresh = manifest and manifest.get("inventory") == inventory_path
+    if fresh and manifest.get("fingerprint") == _fingerprint(inventory_path):
+        if manifest.get("compiled") and os.path.exists(compiled_path):
+            return compiled_path
+        if not manifest.get("compiled"):
+            return inventory_path
+    try:
+        return compile_inventory(config_path, inventory_path) or \
+            inventory_path
+    except (IOError, OSError) as e:
+        LOG.warning("Failed to compile inventory %s: %s", inventory_path, e)
+        return inventory_path
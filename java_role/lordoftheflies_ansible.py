@@ -12,13 +12,23 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import concurrent.futures
+import glob
+import hashlib
+import json
 import logging
 import os
 import os.path
+import shutil
 import subprocess
 import sys
+import tempfile
+import urllib.parse
 
+from java_role import facts
+from java_role import genconfig
 from java_role import utils
+from java_role import vault
 
 DEFAULT_CONFIG_PATH = "/etc/lordoftheflies"
 
@@ -28,8 +38,21 @@ DEFAULT_VENV_PATH = "venvs/lordoftheflies-ansible"
 
 VENV_PATH_ENV = "LORDOFTHEFLIES_VENV_PATH"
 
+# Name of the Kolla Ansible distribution, as used in its metadata directory.
+DIST_NAME = "lordoftheflies_ansible"
+
+# Directories in a Kolla Ansible source tree which do not affect its
+# behaviour.
+SOURCE_EXCLUDE = (".git", ".tox", "__pycache__")
+
+# Group of control plane hosts which are run as the first shard.
+DEFAULT_SHARD_CONTROL_GROUP = "control"
+
 LOG = logging.getLogger(__name__)
 
+# Cache of lordoftheflies-ansible executables, keyed by virtualenv path.
+_EXECUTABLE_CACHE = {}
+
 
 def add_args(parser):
     """Add arguments required for running Kolla Ansible to a parser."""
@@ -66,6 +89,38 @@ def add_args(parser):
                              (VENV_PATH_ENV, DEFAULT_VENV_PATH))
 
 
+def add_shard_args(parser):
+    """Add arguments for sharded Kolla Ansible runs to a parser."""
+    parser.add_argument("--lordoftheflies-shards", metavar="N", type=int,
+                        default=1,
+                        help="split hosts into N shards, run as separate "
+                             "Kolla Ansible processes (default=1)")
+    parser.add_argument("--lordoftheflies-shard-groups", metavar="GROUPS",
+                        help="comma-separated list of groups, each of which "
+                             "forms a shard. Hosts in none of the groups form "
+                             "a final shard")
+    parser.add_argument("--lordoftheflies-shard-control-group",
+                        metavar="GROUP", default=DEFAULT_SHARD_CONTROL_GROUP,
+                        help="group of control plane hosts which form the "
+                             "first shard, run to completion before any "
+                             "other shard is started. An empty value "
+                             "disables this (default=%s)" %
+                             DEFAULT_SHARD_CONTROL_GROUP)
+    parser.add_argument("--lordoftheflies-shard-concurrency", metavar="N",
+                        type=int, default=1,
+                        help="maximum number of shards to run at once, 0 for "
+                             "all (default=1)")
+    parser.add_argument("--lordoftheflies-shard-rolling",
+                        action="store_true",
+                        help="run shards in waves of "
+                             "--lordoftheflies-shard-concurrency, waiting for "
+                             "each wave to complete before starting the next")
+    parser.add_argument("--lordoftheflies-shard-failure-budget", metavar="N",
+                        type=int, default=0,
+                        help="number of shards which may fail before no "
+                             "further shards are started (default=0)")
+
+
 def _get_inventory_path(parsed_args, inventory_filename):
     """Return the path to the Kolla inventory."""
     if parsed_args.lordoftheflies_inventory:
@@ -75,38 +130,64 @@ def _get_inventory_path(parsed_args, inventory_filename):
                             inventory_filename)
 
 
-def _validate_args(parsed_args, inventory_filename):
-    """Validate JavaRole Ansible arguments."""
-    result = utils.is_readable_dir(parsed_args.lordoftheflies_config_path)
-    if not result["result"]:
-        LOG.error("Kolla configuration path %s is invalid: %s",
-                  parsed_args.lordoftheflies_config_path, result["message"])
-        sys.exit(1)
+def _get_executable(venv):
+    """Return the path to the lordoftheflies-ansible executable in a venv."""
+    executable = _EXECUTABLE_CACHE.get(venv)
+    if executable is None:
+        executable = os.path.join(os.path.abspath(venv), "bin",
+                                  "lordoftheflies-ansible")
+        _EXECUTABLE_CACHE[venv] = executable
+    return executable
 
-    inventory = _get_inventory_path(parsed_args, inventory_filename)
-    result = utils.is_readable_file(inventory)
-    if not result["result"]:
-        LOG.error("Kolla inventory %s is invalid: %s",
-                  inventory, result["message"])
-        sys.exit(1)
 
-    result = utils.is_readable_dir(parsed_args.lordoftheflies_venv)
-    if not result["result"]:
-        LOG.error("Kolla virtualenv %s is invalid: %s",
-                  parsed_args.lordoftheflies_venv, result["message"])
+def build_env(parsed_args):
+    """Build the environment for running Kolla Ansible.
+
+    This is equivalent to activating the Kolla Ansible virtualenv.
+
+    :returns: A dict of environment variables to set in addition to those of
+              the java_role process.
+    """
+    venv = os.path.abspath(parsed_args.lordoftheflies_venv)
+    env = {
+        "VIRTUAL_ENV": venv,
+        "PATH": os.pathsep.join([os.path.join(venv, "bin"),
+                                 os.environ.get("PATH", os.defpath)]),
+    }
+    env.update(facts.build_env(parsed_args))
+    return env
+
+
+def _validate_args(parsed_args, inventory_filename):
+    """Validate JavaRole Ansible arguments."""
+    checks = [
+        ("Kolla configuration path", parsed_args.lordoftheflies_config_path,
+         "dir"),
+        ("Kolla inventory",
+         _get_inventory_path(parsed_args, inventory_filename), "file"),
+        ("Kolla virtualenv", parsed_args.lordoftheflies_venv, "dir"),
+    ]
+    errors = utils.validate_paths(checks)
+    if not errors:
+        # Only check the executable once the virtualenv is known to exist.
+        errors = utils.validate_paths([
+            ("Kolla Ansible executable",
+             _get_executable(parsed_args.lordoftheflies_venv), "executable"),
+        ])
+    if errors:
+        LOG.error("Invalid Kolla Ansible arguments:\n%s", "\n".join(errors))
         sys.exit(1)
 
 
 def build_args(parsed_args, command, inventory_filename, extra_vars=None,
                tags=None, verbose_level=None, extra_args=None, limit=None):
     """Build arguments required for running Kolla Ansible."""
-    venv_activate = os.path.join(parsed_args.lordoftheflies_venv, "bin", "activate")
-    cmd = [".", venv_activate, "&&"]
-    cmd += ["lordoftheflies-ansible", command]
+    cmd = [_get_executable(parsed_args.lordoftheflies_venv), command]
     if verbose_level:
         cmd += ["-" + "v" * verbose_level]
-    if parsed_args.vault_password_file:
-        cmd += ["--key", parsed_args.vault_password_file]
+    vault_password_file = vault.get_password_file(parsed_args)
+    if vault_password_file:
+        cmd += ["--key", vault_password_file]
     inventory = _get_inventory_path(parsed_args, inventory_filename)
     cmd += ["--inventory", inventory]
     if parsed_args.lordoftheflies_config_path != DEFAULT_CONFIG_PATH:
@@ -120,7 +201,11 @@ def build_args(parsed_args, command, inventory_filename, extra_vars=None,
         for extra_var_name, extra_var_value in extra_vars.items():
             cmd += ["-e", "%s=%s" % (extra_var_name, extra_var_value)]
     if parsed_args.lordoftheflies_limit or limit:
-        limits = [l for l in [parsed_args.lordoftheflies_limit, limit] if l]
+        limits = [pattern
+                  for pattern in [parsed_args.lordoftheflies_limit, limit]
+                  if pattern]
+        # A limit file may only be the first element of a host pattern.
+        limits.sort(key=lambda pattern: not pattern.startswith("@"))
         cmd += ["--limit", ":&".join(limits)]
     if parsed_args.lordoftheflies_skip_tags:
         cmd += ["--skip-tags", parsed_args.lordoftheflies_skip_tags]
@@ -134,9 +219,18 @@ def build_args(parsed_args, command, inventory_filename, extra_vars=None,
 
 def run(parsed_args, command, inventory_filename, extra_vars=None,
         tags=None, quiet=False, verbose_level=None, extra_args=None,
-        limit=None):
-    """Run a Kolla Ansible command."""
+        limit=None, shard=False):
+    """Run a Kolla Ansible command.
+
+    :param shard: Whether to split the hosts into shards, if sharding is
+                  configured by the shard arguments.
+    """
     _validate_args(parsed_args, inventory_filename)
+    if shard and _is_sharded(parsed_args):
+        return _run_sharded(parsed_args, command, inventory_filename,
+                            extra_vars=extra_vars, tags=tags, quiet=quiet,
+                            verbose_level=verbose_level,
+                            extra_args=extra_args, limit=limit)
     cmd = build_args(parsed_args, command,
                      inventory_filename=inventory_filename,
                      extra_vars=extra_vars, tags=tags,
@@ -144,12 +238,344 @@ def run(parsed_args, command, inventory_filename, extra_vars=None,
                      extra_args=extra_args,
                      limit=limit)
     try:
-        utils.run_command(" ".join(cmd), quiet=quiet, shell=True)
+        utils.run_command(cmd, quiet=quiet, env=_get_run_env(parsed_args))
     except subprocess.CalledProcessError as e:
         LOG.error("lordoftheflies-ansible %s exited %d", command, e.returncode)
         sys.exit(e.returncode)
 
 
+def _get_installation_paths(venv):
+    """Return paths identifying the Kolla Ansible installed in a virtualenv.
+
+    These are the virtualenv's configuration, which includes the Python
+    version, and the distribution metadata, which includes the version and
+    the hashes of the installed files.
+
+    :returns: A tuple of a list of paths, and the path to the source tree of
+              an editable install, or None.
+    """
+    venv = os.path.abspath(venv)
+    paths = [os.path.join(venv, "pyvenv.cfg")]
+    source = None
+    pattern = os.path.join(venv, "lib", "python*", "site-packages",
+                           DIST_NAME + "-*.dist-info")
+    for dist_info in sorted(glob.glob(pattern)):
+        paths.append(dist_info)
+        try:
+            with open(os.path.join(dist_info, "direct_url.json")) as f:
+                direct_url = json.load(f)
+        except (IOError, ValueError):
+            continue
+        url = urllib.parse.urlparse(direct_url.get("url", ""))
+        editable = direct_url.get("dir_info", {}).get("editable")
+        if url.scheme == "file" and editable:
+            source = urllib.parse.unquote(url.path)
+    return paths, source
+
+
+def _get_precheck_fingerprint(parsed_args, inventory_filename, **kwargs):
+    """Return a fingerprint of the inputs to Kolla Ansible prechecks.
+
+    This covers the Kolla inventory, the Kolla configuration path, including
+    passwords, the Kolla Ansible virtualenv and version, the source tree of
+    an editable install, and the arguments of the prechecks command,
+    including the limit.
+    """
+    inventory = _get_inventory_path(parsed_args, inventory_filename)
+    cmd = build_args(parsed_args, "prechecks",
+                     inventory_filename=inventory_filename, **kwargs)
+    paths = [inventory, parsed_args.lordoftheflies_config_path]
+    install_paths, source = _get_installation_paths(
+        parsed_args.lordoftheflies_venv)
+    hashes = [utils.hash_paths(paths), utils.hash_paths(install_paths)]
+    if source:
+        hashes.append(utils.hash_paths([source], exclude=SOURCE_EXCLUDE))
+    content = json.dumps([hashes, cmd])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def _get_precheck_cache_file(parsed_args, inventory_filename):
+    """Return the path to the precheck cache file, or None."""
+    config_path = getattr(parsed_args, "config_path", None)
+    if not config_path:
+        return None
+    cache_dir = utils.get_cache_dir(config_path, "prechecks")
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, inventory_filename)
+
+
+def run_prechecks(parsed_args, inventory_filename, force=False, quiet=False,
+                  verbose_level=None, **kwargs):
+    """Run Kolla Ansible prechecks, unless their inputs are unchanged.
+
+    A fingerprint of the inputs is recorded after prechecks pass. Prechecks
+    are skipped while the fingerprint matches.
+
+    :param force: Whether to run prechecks even if inputs are unchanged.
+    """
+    _validate_args(parsed_args, inventory_filename)
+    cache_file = _get_precheck_cache_file(parsed_args, inventory_filename)
+    fingerprint = None
+    if cache_file:
+        fingerprint = _get_precheck_fingerprint(parsed_args,
+                                                inventory_filename, **kwargs)
+        if not force and os.path.exists(cache_file):
+            if utils.read_file(cache_file) == fingerprint:
+                LOG.info("Skipping lordoftheflies-ansible prechecks for %s "
+                         "inventory, inputs are unchanged since prechecks "
+                         "last passed", inventory_filename)
+                return
+    run(parsed_args, "prechecks", inventory_filename, quiet=quiet,
+        verbose_level=verbose_level, **kwargs)
+    if cache_file:
+        utils.write_file_atomic(cache_file, fingerprint, mode=0o600)
+
+
+def run_genconfig(parsed_args, inventory_filename, incremental=False,
+                  extra_vars=None, quiet=False, verbose_level=None):
+    """Run Kolla Ansible genconfig, optionally only for changed services.
+
+    In incremental mode, fingerprints of the inputs to each service are
+    recorded after genconfig succeeds, and subsequent runs pass only the
+    tags of services whose inputs changed. A change to inputs common to all
+    services causes a full run. Incremental mode is not used when a Kolla
+    limit or tags are specified, since the run would not cover all services
+    on all hosts.
+
+    :param incremental: Whether to generate configuration only for services
+                        whose inputs changed.
+    """
+    _validate_args(parsed_args, inventory_filename)
+    state_file = None
+    if incremental:
+        if parsed_args.lordoftheflies_limit or parsed_args.lordoftheflies_tags:
+            LOG.warning("Not using incremental genconfig with a Kolla limit "
+                        "or tags")
+        else:
+            node_config_dir = (extra_vars or {}).get("node_config_directory")
+            state_file = genconfig.get_state_file(
+                getattr(parsed_args, "config_path", None) or "",
+                node_config_dir)
+    tags = None
+    if state_file:
+        cmd = build_args(parsed_args, "genconfig",
+                         inventory_filename=inventory_filename,
+                         extra_vars=extra_vars)
+        fingerprints = genconfig.get_fingerprints(
+            parsed_args.lordoftheflies_config_path,
+            _get_inventory_path(parsed_args, inventory_filename), extra=cmd)
+        services = genconfig.get_changed_services(state_file, fingerprints)
+        if services == []:
+            LOG.info("Skipping lordoftheflies-ansible genconfig for %s "
+                     "inventory, inputs are unchanged", inventory_filename)
+            return
+        if services:
+            LOG.info("Generating configuration for changed services: %s",
+                     ", ".join(services))
+            tags = ",".join(services)
+    run(parsed_args, "genconfig", inventory_filename, extra_vars=extra_vars,
+        tags=tags, quiet=quiet, verbose_level=verbose_level)
+    if state_file:
+        genconfig.save_state(state_file, fingerprints)
+
+
+def _is_sharded(parsed_args):
+    """Return whether shard arguments request a sharded run."""
+    if getattr(parsed_args, "lordoftheflies_shards", 1) > 1:
+        return True
+    return bool(getattr(parsed_args, "lordoftheflies_shard_groups", None))
+
+
+def _list_hosts(parsed_args, inventory_filename, pattern, limit=None):
+    """Return a list of hosts in the Kolla inventory matching a pattern."""
+    venv = os.path.abspath(parsed_args.lordoftheflies_venv)
+    cmd = [os.path.join(venv, "bin", "ansible"), pattern, "--list-hosts",
+           "--inventory", _get_inventory_path(parsed_args, inventory_filename)]
+    limits = [pattern for pattern in [parsed_args.lordoftheflies_limit, limit]
+              if pattern]
+    if limits:
+        cmd += ["--limit", ":&".join(limits)]
+    try:
+        output = utils.run_command(cmd, check_output=True,
+                                   env=_get_run_env(parsed_args))
+    except subprocess.CalledProcessError as e:
+        LOG.error("Failed to list hosts in Kolla inventory %s: returncode "
+                  "%d", inventory_filename, e.returncode)
+        sys.exit(e.returncode)
+    if isinstance(output, bytes):
+        output = output.decode("utf-8")
+    # The first line is a header, e.g. "  hosts (2):".
+    return [line.strip() for line in output.splitlines()[1:] if line.strip()]
+
+
+def _build_shards(parsed_args, inventory_filename, limit=None):
+    """Split the hosts in the Kolla inventory into shards.
+
+    Hosts in the control group are kept together in a separate shard, so
+    that the control plane is not split across shards.
+
+    :returns: A tuple of the list of control hosts, and a list of lists of
+              the remaining hosts. Empty shards are omitted.
+    """
+    hosts = _list_hosts(parsed_args, inventory_filename, "all", limit=limit)
+    control = []
+    if parsed_args.lordoftheflies_shard_control_group:
+        control_hosts = set(_list_hosts(
+            parsed_args, inventory_filename,
+            parsed_args.lordoftheflies_shard_control_group, limit=limit))
+        control = [h for h in hosts if h in control_hosts]
+        hosts = [h for h in hosts if h not in control_hosts]
+    shards = []
+    if parsed_args.lordoftheflies_shard_groups:
+        remaining = list(hosts)
+        for group in parsed_args.lordoftheflies_shard_groups.split(","):
+            group_hosts = set(_list_hosts(parsed_args, inventory_filename,
+                                          group, limit=limit))
+            shards.append([h for h in remaining if h in group_hosts])
+            remaining = [h for h in remaining if h not in group_hosts]
+        shards.append(remaining)
+    else:
+        num_shards = parsed_args.lordoftheflies_shards
+        size = -(-len(hosts) // num_shards)
+        shards = [hosts[i:i + size] for i in range(0, len(hosts), size or 1)]
+    return control, [shard for shard in shards if shard]
+
+
+def _run_sharded(parsed_args, command, inventory_filename, quiet=False,
+                 limit=None, **kwargs):
+    """Run a Kolla Ansible command in shards of hosts.
+
+    Each shard is run as a separate Kolla Ansible process, limited to the
+    hosts in the shard. Hosts in the control group form the first shard,
+    which must succeed before any other shard is started. Up to
+    --lordoftheflies-shard-concurrency of the remaining shards run at once,
+    optionally in rolling waves. Once more shards have failed than the
+    failure budget allows, no further shards are started.
+    """
+    control, shards = _build_shards(parsed_args, inventory_filename,
+                                    limit=limit)
+    if control:
+        shards.insert(0, control)
+    if not shards:
+        LOG.error("No hosts to run lordoftheflies-ansible %s against",
+                  command)
+        sys.exit(1)
+    concurrency = parsed_args.lordoftheflies_shard_concurrency
+    concurrency = concurrency or len(shards)
+    budget = parsed_args.lordoftheflies_shard_failure_budget
+    env = _get_run_env(parsed_args)
+    shard_dir = tempfile.mkdtemp()
+    try:
+        pending = []
+        for index, shard in enumerate(shards):
+            shard_file = os.path.join(shard_dir, "shard-%d" % index)
+            with open(shard_file, "w") as f:
+                f.write("\n".join(shard) + "\n")
+            cmd = build_args(parsed_args, command,
+                             inventory_filename=inventory_filename,
+                             limit="@%s" % shard_file, **kwargs)
+            prefix = "[shard %d/%d]" % (index + 1, len(shards))
+            pending.append((prefix, cmd))
+        LOG.info("Running lordoftheflies-ansible %s in %d shards",
+                 command, len(shards))
+        failures = []
+        if control:
+            failures = _run_shards([pending.pop(0)], 1, False, 0, quiet, env)
+        if not failures:
+            failures = _run_shards(pending, concurrency,
+                                   parsed_args.lordoftheflies_shard_rolling,
+                                   budget, quiet, env)
+    finally:
+        shutil.rmtree(shard_dir)
+    succeeded = len(shards) - len(failures) - len(pending)
+    LOG.info("lordoftheflies-ansible %s: %d shard(s) succeeded, %d failed, "
+             "%d not run", command, succeeded, len(failures), len(pending))
+    if failures:
+        for prefix, returncode in failures:
+            LOG.error("lordoftheflies-ansible %s %s exited %d",
+                      command, prefix, returncode)
+        sys.exit(failures[0][1])
+
+
+def _run_shards(pending, concurrency, rolling, budget, quiet, env):
+    """Run shard commands, consuming the pending list.
+
+    :returns: A list of (prefix, returncode) tuples for failed shards.
+    """
+    failures = []
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as executor:
+        running = {}
+        while pending or running:
+            can_start = len(failures) <= budget and (
+                not rolling or not running)
+            while pending and can_start and len(running) < concurrency:
+                prefix, cmd = pending.pop(0)
+                future = executor.submit(utils.run_command_prefixed, cmd,
+                                         prefix, quiet=quiet, env=env)
+                running[future] = prefix
+            if not running:
+                break
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                prefix = running.pop(future)
+                try:
+                    future.result()
+                except subprocess.CalledProcessError as e:
+                    failures.append((prefix, e.returncode))
+    return failures
+
+
+def _get_run_env(parsed_args):
+    """Return the complete environment for running Kolla Ansible."""
+    env = dict(os.environ, **build_env(parsed_args))
+    # As done by the virtualenv activate script.
+    env.pop("PYTHONHOME", None)
+    return env
+
+
+def run_concurrent(parsed_args, runs, quiet=False, verbose_level=None):
+    """Run Kolla Ansible commands concurrently.
+
+    Each line of output is prefixed with the inventory and command of the
+    run that produced it. All runs are allowed to complete, even if one
+    fails.
+
+    :param runs: A list of dicts of arguments to run, each containing
+                 command and inventory_filename, and optionally extra_vars,
+                 tags, extra_args and limit.
+    """
+    prepared = []
+    for run_args in runs:
+        run_args = dict(run_args)
+        command = run_args.pop("command")
+        inventory_filename = run_args.pop("inventory_filename")
+        _validate_args(parsed_args, inventory_filename)
+        cmd = build_args(parsed_args, command,
+                         inventory_filename=inventory_filename,
+                         verbose_level=verbose_level, **run_args)
+        prepared.append((command, inventory_filename, cmd))
+    env = _get_run_env(parsed_args)
+    with concurrent.futures.ThreadPoolExecutor(len(prepared)) as executor:
+        futures = [
+            (command, inventory_filename,
+             executor.submit(utils.run_command_prefixed, cmd,
+                             "[%s %s]" % (inventory_filename, command),
+                             quiet=quiet, env=env))
+            for command, inventory_filename, cmd in prepared]
+    returncodes = []
+    for command, inventory_filename, future in futures:
+        try:
+            future.result()
+        except subprocess.CalledProcessError as e:
+            LOG.error("lordoftheflies-ansible %s (%s inventory) exited %d",
+                      command, inventory_filename, e.returncode)
+            returncodes.append(e.returncode)
+    if returncodes:
+        sys.exit(returncodes[0])
+
+
 def run_seed(*args, **kwargs):
     """Run a Kolla Ansible command using the seed inventory."""
     return run(*args, inventory_filename="seed", **kwargs)
@@ -0,0 +1,130 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import logging
+import os
+
+from java_role import utils
+
+LOG = logging.getLogger(__name__)
+
+# Name of the cache directory holding Ansible retry files.
+RETRY_CACHE = "retry"
+
+# Default time in seconds to wait before retrying failed hosts.
+DEFAULT_RETRY_DELAY = 30
+
+# Name of the file recording the hosts of the last failed playbook run.
+FAILED_HOSTS_FILE = "failed-hosts"
+
+
+def add_args(parser):
+    """Add arguments required for retrying failed hosts to a parser."""
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="only run on the hosts which failed or were "
+                             "unreachable in the last failed playbook run")
+    parser.add_argument("--retries", metavar="RETRIES", type=int, default=0,
+                        help="number of times to retry a failed playbook "
+                             "run on the hosts which failed or were "
+                             "unreachable (default=0)")
+    parser.add_argument("--retry-delay", metavar="SECONDS", type=float,
+                        default=DEFAULT_RETRY_DELAY,
+                        help="time to wait before the first retry, doubled "
+                             "for each further retry (default=%d)" %
+                             DEFAULT_RETRY_DELAY)
+
+
+def get_cache_path(config_path):
+    """Return the path to the retry files for a JavaRole configuration."""
+    return os.path.join(config_path, ".cache", RETRY_CACHE)
+
+
+def build_env(parsed_args):
+    """Build environment variables which configure Ansible's retry files.
+
+    Ansible writes the hosts which failed or were unreachable in a playbook
+    to <playbook name>.retry under the JavaRole configuration path.
+
+    :returns: A dict of environment variables, which is empty if the
+              configuration path is unknown.
+    """
+    config_path = getattr(parsed_args, "config_path", None)
+    if not config_path:
+        return {}
+    return {
+        "ANSIBLE_RETRY_FILES_ENABLED": "True",
+        "ANSIBLE_RETRY_FILES_SAVE_PATH": get_cache_path(config_path),
+    }
+
+
+def collect_failed_hosts(config_path, playbooks):
+    """Return the hosts in the retry files of some playbooks.
+
+    The retry files are removed.
+
+    :param config_path: Path to the JavaRole configuration.
+    :param playbooks: A list of paths to playbooks.
+    :returns: A list of hosts, in the order in which they were first seen.
+    """
+    hosts = []
+    for playbook in playbooks:
+        name = os.path.splitext(os.path.basename(playbook))[0]
+        path = os.path.join(get_cache_path(config_path), name + ".retry")
+        if not os.path.exists(path):
+            continue
+        with open(path) as f:
+            hosts += [host.strip() for host in f if host.strip()]
+        os.unlink(path)
+    seen = set()
+    return [host for host in hosts if not (host in seen or seen.add(host))]
+
+
+def get_failed_hosts_file(config_path):
+    """Return the path to the file recording the last failed hosts."""
+    return os.path.join(get_cache_path(config_path), FAILED_HOSTS_FILE)
+
+
+def record_failed_hosts(config_path, hosts):
+    """Record the hosts of a failed playbook run.
+
+    :param config_path: Path to the JavaRole configuration.
+    :param hosts: A list of hosts. If empty, any recorded hosts are removed,
+                  since there is no subset of hosts to retry.
+    """
+    path = get_failed_hosts_file(config_path)
+    if not hosts:
+        if os.path.exists(path):
+            os.unlink(path)
+        return
+    if not utils.get_cache_dir(config_path, RETRY_CACHE):
+        return
+    utils.write_file_atomic(path, "".join(host + "\n" for host in hosts),
+                            mode=0o600)
+
+
+def get_failed_hosts_limit(config_path):
+    """Return a host pattern matching the last failed hosts, or None."""
+    path = get_failed_hosts_file(config_path)
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return None
+    return "@" + path
+
+
+def get_delay(parsed_args, attempt):
+    """Return the time to wait before a retry, with exponential backoff.
+
+    :param attempt: Number of retries already made.
+    """
+    delay = getattr(parsed_args, "retry_delay", DEFAULT_RETRY_DELAY)
+    return delay * 2 ** attempt
@@ -0,0 +1,110 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+import json
+import logging
+import os
+import shlex
+
+from java_role import utils
+
+LOG = logging.getLogger(__name__)
+
+# Name of the cache directory holding runbook checkpoints.
+RUNBOOK_CACHE = "runbooks"
+
+
+def load_plan(path):
+    """Load a runbook plan.
+
+    A plan is a YAML file containing a list of steps, either at the top level
+    or under a steps key. Each step is a java_role command, as a string or a
+    list of arguments, or a dict with a command and an optional name.
+
+    :param path: Path to the plan.
+    :returns: A list of steps, as dicts with name and argv items.
+    :raises: ValueError if the plan is invalid.
+    """
+    plan = utils.read_yaml_file(path)
+    steps = plan.get("steps") if isinstance(plan, dict) else plan
+    if not isinstance(steps, list) or not steps:
+        raise ValueError("Runbook %s does not contain a list of steps" % path)
+    result = []
+    for index, step in enumerate(steps, 1):
+        name = None
+        if isinstance(step, dict):
+            name = step.get("name")
+            step = step.get("command")
+        if isinstance(step, str):
+            argv = shlex.split(step)
+        elif isinstance(step, list):
+            argv = [str(arg) for arg in step]
+        else:
+            argv = None
+        if not argv:
+            raise ValueError("Runbook %s step %d has no command" %
+                             (path, index))
+        result.append({"name": name or " ".join(argv), "argv": argv})
+    return result
+
+
+def get_fingerprint(steps):
+    """Return a fingerprint of the steps of a runbook plan."""
+    content = json.dumps([step["argv"] for step in steps])
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def get_checkpoint_file(config_path, plan_path):
+    """Return the path to the checkpoint file of a plan, or None."""
+    cache_dir = utils.get_cache_dir(config_path, RUNBOOK_CACHE)
+    if not cache_dir:
+        return None
+    key = hashlib.sha256(os.path.abspath(plan_path).encode("utf-8"))
+    return os.path.join(cache_dir, key.hexdigest() + ".json")
+
+
+def read_checkpoint(checkpoint_file, fingerprint):
+    """Return the number of completed steps recorded in a checkpoint.
+
+    Checkpoints of a plan whose steps have changed are ignored.
+    """
+    if not checkpoint_file or not os.path.exists(checkpoint_file):
+        return 0
+    try:
+        with open(checkpoint_file) as f:
+            checkpoint = json.load(f)
+    except (IOError, ValueError) as e:
+        LOG.warning("Ignoring invalid runbook checkpoint %s: %s",
+                    checkpoint_file, e)
+        return 0
+    if checkpoint.get("fingerprint") != fingerprint:
+        LOG.warning("Ignoring runbook checkpoint, the plan has changed")
+        return 0
+    return checkpoint.get("completed", 0)
+
+
+def write_checkpoint(checkpoint_file, fingerprint, completed):
+    """Record the number of completed steps of a plan."""
+    if not checkpoint_file:
+        return
+    checkpoint = {"fingerprint": fingerprint, "completed": completed}
+    utils.write_file_atomic(checkpoint_file, json.dumps(checkpoint),
+                            mode=0o600)
+
+
+def clear_checkpoint(checkpoint_file):
+    """Remove the checkpoint of a plan."""
+    if checkpoint_file and os.path.exists(checkpoint_file):
+        os.unlink(checkpoint_file)
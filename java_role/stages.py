@@ -0,0 +1,91 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+import json
+import logging
+import os
+
+from java_role import utils
+
+LOG = logging.getLogger(__name__)
+
+# Name of the cache directory holding command stage state.
+STAGE_CACHE = "stages"
+
+# Names and patterns of files and directories in the JavaRole configuration
+# which do not affect a command: caches, version control metadata, and
+# editor swap and backup files.
+FINGERPRINT_EXCLUDE = (".cache", ".git", ".hg", ".svn", "*.swp", "*.swo",
+                       "*~", ".#*", "#*#")
+
+
+def get_fingerprint(parsed_args, exclude=("resume",)):
+    """Return a fingerprint of the inputs to a multi-stage command.
+
+    This covers the JavaRole configuration, excluding caches, version
+    control metadata and editor temporary files, and the command's
+    arguments.
+
+    :param parsed_args: Parsed command line arguments.
+    :param exclude: Names of arguments which do not affect the command.
+    """
+    args = dict((k, v) for k, v in vars(parsed_args).items()
+                if k not in exclude)
+    content = json.dumps(
+        [utils.hash_paths([parsed_args.config_path],
+                          exclude=FINGERPRINT_EXCLUDE),
+         args], sort_keys=True, default=str)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def get_state_file(config_path, command_name):
+    """Return the path to the stage state file of a command, or None."""
+    cache_dir = utils.get_cache_dir(config_path, STAGE_CACHE)
+    if not cache_dir:
+        return None
+    return os.path.join(cache_dir, command_name + ".json")
+
+
+def read_completed(state_file, fingerprint):
+    """Return the stages of a command which completed with the same inputs.
+
+    :returns: A list of stage names.
+    """
+    if not state_file or not os.path.exists(state_file):
+        return []
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (IOError, ValueError) as e:
+        LOG.warning("Ignoring invalid stage state %s: %s", state_file, e)
+        return []
+    if state.get("fingerprint") != fingerprint:
+        LOG.info("Not resuming, inputs have changed since the last run")
+        return []
+    return state.get("completed", [])
+
+
+def write_completed(state_file, fingerprint, completed):
+    """Record the stages of a command which completed."""
+    if not state_file:
+        return
+    state = {"fingerprint": fingerprint, "completed": completed}
+    utils.write_file_atomic(state_file, json.dumps(state), mode=0o600)
+
+
+def clear(state_file):
+    """Remove the stage state of a command."""
+    if state_file and os.path.exists(state_file):
+        os.unlink(state_file)
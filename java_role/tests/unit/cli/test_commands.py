@@ -12,12 +12,21 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import io
+import json
+import os
+import shutil
+import tempfile
 import unittest
 
 import cliff.app
 import cliff.commandmanager
 import mock
+import six
 
+from java_role import ansible
+from java_role import facts
+from java_role import retry
 from java_role import utils
 from java_role.cli import commands
 
@@ -51,6 +60,24 @@ class TestCase(unittest.TestCase):
         ]
         self.assertEqual(expected_calls, mock_run.call_args_list)
 
+    @mock.patch.object(ansible, "run_playbooks")
+    def test_clear_failed_hosts(self, mock_run):
+        config_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_path)
+        retry.record_failed_hosts(config_path, ["host1"])
+        command = commands.OvercloudBIOSRAIDConfigure(TestApp(), [])
+        command.app.options = mock.Mock(verbose_level=1)
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["--config-path", config_path,
+                                         "--retry-failed"])
+        mock_run.side_effect = SystemExit(2)
+        self.assertRaises(SystemExit, command.run, parsed_args)
+        self.assertIsNotNone(retry.get_failed_hosts_limit(config_path))
+        mock_run.side_effect = None
+        result = command.run(parsed_args)
+        self.assertEqual(0, result)
+        self.assertIsNone(retry.get_failed_hosts_limit(config_path))
+
     @mock.patch.object(utils, "galaxy_install", spec=True)
     @mock.patch.object(commands.JavaRoleAnsibleMixin,
                        "run_java_role_playbooks")
@@ -69,6 +96,344 @@ class TestCase(unittest.TestCase):
         ]
         self.assertEqual(expected_calls, mock_run.call_args_list)
 
+    @mock.patch.object(commands.KollaAnsibleMixin,
+                       "run_lordoftheflies_ansible_concurrent")
+    def test_lordoftheflies_ansible_run_all(self, mock_run):
+        command = commands.KollaAnsibleRun(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(
+            ["--lordoftheflies-inventory-filename", "all", "pull"])
+        result = command.run(parsed_args)
+        self.assertEqual(0, result)
+        expected_runs = [
+            {"command": "pull", "inventory_filename": "seed"},
+            {"command": "pull", "inventory_filename": "overcloud"},
+        ]
+        mock_run.assert_called_once_with(mock.ANY, expected_runs)
+
+    @mock.patch.object(commands.KollaAnsibleMixin,
+                       "run_lordoftheflies_ansible_concurrent")
+    def test_lordoftheflies_ansible_run_all_inventory(self, mock_run):
+        command = commands.KollaAnsibleRun(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(
+            ["--lordoftheflies-inventory-filename", "all",
+             "--lordoftheflies-inventory", "/path/to/inventory", "pull"])
+        self.assertRaises(SystemExit, command.run, parsed_args)
+        self.assertFalse(mock_run.called)
+
+    @mock.patch.object(commands.KollaAnsibleMixin,
+                       "run_lordoftheflies_ansible_prechecks")
+    @mock.patch.object(commands.KollaAnsibleMixin,
+                       "run_lordoftheflies_ansible_overcloud")
+    @mock.patch.object(commands.JavaRoleAnsibleMixin,
+                       "run_java_role_playbooks")
+    def test_overcloud_service_deploy(self, mock_run, mock_kolla_run,
+                                      mock_prechecks):
+        command = commands.OvercloudServiceDeploy(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["--force-prechecks"])
+        result = command.run(parsed_args)
+        self.assertEqual(0, result)
+        mock_prechecks.assert_called_once_with(mock.ANY, "overcloud",
+                                               force=True)
+        expected_calls = [
+            mock.call(mock.ANY, "deploy", shard=True),
+            mock.call(mock.ANY, "post-deploy", extra_vars=mock.ANY),
+        ]
+        self.assertEqual(expected_calls, mock_kolla_run.call_args_list)
+
+    @mock.patch.object(commands.KollaAnsibleMixin,
+                       "run_lordoftheflies_ansible_prechecks")
+    @mock.patch.object(commands.KollaAnsibleMixin,
+                       "run_lordoftheflies_ansible_overcloud")
+    @mock.patch.object(commands.JavaRoleAnsibleMixin,
+                       "run_java_role_playbooks")
+    def test_overcloud_service_deploy_resume(self, mock_run, mock_kolla_run,
+                                             mock_prechecks):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        command = commands.OvercloudServiceDeploy(TestApp(), [])
+        parser = command.get_parser("test")
+        args = ["--config-path", tmp_dir, "--skip-prechecks"]
+
+        # Post-deploy fails.
+        mock_kolla_run.side_effect = [None, SystemExit(2)]
+        parsed_args = parser.parse_args(args)
+        self.assertRaises(SystemExit, command.run, parsed_args)
+        self.assertEqual(3, mock_run.call_count)
+        self.assertEqual(2, mock_kolla_run.call_count)
+
+        # Resume from post-deploy.
+        mock_run.reset_mock()
+        mock_kolla_run.reset_mock()
+        mock_kolla_run.side_effect = None
+        parsed_args = parser.parse_args(args + ["--resume"])
+        result = command.run(parsed_args)
+        self.assertEqual(0, result)
+        mock_kolla_run.assert_called_once_with(mock.ANY, "post-deploy",
+                                               extra_vars=mock.ANY)
+        mock_run.assert_called_once_with(mock.ANY,
+                                         ["ansible/public-openrc.yml"])
+
+        # State is cleared after success.
+        mock_run.reset_mock()
+        result = command.run(parsed_args)
+        self.assertEqual(4, mock_run.call_count)
+
+    @mock.patch.object(commands.KollaAnsibleMixin,
+                       "run_lordoftheflies_ansible_prechecks")
+    @mock.patch.object(commands.KollaAnsibleMixin,
+                       "run_lordoftheflies_ansible_overcloud")
+    @mock.patch.object(commands.JavaRoleAnsibleMixin,
+                       "run_java_role_playbooks")
+    def test_overcloud_service_deploy_resume_changed(self, mock_run,
+                                                     mock_kolla_run,
+                                                     mock_prechecks):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        command = commands.OvercloudServiceDeploy(TestApp(), [])
+        parser = command.get_parser("test")
+        mock_kolla_run.side_effect = SystemExit(2)
+        parsed_args = parser.parse_args(["--config-path", tmp_dir])
+        self.assertRaises(SystemExit, command.run, parsed_args)
+
+        # Arguments changed, all stages run.
+        mock_run.reset_mock()
+        mock_kolla_run.side_effect = None
+        parsed_args = parser.parse_args(["--config-path", tmp_dir,
+                                         "--resume", "--tags", "nova"])
+        result = command.run(parsed_args)
+        self.assertEqual(0, result)
+        self.assertEqual(4, mock_run.call_count)
+        self.assertEqual(2, mock_prechecks.call_count)
+
+    @mock.patch.object(commands.KollaAnsibleMixin,
+                       "run_lordoftheflies_ansible_genconfig")
+    @mock.patch.object(commands.KollaAnsibleMixin,
+                       "run_lordoftheflies_ansible_prechecks")
+    @mock.patch.object(commands.JavaRoleAnsibleMixin,
+                       "run_java_role_playbooks")
+    def test_overcloud_service_configuration_generate_incremental(
+            self, mock_run, mock_prechecks, mock_genconfig):
+        command = commands.OvercloudServiceConfigurationGenerate(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["--node-config-dir", "/tmp/config",
+                                         "--skip-prechecks", "--incremental"])
+        result = command.run(parsed_args)
+        self.assertEqual(0, result)
+        self.assertFalse(mock_prechecks.called)
+        mock_genconfig.assert_called_once_with(
+            mock.ANY, "overcloud", incremental=True,
+            extra_vars={"node_config_directory": "/tmp/config"})
+
+    def _write_runbook(self, tmp_dir):
+        plan = os.path.join(tmp_dir, "plan.yml")
+        with open(plan, "w") as f:
+            f.write("- facts prune\n- facts refresh\n- inventory compile\n")
+        return plan
+
+    def test_runbook_run(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        plan = self._write_runbook(tmp_dir)
+        app = TestApp()
+        app.stdout = six.StringIO()
+        command = commands.RunbookRun(app, [])
+        parser = command.get_parser("test")
+
+        # Second step fails.
+        parsed_args = parser.parse_args(["--config-path", tmp_dir, plan])
+        with mock.patch.object(app, "run_subcommand") as mock_run:
+            mock_run.side_effect = [0, SystemExit(2)]
+            self.assertRaises(SystemExit, command.run, parsed_args)
+        self.assertEqual([mock.call(["facts", "prune"]),
+                          mock.call(["facts", "refresh"])],
+                         mock_run.call_args_list)
+        self.assertIn("failed", app.stdout.getvalue())
+
+        # Resume from the failed step.
+        parsed_args = parser.parse_args(["--config-path", tmp_dir,
+                                         "--resume", plan])
+        with mock.patch.object(app, "run_subcommand") as mock_run:
+            mock_run.return_value = 0
+            result = command.run(parsed_args)
+        self.assertEqual(0, result)
+        self.assertEqual([mock.call(["facts", "refresh"]),
+                          mock.call(["inventory", "compile"])],
+                         mock_run.call_args_list)
+
+        # Checkpoint is cleared after success.
+        with mock.patch.object(app, "run_subcommand") as mock_run:
+            mock_run.return_value = 0
+            result = command.run(parsed_args)
+        self.assertEqual(3, mock_run.call_count)
+
+    @mock.patch.object(commands.vault, "agent_session")
+    @mock.patch.object(commands.vault, "get_password")
+    @mock.patch.dict(os.environ)
+    def test_shell(self, mock_password, mock_session):
+        mock_password.return_value = b"secret"
+        os.environ[ansible.ENGINE_ENV] = "subprocess"
+        app = TestApp()
+        app.interactive_mode = False
+        command = commands.Shell(app, [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["--ask-vault-pass", "--engine",
+                                         "inprocess"])
+
+        def interact():
+            self.assertTrue(app.interactive_mode)
+            self.assertEqual("inprocess", os.environ[ansible.ENGINE_ENV])
+
+        with mock.patch.object(app, "interact") as mock_interact:
+            mock_interact.side_effect = interact
+            result = command.run(parsed_args)
+        self.assertEqual(0, result)
+        self.assertEqual(1, mock_interact.call_count)
+        self.assertFalse(app.interactive_mode)
+        mock_session.assert_called_once_with("secret")
+        self.assertEqual("subprocess", os.environ[ansible.ENGINE_ENV])
+
+    @mock.patch.dict(os.environ)
+    def test_shell_engine_restored_on_error(self):
+        os.environ.pop(ansible.ENGINE_ENV, None)
+        app = TestApp()
+        app.interactive_mode = False
+        command = commands.Shell(app, [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["--engine", "inprocess"])
+        with mock.patch.object(app, "interact") as mock_interact:
+            mock_interact.side_effect = KeyboardInterrupt
+            self.assertRaises(KeyboardInterrupt, command.run, parsed_args)
+        self.assertNotIn(ansible.ENGINE_ENV, os.environ)
+
+    @mock.patch.object(commands.vault, "agent_session")
+    def test_shell_no_vault(self, mock_session):
+        app = TestApp()
+        app.interactive_mode = False
+        command = commands.Shell(app, [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args([])
+        with mock.patch.object(app, "interact"):
+            result = command.run(parsed_args)
+        self.assertEqual(0, result)
+        self.assertFalse(mock_session.called)
+
+    @mock.patch.object(commands.vault, "run_agent")
+    @mock.patch.dict(os.environ, {"JAVA_ROLE_VAULT_PASSWORD": "secret"})
+    def test_vault_agent(self, mock_run):
+        command = commands.VaultAgent(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["--socket", "/sock", "--ttl", "60"])
+        result = command.run(parsed_args)
+        self.assertEqual(0, result)
+        mock_run.assert_called_once_with("secret", "/sock", 60)
+
+    @mock.patch.object(commands.vault, "stop_agent")
+    def test_vault_agent_stop_not_running(self, mock_stop):
+        mock_stop.return_value = False
+        command = commands.VaultAgent(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["--socket", "/sock", "--stop"])
+        self.assertRaises(SystemExit, command.run, parsed_args)
+        mock_stop.assert_called_once_with("/sock")
+
+    @mock.patch.object(commands.vault, "process_files")
+    @mock.patch.object(commands.vault, "get_password")
+    def test_vault_encrypt(self, mock_password, mock_process):
+        mock_password.return_value = b"secret"
+        mock_process.return_value = [("/path/to/a", True, None),
+                                     ("/path/to/b", False, None)]
+        command = commands.VaultEncrypt(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["--workers", "4", "/path/to/a",
+                                         "/path/to/b"])
+        result = command.run(parsed_args)
+        self.assertEqual(0, result)
+        mock_process.assert_called_once_with(
+            "encrypt", ["/path/to/a", "/path/to/b"], b"secret",
+            new_password=None, workers=4)
+
+    @mock.patch.object(commands.vault, "process_files")
+    @mock.patch.object(commands.vault, "get_password")
+    def test_vault_decrypt_failure(self, mock_password, mock_process):
+        mock_password.return_value = b"secret"
+        mock_process.return_value = [("/path/to/a", False, ValueError())]
+        command = commands.VaultDecrypt(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["/path/to/a"])
+        self.assertRaises(SystemExit, command.run, parsed_args)
+
+    @mock.patch.object(commands.vault, "process_files")
+    @mock.patch.object(commands.vault, "get_password")
+    def test_vault_view(self, mock_password, mock_process):
+        mock_password.return_value = b"secret"
+        mock_process.return_value = [("/path/to/a", True, b"var: a\n"),
+                                     ("/path/to/b", True, b"var: b\n")]
+        app = TestApp()
+        app.stdout = six.StringIO()
+        command = commands.VaultView(app, [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["/path/to/a", "/path/to/b"])
+        result = command.run(parsed_args)
+        self.assertEqual(0, result)
+        expected = ("==> /path/to/a <==\nvar: a\n"
+                    "==> /path/to/b <==\nvar: b\n")
+        self.assertEqual(expected, app.stdout.getvalue())
+
+    @mock.patch.object(commands.vault, "process_files")
+    @mock.patch.object(commands.vault, "get_password")
+    def test_vault_view_binary(self, mock_password, mock_process):
+        mock_password.return_value = b"secret"
+        mock_process.return_value = [("/path/to/a", True, b"\xff\x00")]
+        app = TestApp()
+        app.stdout = io.TextIOWrapper(io.BytesIO(), encoding="utf-8")
+        command = commands.VaultView(app, [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["/path/to/a"])
+        result = command.run(parsed_args)
+        self.assertEqual(0, result)
+        self.assertEqual(b"\xff\x00", app.stdout.buffer.getvalue())
+
+    @mock.patch.object(commands.vault, "process_files")
+    @mock.patch.object(commands.vault, "get_password")
+    def test_vault_view_binary_no_buffer(self, mock_password, mock_process):
+        mock_password.return_value = b"secret"
+        mock_process.return_value = [("/path/to/a", True, b"\xff\x00")]
+        app = TestApp()
+        app.stdout = six.StringIO()
+        command = commands.VaultView(app, [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["/path/to/a"])
+        self.assertRaises(SystemExit, command.run, parsed_args)
+
+    @mock.patch.object(commands.vault, "process_files")
+    @mock.patch.object(commands.vault, "get_password")
+    @mock.patch.object(commands.getpass, "getpass")
+    def test_vault_rekey(self, mock_getpass, mock_password, mock_process):
+        mock_getpass.side_effect = ["new", "new"]
+        mock_password.return_value = b"secret"
+        mock_process.return_value = [("/path/to/a", True, None)]
+        command = commands.VaultRekey(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["/path/to/a"])
+        result = command.run(parsed_args)
+        self.assertEqual(0, result)
+        mock_process.assert_called_once_with(
+            "rekey", ["/path/to/a"], b"secret", new_password=b"new",
+            workers=None)
+
+    @mock.patch.object(commands.vault, "process_files")
+    @mock.patch.object(commands.getpass, "getpass")
+    def test_vault_rekey_mismatch(self, mock_getpass, mock_process):
+        mock_getpass.side_effect = ["new", "other"]
+        command = commands.VaultRekey(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["/path/to/a"])
+        self.assertRaises(SystemExit, command.run, parsed_args)
+        self.assertFalse(mock_process.called)
+
     @mock.patch.object(commands.JavaRoleAnsibleMixin,
                        "run_java_role_playbooks")
     def test_network_connectivity_check(self, mock_run):
@@ -82,6 +447,162 @@ class TestCase(unittest.TestCase):
         ]
         self.assertEqual(expected_calls, mock_run.call_args_list)
 
+    @mock.patch.object(commands.JavaRoleAnsibleMixin,
+                       "run_java_role_config_dump")
+    def test_configuration_dump(self, mock_dump):
+        command = commands.ConfigurationDump(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["--var-name", "var1"])
+        mock_dump.return_value = {"host1": "value1"}
+        with mock.patch("sys.stdout", new=six.StringIO()) as mock_stdout:
+            result = command.run(parsed_args)
+        self.assertEqual(0, result)
+        self.assertEqual({"host1": "value1"},
+                         json.loads(mock_stdout.getvalue()))
+        mock_dump.assert_called_once_with(mock.ANY, host=None, hosts=None,
+                                          facts=False, var_name="var1",
+                                          var_names=None, cache=False)
+
+    @mock.patch.object(commands.JavaRoleAnsibleMixin,
+                       "run_java_role_config_dump")
+    def test_configuration_dump_var_names(self, mock_dump):
+        command = commands.ConfigurationDump(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["--var-name", "var1",
+                                         "--var-name", "var2.key[0]",
+                                         "--config-dump-cache"])
+        mock_dump.return_value = {"host1": {"var1": "value1"}}
+        with mock.patch("sys.stdout", new=six.StringIO()):
+            result = command.run(parsed_args)
+        self.assertEqual(0, result)
+        mock_dump.assert_called_once_with(mock.ANY, host=None, hosts=None,
+                                          facts=False, var_name=None,
+                                          var_names=["var1", "var2.key[0]"],
+                                          cache=True)
+
+    @mock.patch.object(commands.JavaRoleAnsibleMixin,
+                       "run_java_role_config_dump_iter")
+    @mock.patch.object(commands.JavaRoleAnsibleMixin,
+                       "run_java_role_config_dump")
+    def test_configuration_dump_ndjson(self, mock_dump, mock_dump_iter):
+        command = commands.ConfigurationDump(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["--output-format", "ndjson"])
+        mock_dump_iter.return_value = iter([("host1", {"var1": "value1"}),
+                                            ("host2", {"var2": "value2"})])
+        with mock.patch("sys.stdout", new=six.StringIO()) as mock_stdout:
+            result = command.run(parsed_args)
+        self.assertEqual(0, result)
+        expected = ('{"host1": {"var1": "value1"}}\n'
+                    '{"host2": {"var2": "value2"}}\n')
+        self.assertEqual(expected, mock_stdout.getvalue())
+        self.assertFalse(mock_dump.called)
+        mock_dump_iter.assert_called_once_with(mock.ANY, hosts=None,
+                                               facts=False, var_name=None,
+                                               var_names=None)
+
+    def test_write_hostvars_stream(self):
+        hostvars = {
+            "host1": {"var1": "value1", "var2": [1, 2]},
+            "host2": {"var3": {"key": "value"}},
+        }
+        stream = six.StringIO()
+        commands._write_hostvars_stream(sorted(hostvars.items()), stream)
+        expected = json.dumps(hostvars, sort_keys=True, indent=4)
+        self.assertEqual(expected, stream.getvalue())
+
+    def test_write_hostvars_stream_empty(self):
+        stream = six.StringIO()
+        commands._write_hostvars_stream([], stream)
+        self.assertEqual("{}", stream.getvalue())
+
+    @mock.patch.object(facts, "invalidate")
+    @mock.patch.object(commands.JavaRoleAnsibleMixin,
+                       "run_java_role_config_dump")
+    def test_facts_refresh(self, mock_dump, mock_invalidate):
+        command = commands.FactsRefresh(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["--config-path", "/path/to/config",
+                                         "--fact-cache-timeout", "60"])
+
+        result = command.run(parsed_args)
+        self.assertEqual(0, result)
+
+        mock_invalidate.assert_called_once_with("/path/to/config")
+        expected_calls = [
+            mock.call(mock.ANY, var_name="inventory_hostname", facts=True,
+                      tags="dump-config"),
+        ]
+        self.assertEqual(expected_calls, mock_dump.call_args_list)
+
+    @mock.patch.object(facts, "invalidate")
+    @mock.patch.object(commands.JavaRoleAnsibleMixin,
+                       "run_java_role_config_dump")
+    def test_facts_refresh_limit(self, mock_dump, mock_invalidate):
+        command = commands.FactsRefresh(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["--config-path", "/path/to/config",
+                                         "--fact-cache-timeout", "60",
+                                         "--limit", "group1"])
+        mock_dump.return_value = {"host1": "host1", "host2": "host2"}
+
+        result = command.run(parsed_args)
+        self.assertEqual(0, result)
+
+        mock_invalidate.assert_called_once_with("/path/to/config",
+                                                ["host1", "host2"])
+        expected_calls = [
+            mock.call(mock.ANY, var_name="inventory_hostname",
+                      tags="dump-config"),
+            mock.call(mock.ANY, var_name="inventory_hostname", facts=True,
+                      tags="dump-config"),
+        ]
+        self.assertEqual(expected_calls, mock_dump.call_args_list)
+
+    @mock.patch.object(facts, "prune")
+    def test_facts_prune(self, mock_prune):
+        command = commands.FactsPrune(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["--config-path", "/path/to/config",
+                                         "--fact-cache-timeout", "60"])
+        mock_prune.return_value = []
+
+        result = command.run(parsed_args)
+        self.assertEqual(0, result)
+
+        mock_prune.assert_called_once_with("/path/to/config", 60)
+
+    @mock.patch.object(facts, "invalidate")
+    @mock.patch.object(commands.JavaRoleAnsibleMixin,
+                       "run_java_role_config_dump")
+    @mock.patch.dict(os.environ)
+    def test_facts_refresh_cache_disabled(self, mock_dump, mock_invalidate):
+        os.environ.pop(facts.FACT_CACHE_TIMEOUT_ENV, None)
+        command = commands.FactsRefresh(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["--config-path", "/path/to/config"])
+        self.assertRaises(SystemExit, command.run, parsed_args)
+        self.assertFalse(mock_invalidate.called)
+        self.assertFalse(mock_dump.called)
+
+    @mock.patch.object(facts, "invalidate")
+    @mock.patch.object(facts, "prune")
+    @mock.patch.dict(os.environ)
+    def test_facts_prune_cache_disabled(self, mock_prune, mock_invalidate):
+        os.environ.pop(facts.FACT_CACHE_TIMEOUT_ENV, None)
+        command = commands.FactsPrune(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["--config-path", "/path/to/config"])
+        self.assertRaises(SystemExit, command.run, parsed_args)
+        self.assertFalse(mock_prune.called)
+        self.assertFalse(mock_invalidate.called)
+        # All facts may be removed with the cache disabled.
+        mock_invalidate.return_value = ["host1"]
+        parsed_args = parser.parse_args(["--config-path", "/path/to/config",
+                                         "--all"])
+        self.assertEqual(0, command.run(parsed_args))
+        mock_invalidate.assert_called_once_with("/path/to/config")
+
     @mock.patch.object(commands.JavaRoleAnsibleMixin,
                        "run_java_role_config_dump")
     @mock.patch.object(commands.JavaRoleAnsibleMixin,
@@ -162,7 +683,11 @@ class TestCase(unittest.TestCase):
         self.assertEqual(0, result)
 
         expected_calls = [
-            mock.call(mock.ANY, hosts="seed", tags="dump-config")
+            mock.call(mock.ANY, hosts="seed",
+                      var_names=["java_role_ansible_user",
+                                 "ansible_python_interpreter",
+                                 "lordoftheflies_ansible_target_venv"],
+                      tags="dump-config")
         ]
         self.assertEqual(expected_calls, mock_dump.call_args_list)
 
@@ -316,6 +841,80 @@ class TestCase(unittest.TestCase):
         ]
         self.assertEqual(expected_calls, mock_lordoftheflies_run.call_args_list)
 
+    @mock.patch.object(commands.JavaRoleAnsibleMixin,
+                       "run_java_role_config_dump")
+    @mock.patch.object(commands.JavaRoleAnsibleMixin,
+                       "run_java_role_playbook_graph")
+    @mock.patch.object(commands.JavaRoleAnsibleMixin,
+                       "run_java_role_playbooks")
+    @mock.patch.object(commands.KollaAnsibleMixin,
+                       "run_lordoftheflies_ansible_seed")
+    def test_seed_host_configure_playbook_workers(
+            self, mock_lordoftheflies_run, mock_run, mock_graph, mock_dump):
+        command = commands.SeedHostConfigure(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args(["--playbook-workers", "4"])
+        mock_dump.return_value = {
+            "seed": {"java_role_ansible_user": "stack"}
+        }
+
+        result = command.run(parsed_args)
+        self.assertEqual(0, result)
+
+        expected_calls = [
+            mock.call(mock.ANY, mock.ANY, workers=4, limit="seed"),
+        ]
+        self.assertEqual(expected_calls, mock_graph.call_args_list)
+        graph = mock_graph.call_args[0][1]
+        self.assertEqual(15, len(graph))
+        self.assertIn(("ansible/ntp.yml", ["ansible/network.yml"]), graph)
+        self.assertEqual(2, mock_run.call_count)
+
+    def test_build_playbook_graph(self):
+        result = commands._build_playbook_graph(
+            "ip-allocation", "users", "yum", "dev-tools", "unknown", "ntp")
+        expected = [
+            ("ansible/ip-allocation.yml", []),
+            ("ansible/users.yml", []),
+            ("ansible/yum.yml", []),
+            ("ansible/dev-tools.yml", ["ansible/yum.yml"]),
+            ("ansible/unknown.yml", [
+                "ansible/ip-allocation.yml",
+                "ansible/users.yml",
+                "ansible/yum.yml",
+                "ansible/dev-tools.yml",
+            ]),
+            ("ansible/ntp.yml", ["ansible/dev-tools.yml"]),
+        ]
+        self.assertEqual(expected, result)
+
+    def test_build_playbook_graph_barriers(self):
+        playbooks = [
+            "ip-allocation", "ssh-known-host", "java_role-ansible-user",
+            "java_role-target-venv", "wipe-disks", "users", "yum",
+            "dev-tools", "disable-selinux", "network", "sysctl",
+            "ip-routing", "snat", "disable-glean", "ntp", "lvm"]
+        graph = commands._build_playbook_graph(*playbooks)
+        dependencies = dict(graph)
+
+        def _ancestors(playbook):
+            result = set()
+            for dep in dependencies[playbook]:
+                result |= {dep} | _ancestors(dep)
+            return result
+
+        # No playbook may run concurrently with a barrier.
+        for barrier in commands.PLAYBOOK_BARRIERS:
+            barrier = "ansible/%s.yml" % barrier
+            before = _ancestors(barrier)
+            for playbook in dependencies:
+                if playbook != barrier and playbook not in before:
+                    self.assertIn(barrier, _ancestors(playbook))
+        self.assertEqual(["ansible/disable-selinux.yml"],
+                         dependencies["ansible/network.yml"])
+        self.assertEqual(["ansible/network.yml"],
+                         dependencies["ansible/ip-routing.yml"])
+
     @mock.patch.object(commands.JavaRoleAnsibleMixin,
                        "run_java_role_playbooks")
     def test_seed_host_upgrade(self, mock_run):
@@ -428,6 +1027,33 @@ class TestCase(unittest.TestCase):
         ]
         self.assertEqual(expected_calls, mock_lordoftheflies_run.call_args_list)
 
+    @mock.patch.object(commands.JavaRoleAnsibleMixin, "_get_verbosity_args",
+                       return_value={})
+    @mock.patch.object(ansible.PlaybookBatch, "flush", autospec=True)
+    @mock.patch.object(ansible, "run_playbooks")
+    def test_overcloud_inventory_discover(self, mock_run, mock_flush,
+                                          mock_verbosity):
+        command = commands.OvercloudInventoryDiscover(TestApp(), [])
+        parser = command.get_parser("test")
+        parsed_args = parser.parse_args([])
+        batch_runs = []
+        mock_flush.side_effect = lambda batch: batch_runs.extend(batch._runs)
+
+        result = command.run(parsed_args)
+        self.assertEqual(0, result)
+
+        expected_runs = [
+            ["ansible/overcloud-inventory-discover.yml"],
+            ["ansible/ip-allocation.yml"],
+            ["ansible/lordoftheflies-bifrost-hostvars.yml"],
+        ]
+        self.assertEqual(expected_runs, batch_runs)
+        expected_calls = [
+            mock.call(mock.ANY, ["ansible/lordoftheflies-ansible.yml"],
+                      tags="config"),
+        ]
+        self.assertEqual(expected_calls, mock_run.call_args_list)
+
     @mock.patch.object(commands.JavaRoleAnsibleMixin,
                        "run_java_role_config_dump")
     @mock.patch.object(commands.JavaRoleAnsibleMixin,
@@ -447,7 +1073,11 @@ class TestCase(unittest.TestCase):
         self.assertEqual(0, result)
 
         expected_calls = [
-            mock.call(mock.ANY, hosts="overcloud", tags="dump-config")
+            mock.call(mock.ANY, hosts="overcloud",
+                      var_names=["java_role_ansible_user",
+                                 "ansible_python_interpreter",
+                                 "lordoftheflies_ansible_target_venv"],
+                      tags="dump-config")
         ]
         self.assertEqual(expected_calls, mock_dump.call_args_list)
 
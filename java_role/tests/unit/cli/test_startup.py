@@ -0,0 +1,110 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import inspect
+import json
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+from cliff.command import Command
+import mock
+
+from java_role.cli import commands
+from java_role.cli import manager
+
+# Maximum time in seconds to build the argument parsers of all commands.
+PARSER_BUDGET = 1.0
+
+# Maximum time in seconds for 'java_role --version'.
+VERSION_BUDGET = 2.0
+
+# Modules which should not be imported by 'java_role --version'.
+HEAVY_MODULES = ["java_role.cli.commands", "java_role.ansible", "six",
+                 "yaml"]
+
+SETUP_CFG = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                         os.pardir, os.pardir, "setup.cfg")
+
+_VERSION_SCRIPT = """
+import json
+import sys
+from java_role.cmd import java_role
+try:
+    java_role.main(["--version"])
+except SystemExit:
+    pass
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def _get_command_classes():
+    classes = [cls for _, cls in inspect.getmembers(commands, inspect.isclass)
+               if cls.__module__ == commands.__name__]
+    return [cls for cls in classes
+            if issubclass(cls, Command) and cls is not Command]
+
+
+class TestCase(unittest.TestCase):
+
+    @mock.patch.dict(os.environ, {"JAVA_ROLE_VAULT_PASSWORD": "test-pass"})
+    @mock.patch.object(subprocess, "Popen")
+    def test_build_parsers_without_subprocesses(self, mock_popen):
+        mock_popen.side_effect = AssertionError("Subprocess spawned")
+        for cls in _get_command_classes():
+            cls(mock.Mock(), []).get_parser("test")
+        self.assertFalse(mock_popen.called)
+
+    def test_build_parsers_budget(self):
+        start = time.time()
+        for cls in _get_command_classes():
+            cls(mock.Mock(), []).get_parser("test")
+        elapsed = time.time() - start
+        self.assertLess(elapsed, PARSER_BUDGET,
+                        "Building command parsers took %.3fs, budget %.3fs" %
+                        (elapsed, PARSER_BUDGET))
+
+    @unittest.skipUnless(os.path.exists(SETUP_CFG), "setup.cfg not found")
+    def test_command_index_up_to_date(self):
+        self.assertEqual(manager.build_index(SETUP_CFG), manager.load_index(),
+                         "Run tools/generate-command-index.py")
+
+    def test_command_manager_lazy(self):
+        command_manager = manager.IndexedCommandManager()
+        self.assertIn("configuration dump", command_manager.commands)
+        command_class, name, args = command_manager.find_command(
+            ["configuration", "dump", "--host", "host1"])
+        self.assertIs(commands.ConfigurationDump, command_class)
+        self.assertEqual("configuration dump", name)
+        self.assertEqual(["--host", "host1"], args)
+
+    def test_command_manager_no_index(self):
+        with mock.patch("cliff.commandmanager.CommandManager.load_commands"
+                        ) as mock_load:
+            manager.IndexedCommandManager(index_file="/path/does/not/exist")
+        mock_load.assert_called_once_with(manager.NAMESPACE)
+
+    def test_version_budget(self):
+        start = time.time()
+        output = subprocess.check_output([sys.executable, "-c",
+                                          _VERSION_SCRIPT],
+                                         stderr=subprocess.STDOUT)
+        elapsed = time.time() - start
+        modules = json.loads(output.decode("utf-8").splitlines()[-1])
+        self.assertEqual([], [m for m in HEAVY_MODULES if m in modules])
+        self.assertLess(elapsed, VERSION_BUDGET,
+                        "java_role --version took %.3fs, budget %.3fs" %
+                        (elapsed, VERSION_BUDGET))
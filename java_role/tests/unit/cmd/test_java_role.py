@@ -0,0 +1,45 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import unittest
+
+from cliff.app import App
+import mock
+
+from java_role import utils
+from java_role.cmd import java_role
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.app = java_role.JavaRoleApp()
+
+    @mock.patch.object(App, "run_subcommand")
+    def test_run_subcommand_exit_interactive(self, mock_run):
+        mock_run.side_effect = SystemExit(3)
+        self.app.interactive_mode = True
+        self.assertEqual(3, self.app.run_subcommand(["facts", "prune"]))
+
+    @mock.patch.object(App, "run_subcommand")
+    def test_run_subcommand_exit(self, mock_run):
+        mock_run.side_effect = SystemExit(3)
+        self.app.interactive_mode = False
+        self.assertRaises(SystemExit, self.app.run_subcommand,
+                          ["facts", "prune"])
+
+    @mock.patch.object(utils, "clear_path_cache")
+    def test_prepare_to_run_command(self, mock_clear):
+        self.app.prepare_to_run_command(mock.Mock())
+        mock_clear.assert_called_once_with()
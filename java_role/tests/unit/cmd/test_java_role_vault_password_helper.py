@@ -0,0 +1,41 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import unittest
+
+import mock
+
+from java_role import vault
+from java_role.cmd import java_role_vault_password_helper as helper
+
+
+class TestCase(unittest.TestCase):
+
+    @mock.patch.object(vault, "get_agent_password")
+    @mock.patch.dict(os.environ, {"JAVA_ROLE_VAULT_PASSWORD": "env"})
+    def test_main_env(self, mock_agent):
+        with mock.patch("sys.stdout") as mock_stdout:
+            helper.main()
+        mock_stdout.write.assert_any_call("env")
+        self.assertFalse(mock_agent.called)
+
+    @mock.patch.object(vault, "get_agent_password")
+    @mock.patch.dict(os.environ)
+    def test_main_agent(self, mock_agent):
+        os.environ.pop("JAVA_ROLE_VAULT_PASSWORD", None)
+        mock_agent.return_value = "agent"
+        with mock.patch("sys.stdout") as mock_stdout:
+            helper.main()
+        mock_stdout.write.assert_any_call("agent")
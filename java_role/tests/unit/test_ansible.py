@@ -13,18 +13,26 @@
 # under the License.
 
 import argparse
+import importlib
 import os
 import shutil
 import subprocess
+import sys
 import tempfile
 import unittest
 
 import mock
 
 from java_role import ansible
+from java_role import engine
+from java_role import inventory
+from java_role import retry
 from java_role import utils
 from java_role import vault
 
+ANSIBLE_PLAYBOOK = os.path.join(os.path.dirname(sys.executable),
+                                "ansible-playbook")
+
 
 class TestCase(unittest.TestCase):
 
@@ -47,7 +55,8 @@ class TestCase(unittest.TestCase):
             "playbook1.yml",
             "playbook2.yml",
         ]
-        mock_run.assert_called_once_with(expected_cmd, quiet=False)
+        mock_run.assert_called_once_with(expected_cmd, quiet=False,
+                                         env=mock.ANY)
         mock_vars.assert_called_once_with("/etc/java_role")
 
     @mock.patch.object(utils, "run_command")
@@ -88,7 +97,8 @@ class TestCase(unittest.TestCase):
             "playbook1.yml",
             "playbook2.yml",
         ]
-        mock_run.assert_called_once_with(expected_cmd, quiet=False)
+        mock_run.assert_called_once_with(expected_cmd, quiet=False,
+                                         env=mock.ANY)
         mock_vars.assert_called_once_with("/path/to/config")
 
     @mock.patch.object(utils, "run_command")
@@ -131,7 +141,8 @@ class TestCase(unittest.TestCase):
             "playbook1.yml",
             "playbook2.yml",
         ]
-        mock_run.assert_called_once_with(expected_cmd, quiet=False)
+        mock_run.assert_called_once_with(expected_cmd, quiet=False,
+                                         env=mock.ANY)
         mock_vars.assert_called_once_with("/path/to/config")
 
     @mock.patch.object(utils, "run_command")
@@ -154,23 +165,25 @@ class TestCase(unittest.TestCase):
             "--inventory", "/etc/java_role/inventory",
             "playbook1.yml",
         ]
-        mock_run.assert_called_once_with(expected_cmd, quiet=False)
+        mock_run.assert_called_once_with(expected_cmd, quiet=False,
+                                         env=mock.ANY)
 
     @mock.patch.dict(os.environ, {"JAVA_ROLE_VAULT_PASSWORD": "test-pass"})
+    @mock.patch.dict(vault._PASSWORD_HELPER_CACHE, clear=True)
+    @mock.patch.object(vault.shutil, "which")
     @mock.patch.object(utils, "run_command")
     @mock.patch.object(ansible, "_get_vars_files")
     @mock.patch.object(ansible, "_validate_args")
     def test_run_playbooks_vault_password_helper(self, mock_validate,
-                                                 mock_vars, mock_run):
+                                                 mock_vars, mock_run,
+                                                 mock_which):
+        mock_which.return_value = "/path/to/java_role-vault-password-helper"
         mock_vars.return_value = []
         parser = argparse.ArgumentParser()
-        mock_run.return_value = "/path/to/java_role-vault-password-helper"
         ansible.add_args(parser)
         vault.add_args(parser)
-        mock_run.assert_called_once_with(
-            ["which", "java_role-vault-password-helper"], check_output=True)
-        mock_run.reset_mock()
         parsed_args = parser.parse_args([])
+        self.assertIsNone(parsed_args.vault_password_file)
         ansible.run_playbooks(parsed_args, ["playbook1.yml"])
         expected_cmd = [
             "ansible-playbook",
@@ -178,7 +191,8 @@ class TestCase(unittest.TestCase):
             "--inventory", "/etc/java_role/inventory",
             "playbook1.yml",
         ]
-        mock_run.assert_called_once_with(expected_cmd, quiet=False)
+        mock_run.assert_called_once_with(expected_cmd, quiet=False,
+                                         env=mock.ANY)
 
     @mock.patch.object(utils, "run_command")
     @mock.patch.object(ansible, "_get_vars_files")
@@ -232,7 +246,8 @@ class TestCase(unittest.TestCase):
             "playbook1.yml",
             "playbook2.yml",
         ]
-        mock_run.assert_called_once_with(expected_cmd, quiet=False)
+        mock_run.assert_called_once_with(expected_cmd, quiet=False,
+                                         env=mock.ANY)
         mock_vars.assert_called_once_with("/etc/java_role")
 
     @mock.patch.object(utils, "run_command")
@@ -247,6 +262,432 @@ class TestCase(unittest.TestCase):
         self.assertRaises(SystemExit,
                           ansible.run_playbooks, parsed_args, ["command"])
 
+    @mock.patch.object(engine, "run_playbooks")
+    @mock.patch.object(utils, "run_command")
+    @mock.patch.object(ansible, "_get_vars_files")
+    @mock.patch.object(ansible, "_validate_args")
+    def test_run_playbooks_inprocess(self, mock_validate, mock_vars,
+                                     mock_run, mock_engine):
+        mock_vars.return_value = []
+        mock_engine.return_value = 0
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["--engine", "inprocess"])
+        ansible.run_playbooks(parsed_args, ["playbook1.yml"])
+        expected_cmd = [
+            "ansible-playbook",
+            "--inventory", "/etc/java_role/inventory",
+            "playbook1.yml",
+        ]
+        mock_engine.assert_called_once_with(expected_cmd, quiet=False,
+                                            env=mock.ANY)
+        self.assertFalse(mock_run.called)
+
+    @mock.patch.object(engine, "run_playbooks")
+    @mock.patch.object(ansible, "_get_vars_files")
+    @mock.patch.object(ansible, "_validate_args")
+    def test_run_playbooks_inprocess_failure(self, mock_validate, mock_vars,
+                                             mock_engine):
+        mock_vars.return_value = []
+        mock_engine.return_value = 2
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["--engine", "inprocess"])
+        self.assertRaises(SystemExit,
+                          ansible.run_playbooks, parsed_args, ["command"])
+
+    def _write_retry_file(self, config_path, name, hosts):
+        path = retry.get_cache_path(config_path)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        with open(os.path.join(path, name), "w") as f:
+            f.write("".join(host + "\n" for host in hosts))
+
+    @mock.patch.object(ansible.time, "sleep")
+    @mock.patch.object(utils, "run_command")
+    @mock.patch.object(ansible, "_get_vars_files")
+    @mock.patch.object(ansible, "_validate_args")
+    def test_run_playbooks_retries(self, mock_validate, mock_vars, mock_run,
+                                   mock_sleep):
+        config_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_path)
+        mock_vars.return_value = []
+
+        def run(cmd, **kwargs):
+            if mock_run.call_count < 3:
+                hosts = ["host1", "host2"] if mock_run.call_count == 1 \
+                    else ["host2"]
+                self._write_retry_file(config_path, "playbook1.retry", hosts)
+                raise subprocess.CalledProcessError(2, "dummy")
+
+        mock_run.side_effect = run
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", config_path,
+                                         "--inventory", "/path/to/inventory",
+                                         "--retries", "2",
+                                         "--retry-delay", "5"])
+        ansible.run_playbooks(parsed_args, ["/path/to/playbook1.yml"],
+                              limit="group1")
+        failed_hosts_file = retry.get_failed_hosts_file(config_path)
+        limits = [call[0][0][call[0][0].index("--limit") + 1]
+                  for call in mock_run.call_args_list]
+        self.assertEqual(["group1",
+                          "@%s:&group1" % failed_hosts_file,
+                          "@%s:&group1" % failed_hosts_file], limits)
+        self.assertEqual([mock.call(5.0), mock.call(10.0)],
+                         mock_sleep.call_args_list)
+        # Failed hosts are only cleared once the whole command succeeds.
+        with open(failed_hosts_file) as f:
+            self.assertEqual("host2\n", f.read())
+
+    @mock.patch.object(ansible.time, "sleep")
+    @mock.patch.object(utils, "run_command")
+    @mock.patch.object(ansible, "_get_vars_files")
+    @mock.patch.object(ansible, "_validate_args")
+    def test_run_playbooks_retries_exhausted(self, mock_validate, mock_vars,
+                                             mock_run, mock_sleep):
+        config_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_path)
+        mock_vars.return_value = []
+
+        def run(cmd, **kwargs):
+            self._write_retry_file(config_path, "playbook1.retry", ["host1"])
+            raise subprocess.CalledProcessError(4, "dummy")
+
+        mock_run.side_effect = run
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", config_path,
+                                         "--retries", "1"])
+        self.assertRaises(SystemExit,
+                          ansible.run_playbooks, parsed_args,
+                          ["playbook1.yml"])
+        self.assertEqual(2, mock_run.call_count)
+        self.assertEqual(1, mock_sleep.call_count)
+
+    @mock.patch.object(ansible.time, "sleep")
+    @mock.patch.object(utils, "run_command")
+    @mock.patch.object(ansible, "_get_vars_files")
+    @mock.patch.object(ansible, "_validate_args")
+    def test_run_playbooks_retries_no_failed_hosts(self, mock_validate,
+                                                   mock_vars, mock_run,
+                                                   mock_sleep):
+        config_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_path)
+        mock_vars.return_value = []
+        mock_run.side_effect = subprocess.CalledProcessError(1, "dummy")
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", config_path,
+                                         "--retries", "3"])
+        self.assertRaises(SystemExit,
+                          ansible.run_playbooks, parsed_args,
+                          ["playbook1.yml"])
+        self.assertEqual(1, mock_run.call_count)
+        self.assertFalse(mock_sleep.called)
+
+    @mock.patch.object(utils, "run_command")
+    @mock.patch.object(ansible, "_get_vars_files")
+    @mock.patch.object(ansible, "_validate_args")
+    def test_run_playbooks_retry_failed(self, mock_validate, mock_vars,
+                                        mock_run):
+        config_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_path)
+        mock_vars.return_value = []
+        retry.record_failed_hosts(config_path, ["host1"])
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", config_path,
+                                         "--inventory", "/path/to/inventory",
+                                         "--limit", "group1",
+                                         "--retry-failed"])
+        ansible.run_playbooks(parsed_args, ["playbook1.yml"])
+        expected_cmd = [
+            "ansible-playbook",
+            "--inventory", "/path/to/inventory",
+            "--limit", "@%s:&group1" % retry.get_failed_hosts_file(
+                config_path),
+            "playbook1.yml",
+        ]
+        mock_run.assert_called_once_with(expected_cmd, quiet=False,
+                                         env=mock.ANY)
+
+    @mock.patch.object(utils, "run_command")
+    @mock.patch.object(ansible, "_get_vars_files")
+    @mock.patch.object(ansible, "_validate_args")
+    def test_run_playbooks_retry_hosts_disabled(self, mock_validate,
+                                                mock_vars, mock_run):
+        config_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_path)
+        mock_vars.return_value = []
+        retry.record_failed_hosts(config_path, ["host1"])
+        failed_hosts_file = retry.get_failed_hosts_file(config_path)
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", config_path,
+                                         "--inventory", "/path/to/inventory",
+                                         "--retry-failed", "--retries", "2"])
+        ansible.run_playbooks(parsed_args, ["playbook1.yml"],
+                              retry_hosts=False)
+        expected_cmd = [
+            "ansible-playbook",
+            "--inventory", "/path/to/inventory",
+            "playbook1.yml",
+        ]
+        mock_run.assert_called_once_with(expected_cmd, quiet=False,
+                                         env=mock.ANY)
+        # The failed hosts are neither cleared nor overwritten.
+        with open(failed_hosts_file) as f:
+            self.assertEqual("host1\n", f.read())
+        mock_run.reset_mock()
+
+        def run(cmd, **kwargs):
+            self._write_retry_file(config_path, "playbook1.retry", ["host2"])
+            raise subprocess.CalledProcessError(2, "dummy")
+
+        mock_run.side_effect = run
+        self.assertRaises(SystemExit, ansible.run_playbooks, parsed_args,
+                          ["playbook1.yml"], retry_hosts=False)
+        self.assertEqual(1, mock_run.call_count)
+        with open(failed_hosts_file) as f:
+            self.assertEqual("host1\n", f.read())
+
+    @mock.patch.object(utils, "run_command")
+    @mock.patch.object(ansible, "_get_vars_files")
+    @mock.patch.object(ansible, "_validate_args")
+    def test_run_playbooks_retry_failed_chained(self, mock_validate,
+                                                mock_vars, mock_run):
+        config_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_path)
+        mock_vars.return_value = []
+        retry.record_failed_hosts(config_path, ["host1"])
+        failed_hosts_file = retry.get_failed_hosts_file(config_path)
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", config_path,
+                                         "--retry-failed"])
+        # Both runs of a command are limited to the recorded hosts.
+        ansible.run_playbooks(parsed_args, ["playbook1.yml"])
+        ansible.run_playbooks(parsed_args, ["playbook2.yml"])
+        limits = [call[0][0][call[0][0].index("--limit") + 1]
+                  for call in mock_run.call_args_list]
+        self.assertEqual(["@" + failed_hosts_file] * 2, limits)
+        self.assertTrue(os.path.exists(failed_hosts_file))
+        ansible.clear_failed_hosts(parsed_args)
+        self.assertIsNone(retry.get_failed_hosts_limit(config_path))
+
+    @mock.patch.object(utils, "run_command")
+    @mock.patch.object(ansible, "_validate_args")
+    def test_run_playbooks_retry_failed_none_recorded(self, mock_validate,
+                                                      mock_run):
+        config_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_path)
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", config_path,
+                                         "--retry-failed"])
+        self.assertRaises(SystemExit,
+                          ansible.run_playbooks, parsed_args,
+                          ["playbook1.yml"])
+        self.assertFalse(mock_run.called)
+
+    @mock.patch.object(utils, "run_command")
+    @mock.patch.object(ansible, "_get_vars_files")
+    @mock.patch.object(ansible, "_validate_args")
+    def test_run_playbook_graph(self, mock_validate, mock_vars, mock_run):
+        mock_vars.return_value = []
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args([])
+        graph = [
+            ("playbook1.yml", []),
+            ("playbook2.yml", ["playbook1.yml"]),
+            ("playbook3.yml", ["playbook1.yml"]),
+            ("playbook4.yml", ["playbook2.yml", "playbook3.yml"]),
+        ]
+        ansible.run_playbook_graph(parsed_args, graph, workers=2,
+                                   limit="group1", quiet=True)
+        mock_validate.assert_called_once_with(
+            parsed_args, ["playbook1.yml", "playbook2.yml", "playbook3.yml",
+                          "playbook4.yml"])
+        run_playbooks = [c[0][0][-1] for c in mock_run.call_args_list]
+        self.assertEqual("playbook1.yml", run_playbooks[0])
+        self.assertEqual({"playbook2.yml", "playbook3.yml"},
+                         set(run_playbooks[1:3]))
+        self.assertEqual("playbook4.yml", run_playbooks[3])
+        expected_cmd = [
+            "ansible-playbook",
+            "--inventory", "/etc/java_role/inventory",
+            "--limit", "group1",
+            "playbook1.yml",
+        ]
+        self.assertEqual(mock.call(expected_cmd, quiet=True, env=mock.ANY),
+                         mock_run.call_args_list[0])
+
+    @mock.patch.object(utils, "run_command")
+    @mock.patch.object(ansible, "_get_vars_files")
+    @mock.patch.object(ansible, "_validate_args")
+    def test_run_playbook_graph_failure(self, mock_validate, mock_vars,
+                                        mock_run):
+        mock_vars.return_value = []
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args([])
+        graph = [
+            ("playbook1.yml", []),
+            ("playbook2.yml", ["playbook1.yml"]),
+            ("playbook3.yml", []),
+        ]
+
+        def _run(cmd, **kwargs):
+            if cmd[-1] == "playbook1.yml":
+                raise subprocess.CalledProcessError(2, cmd, b"failed\n")
+            return b"ok\n"
+
+        mock_run.side_effect = _run
+        with mock.patch("sys.stdout"):
+            self.assertRaises(SystemExit, ansible.run_playbook_graph,
+                              parsed_args, graph, workers=1)
+        run_playbooks = [c[0][0][-1] for c in mock_run.call_args_list]
+        self.assertEqual(["playbook1.yml", "playbook3.yml"], run_playbooks)
+        mock_run.assert_called_with(mock.ANY, check_output=True,
+                                    stderr=subprocess.STDOUT, env=mock.ANY)
+
+    def test_get_critical_path(self):
+        dependencies = {
+            "playbook1.yml": [],
+            "playbook2.yml": ["playbook1.yml"],
+            "playbook3.yml": ["playbook1.yml"],
+            "playbook4.yml": ["playbook2.yml", "playbook3.yml"],
+        }
+        durations = {
+            "playbook1.yml": 1.0,
+            "playbook2.yml": 5.0,
+            "playbook3.yml": 2.0,
+            "playbook4.yml": 1.0,
+        }
+        result = ansible._get_critical_path(dependencies, durations)
+        expected = (["playbook1.yml", "playbook2.yml", "playbook4.yml"], 7.0)
+        self.assertEqual(expected, result)
+
+    @mock.patch.object(utils, "write_yaml_file")
+    @mock.patch.object(ansible, "run_playbooks")
+    def test_playbook_batch(self, mock_run, mock_write):
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args([])
+        with ansible.PlaybookBatch(parsed_args) as batch:
+            batch.add(parsed_args, ["playbook1.yml", "playbook2.yml"],
+                      limit="group1", quiet=True)
+            batch.add(parsed_args, ["playbook3.yml"], limit="group1",
+                      quiet=True)
+            self.assertFalse(mock_run.called)
+        refresh = mock_write.call_args[0][0]
+        mock_write.assert_called_once_with(
+            refresh, ansible.REFRESH_INVENTORY_PLAYBOOK)
+        mock_run.assert_called_once_with(
+            parsed_args,
+            ["playbook1.yml", "playbook2.yml", refresh, "playbook3.yml"],
+            source_inventory=True, limit="group1", quiet=True)
+        self.assertFalse(os.path.exists(os.path.dirname(refresh)))
+
+    @unittest.skipUnless(os.access(ANSIBLE_PLAYBOOK, os.X_OK),
+                         "requires ansible-playbook")
+    def test_playbook_batch_failure(self):
+        # Ansible does not start the next playbook once a host has failed,
+        # so later runs are not started on any host, as with separate runs.
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        hosts = os.path.join(path, "hosts")
+        with open(hosts, "w") as f:
+            for host in ("host0", "host1"):
+                f.write("%s ansible_connection=local "
+                        "ansible_python_interpreter=%s\n" %
+                        (host, sys.executable))
+        playbook1 = os.path.join(path, "playbook1.yml")
+        utils.write_yaml_file(playbook1, [{
+            "hosts": "all", "gather_facts": False,
+            "tasks": [{"fail": {}, "when": "inventory_hostname == 'host0'"}],
+        }])
+        playbook2 = os.path.join(path, "playbook2.yml")
+        utils.write_yaml_file(playbook2, [{
+            "hosts": "all", "gather_facts": False,
+            "tasks": [{"file": {"path": "%s/{{ inventory_hostname }}" % path,
+                                "state": "touch"}}],
+        }])
+        refresh = os.path.join(path, "refresh.yml")
+        utils.write_yaml_file(refresh, ansible.REFRESH_INVENTORY_PLAYBOOK)
+        self.assertRaises(
+            subprocess.CalledProcessError, utils.run_command,
+            [ANSIBLE_PLAYBOOK, "--inventory", hosts, playbook1, refresh,
+             playbook2], quiet=True)
+        self.assertFalse(os.path.exists(os.path.join(path, "host1")))
+
+    @mock.patch.object(inventory, "get_inventory")
+    @mock.patch.object(ansible, "_get_vars_files")
+    def test_build_args_source_inventory(self, mock_vars, mock_get):
+        mock_vars.return_value = []
+        mock_get.return_value = "/path/to/compiled.json"
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["--inventory", "/path/to/inventory"])
+        cmd = ansible.build_args(parsed_args, ["playbook1.yml"])
+        self.assertIn("/path/to/compiled.json", cmd)
+        cmd = ansible.build_args(parsed_args, ["playbook1.yml"],
+                                 source_inventory=True)
+        self.assertIn("/path/to/inventory", cmd)
+        self.assertEqual(1, mock_get.call_count)
+
+    @mock.patch.object(ansible, "run_playbooks")
+    def test_playbook_batch_incompatible(self, mock_run):
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args([])
+        with ansible.PlaybookBatch(parsed_args) as batch:
+            batch.add(parsed_args, ["playbook1.yml"], limit="group1")
+            batch.add(parsed_args, ["playbook2.yml"], limit="group2")
+            batch.add(parsed_args, ["playbook3.yml"], limit="group2",
+                      extra_vars={"var1": "value1"})
+            batch.add(parsed_args, ["playbook4.yml"], limit="group2",
+                      extra_vars={"var1": "value1"}, tags="config")
+        expected_calls = [
+            mock.call(parsed_args, ["playbook1.yml"], limit="group1"),
+            mock.call(parsed_args, ["playbook2.yml"], limit="group2"),
+            mock.call(parsed_args, ["playbook3.yml"], limit="group2",
+                      extra_vars={"var1": "value1"}),
+            mock.call(parsed_args, ["playbook4.yml"], limit="group2",
+                      extra_vars={"var1": "value1"}, tags="config"),
+        ]
+        self.assertEqual(expected_calls, mock_run.call_args_list)
+
+    @mock.patch.object(ansible, "run_playbooks")
+    def test_playbook_batch_exception(self, mock_run):
+        parser = argparse.ArgumentParser()
+        parsed_args = parser.parse_args([])
+
+        def _batch():
+            with ansible.PlaybookBatch(parsed_args) as batch:
+                batch.add(parsed_args, ["playbook1.yml"])
+                raise ValueError()
+
+        self.assertRaises(ValueError, _batch)
+        self.assertFalse(mock_run.called)
+
     @mock.patch.object(shutil, 'rmtree')
     @mock.patch.object(utils, 'read_yaml_file')
     @mock.patch.object(os, 'listdir')
@@ -274,10 +715,281 @@ class TestCase(unittest.TestCase):
                                              "dump_path": dump_dir,
                                          },
                                          quiet=True, tags=None,
-                                         verbose_level=None, check=False)
+                                         verbose_level=None, check=False,
+                                         retry_hosts=False)
         mock_rmtree.assert_called_once_with(dump_dir)
         mock_listdir.assert_called_once_with(dump_dir)
         mock_read.assert_has_calls([
             mock.call(os.path.join(dump_dir, "host1.yml")),
             mock.call(os.path.join(dump_dir, "host2.yml")),
         ])
+
+    @mock.patch.object(ansible, "_run_config_dump")
+    def test_config_dump_cache(self, mock_run):
+        config_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_path)
+        host_vars = os.path.join(config_path, "inventory", "host_vars")
+        os.makedirs(host_vars)
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", config_path])
+        mock_run.return_value = {
+            "host1": {"var1": "value1"},
+            "host2": {"var2": "value2"},
+        }
+        expected_result = {
+            "host1": {"var1": "value1"},
+            "host2": {"var2": "value2"},
+        }
+
+        # Initial dump of all hosts.
+        result = ansible.config_dump(parsed_args, cache=True)
+        self.assertEqual(result, expected_result)
+        self.assertEqual(1, mock_run.call_count)
+
+        # Inputs unchanged.
+        mock_run.reset_mock()
+        result = ansible.config_dump(parsed_args, cache=True)
+        self.assertEqual(result, expected_result)
+        self.assertFalse(mock_run.called)
+
+        # Host variables changed for one host.
+        with open(os.path.join(host_vars, "host1"), "w") as f:
+            f.write("var1: value3")
+        mock_run.return_value = {"host1": {"var1": "value3"}}
+        result = ansible.config_dump(parsed_args, cache=True)
+        expected_result["host1"] = {"var1": "value3"}
+        self.assertEqual(result, expected_result)
+        mock_run.assert_called_once_with(parsed_args, hosts="host1",
+                                         var_name=None, var_names=None,
+                                         extra_vars=None, tags=None,
+                                         verbose_level=None)
+
+        # Global variables changed.
+        mock_run.reset_mock()
+        with open(os.path.join(config_path, "vars.yml"), "w") as f:
+            f.write("var4: value4")
+        mock_run.return_value = {"host1": {"var1": "value3"}}
+        result = ansible.config_dump(parsed_args, cache=True)
+        self.assertEqual(result, {"host1": {"var1": "value3"}})
+        self.assertEqual(1, mock_run.call_count)
+
+    @mock.patch.object(ansible, "_run_config_dump")
+    def test_config_dump_cache_facts(self, mock_run):
+        config_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_path)
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", config_path])
+        mock_run.return_value = {"host1": {"var1": "value1"}}
+        ansible.config_dump(parsed_args, facts=True, cache=True)
+        ansible.config_dump(parsed_args, facts=True, cache=True)
+        self.assertEqual(2, mock_run.call_count)
+        self.assertFalse(os.path.exists(os.path.join(config_path, ".cache")))
+
+    @mock.patch.object(ansible, "_run_config_dump")
+    def test_config_dump_cache_vault(self, mock_run):
+        config_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_path)
+        group_vars = os.path.join(config_path, "inventory", "group_vars")
+        os.makedirs(group_vars)
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", config_path])
+        mock_run.return_value = {"host1": {"var1": "value1"}}
+        ansible.config_dump(parsed_args, cache=True)
+        cache_path = os.path.join(config_path, ".cache", "config-dump")
+        self.assertTrue(os.listdir(cache_path))
+
+        # Decrypted secrets are never cached, and stale entries are removed.
+        with open(os.path.join(group_vars, "all"), "w") as f:
+            f.write("secret: !vault |\n  $ANSIBLE_VAULT;1.1;AES256\n")
+        ansible.config_dump(parsed_args, cache=True)
+        ansible.config_dump(parsed_args, cache=True)
+        self.assertEqual(3, mock_run.call_count)
+        self.assertFalse(os.path.exists(cache_path))
+
+    @mock.patch.object(ansible, "_get_java_role_version")
+    @mock.patch.object(ansible, "_run_config_dump")
+    def test_config_dump_cache_version(self, mock_run, mock_version):
+        config_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_path)
+        os.makedirs(os.path.join(config_path, "inventory"))
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", config_path])
+        mock_run.return_value = {"host1": {"var1": "value1"}}
+        mock_version.return_value = "1.0.0"
+        ansible.config_dump(parsed_args, cache=True)
+        ansible.config_dump(parsed_args, cache=True)
+        self.assertEqual(1, mock_run.call_count)
+        mock_version.return_value = "1.1.0"
+        ansible.config_dump(parsed_args, cache=True)
+        self.assertEqual(2, mock_run.call_count)
+
+    def test_get_java_role_version_pkg_resources(self):
+        # Python releases before 3.8 lack importlib.metadata.
+        mock_pkg_resources = mock.Mock()
+        mock_pkg_resources.get_distribution.return_value.version = "1.0.0"
+        modules = {"importlib.metadata": None,
+                   "pkg_resources": mock_pkg_resources}
+        with mock.patch.dict(sys.modules, modules), \
+                mock.patch.dict(importlib.__dict__):
+            importlib.__dict__.pop("metadata", None)
+            result = ansible._get_java_role_version()
+        self.assertEqual("1.0.0", result)
+        mock_pkg_resources.get_distribution.assert_called_once_with(
+            "java_role")
+
+    def test_get_config_dump_inputs(self):
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", "/path/to/config"])
+        expected = [
+            "/path/to/config/inventory",
+            os.path.abspath("ansible/group_vars"),
+            os.path.abspath("ansible/dump-config.yml"),
+        ]
+        with mock.patch.object(ansible, "_get_vars_files",
+                               return_value=[]):
+            result = ansible._get_config_dump_inputs(parsed_args)
+        self.assertEqual(expected, result)
+
+    @mock.patch.object(engine, "dump_hostvars")
+    @mock.patch.object(ansible, "run_playbook")
+    @mock.patch.object(ansible, "_get_vars_files")
+    @mock.patch.object(ansible, "_validate_args")
+    def test_config_dump_inprocess(self, mock_validate, mock_vars, mock_run,
+                                   mock_dump):
+        mock_vars.return_value = []
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["--engine", "inprocess"])
+        mock_dump.return_value = {"host1": "value1"}
+        result = ansible.config_dump(parsed_args, host="host1",
+                                     var_name="var1")
+        self.assertEqual("value1", result)
+        self.assertFalse(mock_run.called)
+        expected_cmd = [
+            "ansible-playbook",
+            "--inventory", "/etc/java_role/inventory",
+            "ansible/dump-config.yml",
+        ]
+        mock_dump.assert_called_once_with(expected_cmd, hosts="host1",
+                                          var_name="var1", var_names=None,
+                                          env=mock.ANY)
+
+    @mock.patch.object(engine, "dump_hostvars")
+    @mock.patch.object(ansible, "_get_vars_files")
+    @mock.patch.object(ansible, "_validate_args")
+    def test_config_dump_inprocess_failure(self, mock_validate, mock_vars,
+                                           mock_dump):
+        mock_vars.return_value = []
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["--engine", "inprocess"])
+        mock_dump.side_effect = RuntimeError("error")
+        self.assertRaises(SystemExit, ansible.config_dump, parsed_args)
+
+    @mock.patch.object(ansible, "_run_config_dump_inprocess")
+    @mock.patch.object(ansible, "run_playbook")
+    def test_config_dump_inprocess_facts(self, mock_run, mock_inprocess):
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        parsed_args = parser.parse_args(["--engine", "inprocess"])
+        result = ansible.config_dump(parsed_args, facts=True)
+        self.assertEqual({}, result)
+        self.assertEqual(1, mock_run.call_count)
+        self.assertFalse(mock_inprocess.called)
+
+    @mock.patch.object(utils, "read_yaml_file")
+    @mock.patch.object(ansible, "run_playbook")
+    def test_config_dump_iter(self, mock_run, mock_read):
+        parser = argparse.ArgumentParser()
+        parsed_args = parser.parse_args([])
+        dump_dirs = []
+
+        def _run(parsed_args, playbook, extra_vars, **kwargs):
+            dump_dir = extra_vars["dump_path"]
+            dump_dirs.append(dump_dir)
+            for name in ("host2.yml", "host1.yml", "other.txt"):
+                open(os.path.join(dump_dir, name), "w").close()
+
+        mock_run.side_effect = _run
+        mock_read.side_effect = [{"var1": "value1"}, {"var2": "value2"}]
+        result = ansible.config_dump_iter(parsed_args, hosts="group1")
+        self.assertEqual(("host1", {"var1": "value1"}), next(result))
+        # Each dump file is parsed only when it is reached.
+        self.assertEqual(1, mock_read.call_count)
+        self.assertEqual([("host2", {"var2": "value2"})], list(result))
+        self.assertFalse(os.path.exists(dump_dirs[0]))
+
+    @mock.patch.object(ansible, "CONFIG_DUMP_POOL_THRESHOLD", new=2)
+    def test_parse_dump_files_pool(self):
+        dump_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dump_dir)
+        paths = []
+        for i in range(5):
+            ext = ".json" if i % 2 else ".yml"
+            path = os.path.join(dump_dir, "host%d%s" % (i, ext))
+            with open(path, "w") as f:
+                f.write('{"var": %d}' % i)
+            paths.append(path)
+        result = list(ansible._parse_dump_files(paths, workers=2))
+        expected = [(path, {"var": i}) for i, path in enumerate(paths)]
+        self.assertEqual(expected, result)
+
+    @mock.patch.object(utils, "read_yaml_file")
+    @mock.patch.object(ansible, "run_playbook")
+    def test_config_dump_var_names(self, mock_run, mock_read):
+        parser = argparse.ArgumentParser()
+        parsed_args = parser.parse_args([])
+
+        def _run(parsed_args, playbook, extra_vars, **kwargs):
+            self.assertNotIn("dump_var_name", extra_vars)
+            open(os.path.join(extra_vars["dump_path"], "host1.yml"),
+                 "w").close()
+
+        mock_run.side_effect = _run
+        mock_read.return_value = {
+            "var1": "value1",
+            "var2": {"key": [{"nested": "value2"}]},
+        }
+        result = ansible.config_dump(
+            parsed_args, var_names=["var1", "var2.key[0].nested", "var2.x"])
+        expected = {
+            "host1": {"var1": "value1", "var2.key[0].nested": "value2"},
+        }
+        self.assertEqual(expected, result)
+
+    def test_config_dump_var_names_invalid(self):
+        parser = argparse.ArgumentParser()
+        parsed_args = parser.parse_args([])
+        self.assertRaises(SystemExit, ansible.config_dump, parsed_args,
+                          var_names=["var1[x]"])
+
+    @mock.patch.object(ansible.LOG, "error")
+    def test_validate_args_aggregated(self, mock_error):
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", "/path/to/config"])
+        self.assertRaises(SystemExit, ansible._validate_args, parsed_args,
+                          ["playbook1.yml"])
+        self.assertEqual(1, mock_error.call_count)
+        errors = mock_error.call_args[0][1]
+        self.assertIn("/path/to/config is invalid", errors)
+        self.assertIn("/path/to/config/inventory is invalid", errors)
+        self.assertIn("playbook1.yml is invalid", errors)
+
+    def test_get_vars_files(self):
+        config_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, config_path)
+        for name in ("vars1.yml", "vars2.json", "other.txt"):
+            open(os.path.join(config_path, name), "w").close()
+        os.mkdir(os.path.join(config_path, "dir.yml"))
+        result = ansible._get_vars_files(config_path)
+        expected = [os.path.join(config_path, "vars1.yml"),
+                    os.path.join(config_path, "vars2.json")]
+        self.assertEqual(sorted(expected), sorted(result))
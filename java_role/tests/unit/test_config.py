@@ -0,0 +1,152 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from java_role import config
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config_path = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.config_path, ".cache",
+                                      config.BUNDLE_CACHE)
+
+    def tearDown(self):
+        shutil.rmtree(self.config_path)
+
+    def _write(self, name, content):
+        path = os.path.join(self.config_path, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def _read_bundle(self, path):
+        with open(path) as f:
+            return json.load(f)
+
+    def test_compile_vars(self):
+        vars_files = [
+            self._write("a.yml", "var1: a\nvar2: a\n"),
+            self._write("b.json", '{"var2": "b", "var3": "b"}'),
+            self._write("c.yml", "$ANSIBLE_VAULT;1.1;AES256\n0123\n"),
+            self._write("d.yml", "var3: d\n"),
+        ]
+        result = config.compile_vars(self.config_path, vars_files)
+        expected = [
+            os.path.join(self.cache_dir, "bundle-1.json"),
+            vars_files[2],
+            os.path.join(self.cache_dir, "bundle-2.json"),
+        ]
+        self.assertEqual(expected, result)
+        self.assertEqual({"var1": "a", "var2": "b", "var3": "b"},
+                         self._read_bundle(result[0]))
+        self.assertEqual({"var3": "d"}, self._read_bundle(result[2]))
+
+    def test_compile_vars_unsafe_tag(self):
+        vars_files = [
+            self._write("a.yml", "var1: a\n"),
+            self._write("b.yml", "var2: !unsafe '{{ b }}'\n"),
+        ]
+        result = config.compile_vars(self.config_path, vars_files)
+        expected = [
+            os.path.join(self.cache_dir, "bundle-1.json"),
+            vars_files[1],
+        ]
+        self.assertEqual(expected, result)
+
+    def test_compile_vars_no_config_path(self):
+        vars_files = ["/path/to/a.yml", "/path/to/b.yml"]
+        result = config.compile_vars("/path/does/not/exist", vars_files)
+        self.assertEqual(vars_files, result)
+
+    def test_get_vars_files(self):
+        vars_files = [
+            self._write("a.yml", "var1: a\n"),
+            self._write("b.yml", "var1: b\n"),
+        ]
+        bundle = os.path.join(self.cache_dir, "bundle-1.json")
+        result = config.get_vars_files(self.config_path, vars_files)
+        self.assertEqual([bundle], result)
+
+        # Fresh bundle is reused.
+        with mock.patch.object(config, "compile_vars") as mock_compile:
+            result = config.get_vars_files(self.config_path, vars_files)
+        self.assertEqual([bundle], result)
+        self.assertFalse(mock_compile.called)
+
+        # Modified file causes recompilation.
+        self._write("b.yml", "var1: modified\n")
+        os.utime(vars_files[1], (0, 0))
+        result = config.get_vars_files(self.config_path, vars_files)
+        self.assertEqual([bundle], result)
+        self.assertEqual({"var1": "modified"}, self._read_bundle(bundle))
+
+        # Removed file causes recompilation.
+        result = config.get_vars_files(self.config_path, vars_files[:1] * 2)
+        self.assertEqual([bundle], result)
+        self.assertEqual({"var1": "a"}, self._read_bundle(bundle))
+
+    def test_get_vars_files_touched(self):
+        vars_files = [
+            self._write("a.yml", "var1: a\n"),
+            self._write("b.yml", "var1: b\n"),
+        ]
+        config.get_vars_files(self.config_path, vars_files)
+        os.utime(vars_files[1], (0, 0))
+        with mock.patch.object(config, "compile_vars") as mock_compile:
+            config.get_vars_files(self.config_path, vars_files)
+        self.assertFalse(mock_compile.called)
+
+    @mock.patch.dict(os.environ, {"ANSIBLE_HASH_BEHAVIOUR": "merge"})
+    def test_get_vars_files_hash_merge(self):
+        vars_files = [
+            self._write("a.yml", "var1: a\n"),
+            self._write("b.yml", "var1: b\n"),
+        ]
+        result = config.get_vars_files(self.config_path, vars_files)
+        self.assertEqual(vars_files, result)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_get_vars_files_hash_merge_ansible_cfg(self):
+        cfg = self._write("ansible.cfg",
+                          "[defaults]\nhash_behaviour = merge\n")
+        vars_files = [
+            self._write("a.yml", "var1: a\n"),
+            self._write("b.yml", "var1: b\n"),
+        ]
+        with mock.patch.dict(os.environ, {"ANSIBLE_CONFIG": cfg}):
+            os.environ.pop("ANSIBLE_HASH_BEHAVIOUR", None)
+            result = config.get_vars_files(self.config_path, vars_files)
+        self.assertEqual(vars_files, result)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_get_hash_behaviour(self):
+        cfg = self._write("ansible.cfg",
+                          "[defaults]\nhash_behaviour = merge\n")
+        with mock.patch.dict(os.environ, {"ANSIBLE_CONFIG": cfg}):
+            os.environ.pop("ANSIBLE_HASH_BEHAVIOUR", None)
+            self.assertEqual("merge", config.get_hash_behaviour())
+            os.environ["ANSIBLE_HASH_BEHAVIOUR"] = "replace"
+            self.assertEqual("replace", config.get_hash_behaviour())
+        with mock.patch.dict(os.environ, {"ANSIBLE_CONFIG": self.config_path}):
+            os.environ.pop("ANSIBLE_HASH_BEHAVIOUR", None)
+            self.assertEqual("merge", config.get_hash_behaviour())
@@ -0,0 +1,190 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import importlib.util
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import mock
+
+from java_role import engine
+
+HAS_ANSIBLE = importlib.util.find_spec("ansible") is not None
+
+PLAYBOOK = """---
+- hosts: all
+  gather_facts: false
+  vars:
+    state: "{{ marker | default('unset') }}"
+    sfx: "{{ suffix | default('') }}"
+  tasks:
+    - file:
+        path: "{{ out }}/%s-{{ inventory_hostname }}-{{ state }}{{ sfx }}"
+        state: touch
+    - set_fact:
+        marker: set
+    - add_host:
+        name: added
+        ansible_connection: local
+      run_once: true
+"""
+
+DUMP_PLAYBOOK = """---
+- hosts: all
+  gather_facts: false
+  tasks:
+    - copy:
+        content: "{{ {'var1': var1, 'var2': var2,
+                      'playbook_dir': playbook_dir} | to_json }}"
+        dest: "{{ out }}/{{ inventory_hostname }}.json"
+"""
+
+
+class TestCase(unittest.TestCase):
+
+    @mock.patch.object(engine, "_run")
+    def test_run_playbooks(self, mock_run):
+        mock_run.return_value = 0
+        cmd = ["ansible-playbook", "playbook1.yml"]
+        result = engine.run_playbooks(cmd)
+        self.assertEqual(0, result)
+        mock_run.assert_called_once_with(cmd)
+
+    @mock.patch.object(engine, "_run")
+    def test_run_playbooks_quiet(self, mock_run):
+        def _run(cmd):
+            print("hidden output")
+            return 2
+
+        mock_run.side_effect = _run
+        cmd = ["ansible-playbook", "playbook1.yml"]
+        with mock.patch("sys.stdout") as mock_stdout:
+            result = engine.run_playbooks(cmd, quiet=True)
+        self.assertEqual(2, result)
+        self.assertFalse(mock_stdout.write.called)
+
+    @mock.patch.object(engine, "_run")
+    def test_run_playbooks_env(self, mock_run):
+        def _run(cmd):
+            self.assertEqual("new", os.environ["JAVA_ROLE_TEST_SET"])
+            self.assertEqual("new", os.environ["JAVA_ROLE_TEST_UNSET"])
+            return 0
+
+        mock_run.side_effect = _run
+        env = {"JAVA_ROLE_TEST_SET": "new", "JAVA_ROLE_TEST_UNSET": "new"}
+        with mock.patch.dict(os.environ, {"JAVA_ROLE_TEST_SET": "old"}):
+            engine.run_playbooks(["ansible-playbook", "playbook1.yml"],
+                                 env=env)
+            self.assertEqual("old", os.environ["JAVA_ROLE_TEST_SET"])
+            self.assertNotIn("JAVA_ROLE_TEST_UNSET", os.environ)
+
+
+@unittest.skipUnless(HAS_ANSIBLE, "requires ansible")
+class TestRunPlaybooksInProcess(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.out = os.path.join(self.path, "out")
+        os.mkdir(self.out)
+        self.inventory = os.path.join(self.path, "hosts")
+        with open(self.inventory, "w") as f:
+            f.write("host0 ansible_connection=local "
+                    "ansible_python_interpreter=%s\n"
+                    "host1 ansible_connection=local "
+                    "ansible_python_interpreter=%s\n" %
+                    (sys.executable, sys.executable))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def _write_playbook(self, name):
+        path = os.path.join(self.path, name + ".yml")
+        with open(path, "w") as f:
+            f.write(PLAYBOOK % name)
+        return path
+
+    def test_run_playbooks_twice(self):
+        pb1 = self._write_playbook("pb1")
+        pb2 = self._write_playbook("pb2")
+        cmd = ["ansible-playbook", "--inventory", self.inventory,
+               "-e", "out=%s" % self.out]
+        self.assertEqual(0, engine.run_playbooks(cmd + [pb1], quiet=True))
+        self.assertEqual(0, engine.run_playbooks(
+            cmd + ["-e", "suffix=-2", "--limit", "host0", pb2], quiet=True))
+        # The second run uses its own playbook, limit and extra vars, and
+        # does not see hosts or facts added by the first.
+        expected = ["pb1-host0-unset", "pb1-host1-unset",
+                    "pb2-host0-unset-2"]
+        self.assertEqual(expected, sorted(os.listdir(self.out)))
+
+    def test_dump_hostvars(self):
+        with open(os.path.join(self.path, "vars.yml"), "w") as f:
+            f.write("var1: \"{{ hostvars['host1'].var2 }}\"\n"
+                    "var2: \"{{ value }}-{{ inventory_hostname }}\"\n")
+        pb = self._write_playbook("pb")
+        cmd = ["ansible-playbook", "--inventory", self.inventory,
+               "-e", "@%s" % os.path.join(self.path, "vars.yml")]
+        result = engine.dump_hostvars(cmd + ["-e", "value=one", pb],
+                                      var_names=["var1", "var2"])
+        expected = {
+            "host0": {"var1": "one-host1", "var2": "one-host0"},
+            "host1": {"var1": "one-host1", "var2": "one-host1"},
+        }
+        self.assertEqual(expected, result)
+        # A second dump uses its own arguments.
+        result = engine.dump_hostvars(cmd + ["-e", "value=two", "--limit",
+                                             "host0", pb], var_name="var1")
+        self.assertEqual({"host0": "two-host1"}, result)
+
+    def test_dump_hostvars_all(self):
+        pb = self._write_playbook("pb")
+        cmd = ["ansible-playbook", "--inventory", self.inventory,
+               "-e", "var1=value1", pb]
+        result = engine.dump_hostvars(cmd, hosts="host0")
+        self.assertEqual(["host0"], list(result))
+        self.assertEqual("value1", result["host0"]["var1"])
+        self.assertNotIn("hostvars", result["host0"])
+
+    def test_dump_hostvars_undefined(self):
+        pb = self._write_playbook("pb")
+        cmd = ["ansible-playbook", "--inventory", self.inventory, pb]
+        self.assertRaises(RuntimeError, engine.dump_hostvars, cmd,
+                          var_name="missing")
+
+    def test_dump_hostvars_playbook_parity(self):
+        # Variables adjacent to the playbook are loaded, as for the
+        # configuration dump playbook.
+        playbook_dir = os.path.join(self.path, "ansible")
+        os.makedirs(os.path.join(playbook_dir, "group_vars"))
+        with open(os.path.join(playbook_dir, "group_vars", "all"), "w") as f:
+            f.write("var1: playbook-all\n"
+                    "var2: \"{{ var1 }}-{{ inventory_hostname }}\"\n")
+        pb = os.path.join(playbook_dir, "dump.yml")
+        with open(pb, "w") as f:
+            f.write(DUMP_PLAYBOOK)
+        cmd = ["ansible-playbook", "--inventory", self.inventory]
+        self.assertEqual(0, engine.run_playbooks(
+            cmd + ["-e", "out=%s" % self.out, pb], quiet=True))
+        expected = {}
+        for host in ("host0", "host1"):
+            with open(os.path.join(self.out, host + ".json")) as f:
+                expected[host] = json.load(f)
+        result = engine.dump_hostvars(
+            cmd + [pb], var_names=["var1", "var2", "playbook_dir"])
+        self.assertEqual(expected, result)
+        self.assertEqual("playbook-all-host0", result["host0"]["var2"])
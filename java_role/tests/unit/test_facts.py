@@ -0,0 +1,99 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock
+
+from java_role import ansible
+from java_role import facts
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config_path = tempfile.mkdtemp()
+        self.cache_path = facts.get_cache_path(self.config_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.config_path)
+
+    def _write_facts(self, *hosts):
+        os.makedirs(self.cache_path)
+        for host in hosts:
+            with open(os.path.join(self.cache_path, host), "w") as f:
+                f.write("{}")
+
+    @mock.patch.dict(os.environ, clear=True)
+    def test_build_env(self):
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", "/path/to/config",
+                                         "--fact-cache-timeout", "86400"])
+        result = facts.build_env(parsed_args)
+        expected = {
+            "ANSIBLE_GATHERING": "smart",
+            "ANSIBLE_CACHE_PLUGIN": "jsonfile",
+            "ANSIBLE_CACHE_PLUGIN_CONNECTION": "/path/to/config/.cache/facts",
+            "ANSIBLE_CACHE_PLUGIN_PREFIX": "",
+            "ANSIBLE_CACHE_PLUGIN_TIMEOUT": "86400",
+        }
+        self.assertEqual(expected, result)
+
+    @mock.patch.dict(os.environ, clear=True)
+    def test_build_env_disabled(self):
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        parsed_args = parser.parse_args([])
+        self.assertEqual({}, facts.build_env(parsed_args))
+
+    def test_build_env_ansible_env(self):
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        parsed_args = parser.parse_args(["--fact-cache-timeout", "86400"])
+        for name in ("ANSIBLE_GATHERING", "ANSIBLE_CACHE_PLUGIN"):
+            with mock.patch.dict(os.environ, {name: "value"}, clear=True):
+                self.assertEqual({}, facts.build_env(parsed_args))
+
+    def test_build_env_no_config_path(self):
+        parsed_args = argparse.Namespace()
+        self.assertEqual({}, facts.build_env(parsed_args))
+
+    def test_invalidate(self):
+        self._write_facts("host1", "host2", "host3")
+        result = facts.invalidate(self.config_path, ["host1", "host3"])
+        self.assertEqual(["host1", "host3"], result)
+        self.assertEqual(["host2"], os.listdir(self.cache_path))
+
+    def test_invalidate_all(self):
+        self._write_facts("host1", "host2")
+        result = facts.invalidate(self.config_path)
+        self.assertEqual(["host1", "host2"], result)
+        self.assertEqual([], os.listdir(self.cache_path))
+
+    def test_invalidate_no_cache(self):
+        self.assertEqual([], facts.invalidate(self.config_path))
+
+    def test_prune(self):
+        self._write_facts("host1", "host2")
+        old = time.time() - 100
+        os.utime(os.path.join(self.cache_path, "host1"), (old, old))
+        result = facts.prune(self.config_path, 50)
+        self.assertEqual(["host1"], result)
+        self.assertEqual(["host2"], os.listdir(self.cache_path))
@@ -0,0 +1,126 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from java_role import genconfig
+
+INVENTORY = """
+[control]
+host1
+
+[nova:children]
+control
+
+[nova-api:children]
+nova
+
+[glance:children]
+control
+"""
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config_path = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.config_path, "config"))
+        self.inventory_path = self._write("overcloud", INVENTORY)
+        self._write("globals.yml", "var: value\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.config_path)
+
+    def _write(self, name, content):
+        path = os.path.join(self.config_path, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def _get_fingerprints(self):
+        return genconfig.get_fingerprints(self.config_path,
+                                          self.inventory_path)
+
+    def test_get_fingerprints_services(self):
+        common, services = self._get_fingerprints()
+        self.assertEqual(["glance", "nova"], sorted(services))
+
+    def test_get_fingerprints_service_override(self):
+        common, services = self._get_fingerprints()
+        self._write("config/nova-api.conf", "[DEFAULT]\n")
+        new_common, new_services = self._get_fingerprints()
+        self.assertEqual(common, new_common)
+        self.assertNotEqual(services["nova"], new_services["nova"])
+        self.assertEqual(services["glance"], new_services["glance"])
+
+    def test_get_fingerprints_common_override(self):
+        common, _ = self._get_fingerprints()
+        self._write("config/global.conf", "[DEFAULT]\n")
+        new_common, _ = self._get_fingerprints()
+        self.assertNotEqual(common, new_common)
+
+    def test_get_changed_services(self):
+        state_file = os.path.join(self.config_path, "state.json")
+        fingerprints = self._get_fingerprints()
+        self.assertIsNone(genconfig.get_changed_services(state_file,
+                                                         fingerprints))
+        genconfig.save_state(state_file, fingerprints)
+        self.assertEqual([], genconfig.get_changed_services(state_file,
+                                                            fingerprints))
+        common, services = fingerprints
+        services = dict(services, glance="changed")
+        self.assertEqual(["glance"], genconfig.get_changed_services(
+            state_file, (common, services)))
+        self.assertIsNone(genconfig.get_changed_services(
+            state_file, ("changed", services)))
+
+    def test_get_fingerprints_group_membership(self):
+        common, services = self._get_fingerprints()
+        self._write("overcloud", INVENTORY.replace("host1", "host1\nhost2"))
+        new_common, new_services = self._get_fingerprints()
+        self.assertEqual(common, new_common)
+        self.assertNotEqual(services["nova"], new_services["nova"])
+        self.assertNotEqual(services["glance"], new_services["glance"])
+
+    def test_get_fingerprints_unused_group_membership(self):
+        self._write("overcloud", INVENTORY + "\n[compute]\n")
+        common, services = self._get_fingerprints()
+        self._write("overcloud", INVENTORY + "\n[compute]\nhost2\n")
+        new_common, new_services = self._get_fingerprints()
+        self.assertEqual(common, new_common)
+        self.assertEqual(services, new_services)
+
+    def test_get_changed_services_group_membership(self):
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+        state_file = os.path.join(state_dir, "state.json")
+        inventory = INVENTORY + "\n[compute]\nhost2\n"
+        inventory += "\n[cinder:children]\ncompute\n"
+        self._write("overcloud", inventory)
+        fingerprints = self._get_fingerprints()
+        genconfig.save_state(state_file, fingerprints)
+        self.assertEqual([], genconfig.get_changed_services(
+            state_file, fingerprints))
+        self._write("overcloud", inventory.replace("host2", "host2\nhost3"))
+        self.assertEqual(["cinder"], genconfig.get_changed_services(
+            state_file, self._get_fingerprints()))
+
+    def test_get_fingerprints_group_vars(self):
+        common, _ = self._get_fingerprints()
+        self._write("overcloud", INVENTORY + "\n[control:vars]\nfoo=bar\n")
+        new_common, _ = self._get_fingerprints()
+        self.assertNotEqual(common, new_common)
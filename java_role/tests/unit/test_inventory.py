@@ -0,0 +1,238 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import mock
+
+from java_role import inventory
+from java_role import utils
+
+ANSIBLE_PLAYBOOK = os.path.join(os.path.dirname(sys.executable),
+                                "ansible-playbook")
+
+LISTING = {
+    "_meta": {
+        "hostvars": {
+            "host1": {"var1": "value1"},
+        },
+    },
+    "all": {
+        "children": ["group1", "ungrouped"],
+    },
+    "group1": {
+        "hosts": ["host1", "host2"],
+        "vars": {"var2": "value2"},
+    },
+    "group2": {
+        "hosts": ["host1"],
+    },
+    "ungrouped": {},
+}
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config_path = tempfile.mkdtemp()
+        self.inventory_path = os.path.join(self.config_path, "inventory")
+        os.makedirs(os.path.join(self.inventory_path, "group_vars"))
+        self._write("hosts", "[group1]\nhost1\nhost2\n")
+        self.compiled_path = os.path.join(self.config_path, ".cache",
+                                          inventory.INVENTORY_CACHE,
+                                          inventory.COMPILED_INVENTORY)
+
+    def tearDown(self):
+        shutil.rmtree(self.config_path)
+
+    def _write(self, name, content):
+        path = os.path.join(self.inventory_path, name)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def test_convert(self):
+        listing = dict(LISTING)
+        listing["all"] = {"children": ["group1", "group2", "ungrouped"]}
+        result = inventory._convert(listing)
+        expected = {
+            "all": {
+                "children": {
+                    "group1": {
+                        "hosts": {"host1": {"var1": "value1"}, "host2": None},
+                        "vars": {"var2": "value2"},
+                    },
+                    "group2": {
+                        "hosts": {"host1": None},
+                    },
+                    "ungrouped": {},
+                },
+            },
+        }
+        self.assertEqual(expected, result)
+
+    @mock.patch.object(inventory, "_get_ansible_inventory")
+    @mock.patch.object(utils, "run_command")
+    def test_compile_inventory(self, mock_run, mock_get):
+        mock_get.return_value = "/path/to/venv/bin/ansible-inventory"
+        mock_run.return_value = json.dumps(LISTING)
+        result = inventory.compile_inventory(self.config_path,
+                                             self.inventory_path)
+        self.assertEqual(self.compiled_path, result)
+        mock_run.assert_called_once_with(
+            ["/path/to/venv/bin/ansible-inventory", "--inventory", mock.ANY,
+             "--list", "--export"], check_output=True)
+        with open(result) as f:
+            self.assertEqual(inventory._convert(LISTING), json.load(f))
+        # Variables directories are linked rather than compiled.
+        group_vars = os.path.join(os.path.dirname(result), "group_vars")
+        self.assertEqual(os.path.join(self.inventory_path, "group_vars"),
+                         os.readlink(group_vars))
+        self.assertFalse(os.path.lexists(
+            os.path.join(os.path.dirname(result), "host_vars")))
+
+    @unittest.skipUnless(os.access(ANSIBLE_PLAYBOOK, os.X_OK),
+                         "requires ansible-playbook")
+    def test_compile_inventory_precedence(self):
+        # Inventory group_vars take precedence over playbook group_vars, but
+        # variables defined in an inventory file do not.
+        self._write("hosts", "[grp]\nhost1 ansible_connection=local "
+                             "ansible_python_interpreter=%s\n" %
+                    sys.executable)
+        self._write("group_vars/grp", "foo: inventory_group_vars_grp\n")
+        playbook_dir = os.path.join(self.config_path, "ansible")
+        os.makedirs(os.path.join(playbook_dir, "group_vars"))
+        with open(os.path.join(playbook_dir, "group_vars", "all"), "w") as f:
+            f.write("foo: playbook_group_vars_all\n")
+        playbook = os.path.join(playbook_dir, "playbook.yml")
+        with open(playbook, "w") as f:
+            f.write("- hosts: all\n"
+                    "  gather_facts: false\n"
+                    "  tasks:\n"
+                    "    - copy:\n"
+                    "        content: \"{{ foo }}\"\n"
+                    "        dest: \"{{ out }}\"\n")
+        compiled_path = inventory.compile_inventory(self.config_path,
+                                                    self.inventory_path)
+        self.assertEqual(self.compiled_path, compiled_path)
+        for path in (self.inventory_path, compiled_path):
+            out = os.path.join(self.config_path, "out")
+            utils.run_command([ANSIBLE_PLAYBOOK, "--inventory", path,
+                               "-e", "out=%s" % out, playbook], quiet=True)
+            with open(out) as f:
+                self.assertEqual("inventory_group_vars_grp", f.read())
+
+    @mock.patch.object(utils, "run_command")
+    def test_compile_inventory_failure(self, mock_run):
+        mock_run.side_effect = subprocess.CalledProcessError(1, "command")
+        result = inventory.compile_inventory(self.config_path,
+                                             self.inventory_path)
+        self.assertIsNone(result)
+
+    @mock.patch.object(utils, "run_command")
+    def test_compile_inventory_vault(self, mock_run):
+        self._write("group_vars/all", "$ANSIBLE_VAULT;1.1;AES256\n0123\n")
+        result = inventory.compile_inventory(self.config_path,
+                                             self.inventory_path)
+        self.assertIsNone(result)
+        self.assertFalse(mock_run.called)
+
+    @mock.patch.object(utils, "run_command")
+    def test_compile_inventory_executable(self, mock_run):
+        path = self._write("dynamic", "#!/bin/sh\n")
+        os.chmod(path, 0o755)
+        result = inventory.compile_inventory(self.config_path,
+                                             self.inventory_path)
+        self.assertIsNone(result)
+        self.assertFalse(mock_run.called)
+
+    @mock.patch.object(utils, "run_command")
+    def test_compile_inventory_inventory_dir(self, mock_run):
+        self._write("group_vars/all",
+                    "var1: \"{{ inventory_dir }}/files\"\n")
+        result = inventory.compile_inventory(self.config_path,
+                                             self.inventory_path)
+        self.assertIsNone(result)
+        self.assertFalse(mock_run.called)
+
+    def test_get_ansible_inventory(self):
+        bin_dir = os.path.join(self.config_path, "bin")
+        os.mkdir(bin_dir)
+        for name in ("ansible-playbook", "ansible-inventory"):
+            path = os.path.join(bin_dir, name)
+            with open(path, "w") as f:
+                f.write("#!/bin/sh\n")
+            os.chmod(path, 0o755)
+        with mock.patch("shutil.which") as mock_which:
+            mock_which.return_value = os.path.join(bin_dir,
+                                                   "ansible-playbook")
+            self.assertEqual(os.path.join(bin_dir, "ansible-inventory"),
+                             inventory._get_ansible_inventory())
+        with mock.patch("shutil.which") as mock_which:
+            mock_which.return_value = None
+            with mock.patch.object(inventory.sys, "executable",
+                                   os.path.join(self.config_path, "python")):
+                self.assertEqual("ansible-inventory",
+                                 inventory._get_ansible_inventory())
+
+    @mock.patch.object(utils, "run_command")
+    def test_get_inventory_vars_inventory_dir(self, mock_run):
+        vars_file = os.path.join(self.config_path, "globals.yml")
+        with open(vars_file, "w") as f:
+            f.write("var1: \"{{ inventory_file }}\"\n")
+        result = inventory.get_inventory(self.config_path,
+                                         self.inventory_path,
+                                         vars_files=[vars_file])
+        self.assertEqual(self.inventory_path, result)
+        self.assertFalse(mock_run.called)
+
+    @mock.patch.object(utils, "run_command")
+    def test_get_inventory(self, mock_run):
+        mock_run.return_value = json.dumps(LISTING)
+        result = inventory.get_inventory(self.config_path,
+                                         self.inventory_path)
+        self.assertEqual(self.compiled_path, result)
+        self.assertEqual(1, mock_run.call_count)
+
+        # Fresh compiled inventory is reused.
+        result = inventory.get_inventory(self.config_path,
+                                         self.inventory_path)
+        self.assertEqual(self.compiled_path, result)
+        self.assertEqual(1, mock_run.call_count)
+
+        # Changed inventory is recompiled.
+        self._write("group_vars/group1", "var2: value3\n")
+        result = inventory.get_inventory(self.config_path,
+                                         self.inventory_path)
+        self.assertEqual(self.compiled_path, result)
+        self.assertEqual(2, mock_run.call_count)
+
+    @mock.patch.object(utils, "run_command")
+    def test_get_inventory_not_compilable(self, mock_run):
+        self._write("group_vars/all", "$ANSIBLE_VAULT;1.1;AES256\n0123\n")
+        for _ in range(2):
+            result = inventory.get_inventory(self.config_path,
+                                             self.inventory_path)
+            self.assertEqual(self.inventory_path, result)
+        self.assertFalse(mock_run.called)
+
+    def test_get_inventory_host_list(self):
+        result = inventory.get_inventory(self.config_path, "host1,host2,")
+        self.assertEqual("host1,host2,", result)
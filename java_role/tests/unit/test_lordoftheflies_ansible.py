@@ -13,12 +13,18 @@
 # under the License.
 
 import argparse
+import json
 import os
+import shutil
 import subprocess
+import tempfile
+import threading
+import time
 import unittest
 
 import mock
 
+from java_role import ansible
 from java_role import lordoftheflies_ansible
 from java_role import utils
 from java_role import vault
@@ -36,12 +42,12 @@ class TestCase(unittest.TestCase):
         parsed_args = parser.parse_args([])
         lordoftheflies_ansible.run(parsed_args, "command", "overcloud")
         expected_cmd = [
-            ".", "/path/to/cwd/venvs/lordoftheflies-ansible/bin/activate", "&&",
+            "/path/to/cwd/venvs/lordoftheflies-ansible/bin/"
             "lordoftheflies-ansible", "command",
             "--inventory", "/etc/lordoftheflies/inventory/overcloud",
         ]
-        expected_cmd = " ".join(expected_cmd)
-        mock_run.assert_called_once_with(expected_cmd, shell=True, quiet=False)
+        mock_run.assert_called_once_with(expected_cmd, quiet=False,
+                                         env=mock.ANY)
 
     @mock.patch.object(utils, "run_command")
     @mock.patch.object(lordoftheflies_ansible, "_validate_args")
@@ -59,7 +65,7 @@ class TestCase(unittest.TestCase):
         parsed_args = parser.parse_args(args)
         lordoftheflies_ansible.run(parsed_args, "command", "overcloud")
         expected_cmd = [
-            ".", "/path/to/cwd/venvs/lordoftheflies-ansible/bin/activate", "&&",
+            "/path/to/cwd/venvs/lordoftheflies-ansible/bin/"
             "lordoftheflies-ansible", "command",
             "--inventory", "/path/to/inventory",
             "--configdir", "/path/to/config",
@@ -68,8 +74,8 @@ class TestCase(unittest.TestCase):
             "--limit", "host1:host2",
             "--tags", "tag1,tag2",
         ]
-        expected_cmd = " ".join(expected_cmd)
-        mock_run.assert_called_once_with(expected_cmd, shell=True, quiet=False)
+        mock_run.assert_called_once_with(expected_cmd, quiet=False,
+                                         env=mock.ANY)
 
     @mock.patch.object(utils, "run_command")
     @mock.patch.object(lordoftheflies_ansible, "_validate_args")
@@ -89,7 +95,7 @@ class TestCase(unittest.TestCase):
         parsed_args = parser.parse_args(args)
         lordoftheflies_ansible.run(parsed_args, "command", "overcloud")
         expected_cmd = [
-            ".", "/path/to/cwd/venvs/lordoftheflies-ansible/bin/activate", "&&",
+            "/path/to/cwd/venvs/lordoftheflies-ansible/bin/"
             "lordoftheflies-ansible", "command",
             "--inventory", "/path/to/inventory",
             "--configdir", "/path/to/config",
@@ -99,8 +105,8 @@ class TestCase(unittest.TestCase):
             "--skip-tags", "tag3,tag4",
             "--tags", "tag1,tag2",
         ]
-        expected_cmd = " ".join(expected_cmd)
-        mock_run.assert_called_once_with(expected_cmd, shell=True, quiet=False)
+        mock_run.assert_called_once_with(expected_cmd, quiet=False,
+                                         env=mock.ANY)
 
     @mock.patch.object(utils, "run_command")
     @mock.patch.object(lordoftheflies_ansible, "_validate_args")
@@ -114,36 +120,37 @@ class TestCase(unittest.TestCase):
         parsed_args = parser.parse_args(args)
         lordoftheflies_ansible.run(parsed_args, "command", "overcloud")
         expected_cmd = [
-            ".", "/path/to/cwd/venvs/lordoftheflies-ansible/bin/activate", "&&",
+            "/path/to/cwd/venvs/lordoftheflies-ansible/bin/"
             "lordoftheflies-ansible", "command",
             "--key", "/path/to/vault/pw",
             "--inventory", "/etc/lordoftheflies/inventory/overcloud",
         ]
-        expected_cmd = " ".join(expected_cmd)
-        mock_run.assert_called_once_with(expected_cmd, shell=True, quiet=False)
+        mock_run.assert_called_once_with(expected_cmd, quiet=False,
+                                         env=mock.ANY)
 
     @mock.patch.dict(os.environ, {"JAVA_ROLE_VAULT_PASSWORD": "test-pass"})
+    @mock.patch.dict(vault._PASSWORD_HELPER_CACHE, clear=True)
+    @mock.patch.object(vault.shutil, "which")
     @mock.patch.object(utils, "run_command")
     @mock.patch.object(lordoftheflies_ansible, "_validate_args")
-    def test_run_vault_password_helper(self, mock_vars, mock_run):
+    def test_run_vault_password_helper(self, mock_vars, mock_run,
+                                       mock_which):
+        mock_which.return_value = "/path/to/java_role-vault-password-helper"
         mock_vars.return_value = []
         parser = argparse.ArgumentParser()
-        mock_run.return_value = "/path/to/java_role-vault-password-helper"
         lordoftheflies_ansible.add_args(parser)
         vault.add_args(parser)
-        mock_run.assert_called_once_with(
-            ["which", "java_role-vault-password-helper"], check_output=True)
-        mock_run.reset_mock()
         parsed_args = parser.parse_args([])
+        self.assertIsNone(parsed_args.vault_password_file)
         lordoftheflies_ansible.run(parsed_args, "command", "overcloud")
         expected_cmd = [
-            ".", "/path/to/cwd/venvs/lordoftheflies-ansible/bin/activate", "&&",
+            "/path/to/cwd/venvs/lordoftheflies-ansible/bin/"
             "lordoftheflies-ansible", "command",
             "--key", "/path/to/java_role-vault-password-helper",
             "--inventory", "/etc/lordoftheflies/inventory/overcloud",
         ]
-        expected_cmd = " ".join(expected_cmd)
-        mock_run.assert_called_once_with(expected_cmd, shell=True, quiet=False)
+        mock_run.assert_called_once_with(expected_cmd, quiet=False,
+                                         env=mock.ANY)
 
     @mock.patch.object(utils, "run_command")
     @mock.patch.object(lordoftheflies_ansible, "_validate_args")
@@ -164,7 +171,7 @@ class TestCase(unittest.TestCase):
         }
         lordoftheflies_ansible.run(parsed_args, "command", "overcloud", **kwargs)
         expected_cmd = [
-            ".", "/path/to/cwd/venvs/lordoftheflies-ansible/bin/activate", "&&",
+            "/path/to/cwd/venvs/lordoftheflies-ansible/bin/"
             "lordoftheflies-ansible", "command",
             "-v",
             "--inventory", "/etc/lordoftheflies/inventory/overcloud",
@@ -173,8 +180,23 @@ class TestCase(unittest.TestCase):
             "--tags", "tag1,tag2,tag3,tag4",
             "--arg1", "--arg2",
         ]
-        expected_cmd = " ".join(expected_cmd)
-        mock_run.assert_called_once_with(expected_cmd, shell=True, quiet=False)
+        mock_run.assert_called_once_with(expected_cmd, quiet=False,
+                                         env=mock.ANY)
+
+    @mock.patch.object(utils, "run_command")
+    @mock.patch.object(lordoftheflies_ansible, "_validate_args")
+    def test_run_fact_cache(self, mock_validate, mock_run):
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        lordoftheflies_ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", "/path/to/config",
+                                         "--fact-cache-timeout", "86400"])
+        lordoftheflies_ansible.run(parsed_args, "command", "overcloud")
+        env = mock_run.call_args[1]["env"]
+        self.assertEqual("/path/to/config/.cache/facts",
+                         env["ANSIBLE_CACHE_PLUGIN_CONNECTION"])
+        self.assertEqual("smart", env["ANSIBLE_GATHERING"])
 
     @mock.patch.object(utils, "run_command")
     @mock.patch.object(lordoftheflies_ansible, "_validate_args")
@@ -187,3 +209,473 @@ class TestCase(unittest.TestCase):
         self.assertRaises(SystemExit,
                           lordoftheflies_ansible.run, parsed_args, "command",
                           "overcloud")
+
+    @mock.patch.dict(os.environ, {"PATH": "/usr/bin", "PYTHONHOME": "/py"})
+    @mock.patch.object(utils, "run_command")
+    @mock.patch.object(lordoftheflies_ansible, "_validate_args")
+    def test_run_venv_env(self, mock_validate, mock_run):
+        parser = argparse.ArgumentParser()
+        lordoftheflies_ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["--lordoftheflies-venv",
+                                         "/path/to/venv"])
+        lordoftheflies_ansible.run(parsed_args, "command", "overcloud")
+        cmd = mock_run.call_args[0][0]
+        self.assertEqual("/path/to/venv/bin/lordoftheflies-ansible", cmd[0])
+        env = mock_run.call_args[1]["env"]
+        self.assertEqual("/path/to/venv", env["VIRTUAL_ENV"])
+        self.assertEqual("/path/to/venv/bin:/usr/bin", env["PATH"])
+        self.assertNotIn("PYTHONHOME", env)
+
+    @mock.patch.object(utils, "run_command")
+    @mock.patch.object(lordoftheflies_ansible, "_validate_args")
+    def test_run_args_with_spaces(self, mock_validate, mock_run):
+        parser = argparse.ArgumentParser()
+        lordoftheflies_ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["-ke", "var=value with spaces"])
+        lordoftheflies_ansible.run(parsed_args, "command", "overcloud")
+        cmd = mock_run.call_args[0][0]
+        self.assertIn("var=value with spaces", cmd)
+
+    def test_validate_args_executable(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        inventory_dir = os.path.join(tmp_dir, "inventory")
+        bin_dir = os.path.join(tmp_dir, "venv", "bin")
+        os.makedirs(inventory_dir)
+        os.makedirs(bin_dir)
+        open(os.path.join(inventory_dir, "overcloud"), "w").close()
+        parser = argparse.ArgumentParser()
+        lordoftheflies_ansible.add_args(parser)
+        parsed_args = parser.parse_args([
+            "--lordoftheflies-config-path", tmp_dir,
+            "--lordoftheflies-venv", os.path.join(tmp_dir, "venv"),
+        ])
+        self.assertRaises(SystemExit, lordoftheflies_ansible._validate_args,
+                          parsed_args, "overcloud")
+        executable = os.path.join(bin_dir, "lordoftheflies-ansible")
+        with open(executable, "w") as f:
+            f.write("#!/bin/sh\n")
+        self.assertRaises(SystemExit, lordoftheflies_ansible._validate_args,
+                          parsed_args, "overcloud")
+        os.chmod(executable, 0o755)
+        lordoftheflies_ansible._validate_args(parsed_args, "overcloud")
+
+    @mock.patch.object(utils, "run_command_prefixed")
+    @mock.patch.object(lordoftheflies_ansible, "_validate_args")
+    def test_run_concurrent(self, mock_validate, mock_run):
+        parser = argparse.ArgumentParser()
+        lordoftheflies_ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args([])
+        runs = [
+            {"command": "pull", "inventory_filename": "seed"},
+            {"command": "pull", "inventory_filename": "overcloud",
+             "tags": "tag1"},
+        ]
+        lordoftheflies_ansible.run_concurrent(parsed_args, runs,
+                                              verbose_level=1)
+        executable = ("/path/to/cwd/venvs/lordoftheflies-ansible/bin/"
+                      "lordoftheflies-ansible")
+        expected_calls = [
+            mock.call([executable, "pull", "-v",
+                       "--inventory", "/etc/lordoftheflies/inventory/seed"],
+                      "[seed pull]", quiet=False, env=mock.ANY),
+            mock.call([executable, "pull", "-v",
+                       "--inventory",
+                       "/etc/lordoftheflies/inventory/overcloud",
+                       "--tags", "tag1"],
+                      "[overcloud pull]", quiet=False, env=mock.ANY),
+        ]
+        self.assertEqual(sorted(expected_calls),
+                         sorted(mock_run.call_args_list))
+        self.assertEqual([mock.call(parsed_args, "seed"),
+                          mock.call(parsed_args, "overcloud")],
+                         mock_validate.call_args_list)
+
+    @mock.patch.object(utils, "run_command_prefixed")
+    @mock.patch.object(lordoftheflies_ansible, "_validate_args")
+    def test_run_concurrent_failure(self, mock_validate, mock_run):
+        parser = argparse.ArgumentParser()
+        lordoftheflies_ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args([])
+        runs = [
+            {"command": "pull", "inventory_filename": "seed"},
+            {"command": "pull", "inventory_filename": "overcloud"},
+        ]
+
+        def _run(cmd, prefix, **kwargs):
+            if prefix == "[seed pull]":
+                raise subprocess.CalledProcessError(2, "dummy")
+
+        mock_run.side_effect = _run
+        self.assertRaises(SystemExit, lordoftheflies_ansible.run_concurrent,
+                          parsed_args, runs)
+        self.assertEqual(2, mock_run.call_count)
+
+    def _get_shard_args(self, *args):
+        parser = argparse.ArgumentParser()
+        lordoftheflies_ansible.add_args(parser)
+        lordoftheflies_ansible.add_shard_args(parser)
+        vault.add_args(parser)
+        return parser.parse_args(list(args))
+
+    @mock.patch.object(utils, "run_command")
+    def test_list_hosts(self, mock_run):
+        parsed_args = self._get_shard_args("-kl", "host*")
+        mock_run.return_value = b"  hosts (2):\n    host1\n    host2\n"
+        result = lordoftheflies_ansible._list_hosts(parsed_args, "overcloud",
+                                                    "all")
+        self.assertEqual(["host1", "host2"], result)
+        mock_run.assert_called_once_with(
+            ["/path/to/cwd/venvs/lordoftheflies-ansible/bin/ansible", "all",
+             "--list-hosts",
+             "--inventory", "/etc/lordoftheflies/inventory/overcloud",
+             "--limit", "host*"],
+            check_output=True, env=mock.ANY)
+
+    @mock.patch.object(lordoftheflies_ansible, "_list_hosts")
+    def test_build_shards(self, mock_list):
+        parsed_args = self._get_shard_args("--lordoftheflies-shards", "2")
+        hosts = {
+            "all": ["ctl1", "host1", "ctl2", "host2", "host3"],
+            "control": ["ctl1", "ctl2"],
+        }
+        mock_list.side_effect = lambda _, __, pattern, limit: hosts[pattern]
+        result = lordoftheflies_ansible._build_shards(parsed_args,
+                                                      "overcloud")
+        self.assertEqual((["ctl1", "ctl2"], [["host1", "host2"], ["host3"]]),
+                         result)
+
+    @mock.patch.object(lordoftheflies_ansible, "_list_hosts")
+    def test_build_shards_no_control_group(self, mock_list):
+        parsed_args = self._get_shard_args(
+            "--lordoftheflies-shards", "2",
+            "--lordoftheflies-shard-control-group", "")
+        mock_list.return_value = ["host1", "host2", "host3"]
+        result = lordoftheflies_ansible._build_shards(parsed_args,
+                                                      "overcloud")
+        self.assertEqual(([], [["host1", "host2"], ["host3"]]), result)
+        mock_list.assert_called_once_with(parsed_args, "overcloud", "all",
+                                          limit=None)
+
+    @mock.patch.object(lordoftheflies_ansible, "_list_hosts")
+    def test_build_shards_groups(self, mock_list):
+        parsed_args = self._get_shard_args(
+            "--lordoftheflies-shard-groups", "controllers,empty,compute")
+        hosts = {
+            "all": ["ctl1", "ctl2", "cmp1", "cmp2", "mon1"],
+            "control": [],
+            "controllers": ["ctl1", "ctl2"],
+            "empty": [],
+            "compute": ["cmp1", "cmp2", "ctl1"],
+        }
+        mock_list.side_effect = lambda _, __, pattern, limit: hosts[pattern]
+        result = lordoftheflies_ansible._build_shards(parsed_args,
+                                                      "overcloud")
+        self.assertEqual(([], [["ctl1", "ctl2"], ["cmp1", "cmp2"], ["mon1"]]),
+                         result)
+
+    @mock.patch.object(utils, "run_command_prefixed")
+    @mock.patch.object(lordoftheflies_ansible, "_build_shards")
+    @mock.patch.object(lordoftheflies_ansible, "_validate_args")
+    def test_run_sharded(self, mock_validate, mock_build, mock_run):
+        parsed_args = self._get_shard_args("--lordoftheflies-shards", "2",
+                                           "-kl", "host*")
+        mock_build.return_value = ([], [["host1"], ["host2"]])
+        shard_contents = []
+
+        def _run(cmd, prefix, **kwargs):
+            limit = cmd[cmd.index("--limit") + 1]
+            shard_file = limit.split(":&")[0][1:]
+            with open(shard_file) as f:
+                shard_contents.append((prefix, f.read(), limit[-7:]))
+
+        mock_run.side_effect = _run
+        lordoftheflies_ansible.run(parsed_args, "deploy", "overcloud",
+                                   shard=True)
+        expected = [
+            ("[shard 1/2]", "host1\n", ":&host*"),
+            ("[shard 2/2]", "host2\n", ":&host*"),
+        ]
+        self.assertEqual(expected, sorted(shard_contents))
+
+    @mock.patch.object(utils, "run_command_prefixed")
+    @mock.patch.object(lordoftheflies_ansible, "_build_shards")
+    @mock.patch.object(lordoftheflies_ansible, "_validate_args")
+    def test_run_sharded_failure_budget(self, mock_validate, mock_build,
+                                        mock_run):
+        parsed_args = self._get_shard_args(
+            "--lordoftheflies-shards", "4",
+            "--lordoftheflies-shard-concurrency", "1",
+            "--lordoftheflies-shard-failure-budget", "1")
+        mock_build.return_value = ([], [["host1"], ["host2"], ["host3"],
+                                        ["host4"]])
+        mock_run.side_effect = subprocess.CalledProcessError(2, "dummy")
+        self.assertRaises(SystemExit, lordoftheflies_ansible.run,
+                          parsed_args, "deploy", "overcloud", shard=True)
+        # The budget allows one failure, so the third shard is not run.
+        self.assertEqual(2, mock_run.call_count)
+
+    @mock.patch.object(utils, "run_command_prefixed")
+    @mock.patch.object(lordoftheflies_ansible, "_build_shards")
+    @mock.patch.object(lordoftheflies_ansible, "_validate_args")
+    def test_run_sharded_rolling(self, mock_validate, mock_build, mock_run):
+        parsed_args = self._get_shard_args(
+            "--lordoftheflies-shards", "3",
+            "--lordoftheflies-shard-concurrency", "2",
+            "--lordoftheflies-shard-rolling")
+        mock_build.return_value = ([], [["host1"], ["host2"], ["host3"]])
+        events = []
+        lock = threading.Lock()
+
+        def _run(cmd, prefix, **kwargs):
+            with lock:
+                events.append(("start", prefix))
+            time.sleep(0.01 if prefix == "[shard 1/3]" else 0.05)
+            with lock:
+                events.append(("end", prefix))
+
+        mock_run.side_effect = _run
+        lordoftheflies_ansible.run(parsed_args, "deploy", "overcloud",
+                                   shard=True)
+        # The third shard starts only after both shards in the first wave.
+        start3 = events.index(("start", "[shard 3/3]"))
+        self.assertLess(events.index(("end", "[shard 2/3]")), start3)
+
+    @mock.patch.object(utils, "run_command_prefixed")
+    @mock.patch.object(lordoftheflies_ansible, "_build_shards")
+    @mock.patch.object(lordoftheflies_ansible, "_validate_args")
+    def test_run_sharded_control(self, mock_validate, mock_build, mock_run):
+        parsed_args = self._get_shard_args(
+            "--lordoftheflies-shards", "2",
+            "--lordoftheflies-shard-concurrency", "0")
+        mock_build.return_value = (["ctl1"], [["host1"], ["host2"]])
+        events = []
+        lock = threading.Lock()
+
+        def _run(cmd, prefix, **kwargs):
+            with lock:
+                events.append(("start", prefix))
+            time.sleep(0.01)
+            with lock:
+                events.append(("end", prefix))
+
+        mock_run.side_effect = _run
+        lordoftheflies_ansible.run(parsed_args, "deploy", "overcloud",
+                                   shard=True)
+        # The control shard completes before the other shards start.
+        self.assertEqual([("start", "[shard 1/3]"), ("end", "[shard 1/3]")],
+                         events[:2])
+        self.assertEqual(6, len(events))
+
+    @mock.patch.object(utils, "run_command_prefixed")
+    @mock.patch.object(lordoftheflies_ansible, "_build_shards")
+    @mock.patch.object(lordoftheflies_ansible, "_validate_args")
+    def test_run_sharded_control_failure(self, mock_validate, mock_build,
+                                         mock_run):
+        parsed_args = self._get_shard_args(
+            "--lordoftheflies-shards", "2",
+            "--lordoftheflies-shard-failure-budget", "1")
+        mock_build.return_value = (["ctl1"], [["host1"], ["host2"]])
+        mock_run.side_effect = subprocess.CalledProcessError(2, "dummy")
+        self.assertRaises(SystemExit, lordoftheflies_ansible.run,
+                          parsed_args, "deploy", "overcloud", shard=True)
+        # No other shard is run once the control shard has failed.
+        self.assertEqual(1, mock_run.call_count)
+
+    @mock.patch.object(utils, "run_command")
+    @mock.patch.object(lordoftheflies_ansible, "_validate_args")
+    def test_run_shard_not_configured(self, mock_validate, mock_run):
+        parsed_args = self._get_shard_args()
+        lordoftheflies_ansible.run(parsed_args, "deploy", "overcloud",
+                                   shard=True)
+        self.assertEqual(1, mock_run.call_count)
+
+    @mock.patch.object(lordoftheflies_ansible, "run")
+    @mock.patch.object(lordoftheflies_ansible, "_validate_args")
+    def test_run_prechecks_cache(self, mock_validate, mock_run):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        config_path = os.path.join(tmp_dir, "java_role")
+        kolla_config_path = os.path.join(tmp_dir, "kolla")
+        os.makedirs(config_path)
+        os.makedirs(os.path.join(kolla_config_path, "inventory"))
+        passwords = os.path.join(kolla_config_path, "passwords.yml")
+        with open(passwords, "w") as f:
+            f.write("password: secret1\n")
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        lordoftheflies_ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args([
+            "--config-path", config_path,
+            "--lordoftheflies-config-path", kolla_config_path,
+        ])
+
+        # First run.
+        lordoftheflies_ansible.run_prechecks(parsed_args, "overcloud")
+        self.assertEqual(1, mock_run.call_count)
+
+        # Inputs unchanged.
+        lordoftheflies_ansible.run_prechecks(parsed_args, "overcloud")
+        self.assertEqual(1, mock_run.call_count)
+
+        # Forced.
+        lordoftheflies_ansible.run_prechecks(parsed_args, "overcloud",
+                                             force=True)
+        self.assertEqual(2, mock_run.call_count)
+
+        # Limit changed.
+        parsed_args.lordoftheflies_limit = "host1"
+        lordoftheflies_ansible.run_prechecks(parsed_args, "overcloud")
+        self.assertEqual(3, mock_run.call_count)
+
+        # Passwords changed.
+        with open(passwords, "w") as f:
+            f.write("password: secret2\n")
+        lordoftheflies_ansible.run_prechecks(parsed_args, "overcloud")
+        self.assertEqual(4, mock_run.call_count)
+        mock_run.assert_called_with(parsed_args, "prechecks", "overcloud",
+                                    quiet=False, verbose_level=None)
+
+    def test_precheck_fingerprint_installation(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        venv = os.path.join(tmp_dir, "venv")
+        site_packages = os.path.join(venv, "lib", "python3.9",
+                                     "site-packages")
+        dist_info = os.path.join(site_packages,
+                                 "lordoftheflies_ansible-1.0.0.dist-info")
+        source = os.path.join(tmp_dir, "src", "lordoftheflies-ansible")
+        os.makedirs(dist_info)
+        os.makedirs(os.path.join(source, ".git"))
+        with open(os.path.join(venv, "pyvenv.cfg"), "w") as f:
+            f.write("version = 3.9.0\n")
+        with open(os.path.join(dist_info, "direct_url.json"), "w") as f:
+            json.dump({"url": "file://" + source,
+                       "dir_info": {"editable": True}}, f)
+        parser = argparse.ArgumentParser()
+        lordoftheflies_ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["--lordoftheflies-venv", venv])
+
+        def _fingerprint():
+            return lordoftheflies_ansible._get_precheck_fingerprint(
+                parsed_args, "overcloud")
+
+        fingerprints = [_fingerprint()]
+        # Changes to the source tree are included.
+        with open(os.path.join(source, "site.yml"), "w") as f:
+            f.write("---\n")
+        fingerprints.append(_fingerprint())
+        # Changes to VCS metadata are not.
+        with open(os.path.join(source, ".git", "HEAD"), "w") as f:
+            f.write("ref: refs/heads/master\n")
+        self.assertEqual(fingerprints[-1], _fingerprint())
+        # A new version is included.
+        os.rename(dist_info, os.path.join(
+            site_packages, "lordoftheflies_ansible-2.0.0.dist-info"))
+        fingerprints.append(_fingerprint())
+        self.assertEqual(3, len(set(fingerprints)))
+
+    @mock.patch.object(lordoftheflies_ansible, "run")
+    @mock.patch.object(lordoftheflies_ansible, "_validate_args")
+    def test_run_prechecks_failure(self, mock_validate, mock_run):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        lordoftheflies_ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", tmp_dir])
+        mock_run.side_effect = SystemExit(1)
+        for _ in range(2):
+            self.assertRaises(SystemExit, lordoftheflies_ansible.run_prechecks,
+                              parsed_args, "overcloud")
+        self.assertEqual(2, mock_run.call_count)
+
+    @mock.patch.object(lordoftheflies_ansible, "run")
+    @mock.patch.object(lordoftheflies_ansible, "_validate_args")
+    def test_run_genconfig_incremental(self, mock_validate, mock_run):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        config_path = os.path.join(tmp_dir, "java_role")
+        kolla_config_path = os.path.join(tmp_dir, "kolla")
+        os.makedirs(config_path)
+        os.makedirs(os.path.join(kolla_config_path, "config", "nova"))
+        os.makedirs(os.path.join(kolla_config_path, "inventory"))
+
+        def write(path, content):
+            with open(os.path.join(kolla_config_path, path), "w") as f:
+                f.write(content)
+
+        write("globals.yml", "var: value1\n")
+        write("config/nova/nova-api.conf", "[DEFAULT]\n")
+        write("inventory/overcloud",
+              "[control]\nhost1\n[nova:children]\ncontrol\n"
+              "[glance:children]\ncontrol\n")
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        lordoftheflies_ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args([
+            "--config-path", config_path,
+            "--lordoftheflies-config-path", kolla_config_path,
+        ])
+        extra_vars = {"node_config_directory": "/tmp/config"}
+
+        def genconfig():
+            lordoftheflies_ansible.run_genconfig(parsed_args, "overcloud",
+                                                 incremental=True,
+                                                 extra_vars=extra_vars)
+
+        # First run generates all services.
+        genconfig()
+        mock_run.assert_called_once_with(
+            parsed_args, "genconfig", "overcloud", extra_vars=extra_vars,
+            tags=None, quiet=False, verbose_level=None)
+
+        # Inputs unchanged.
+        genconfig()
+        self.assertEqual(1, mock_run.call_count)
+
+        # Service override changed.
+        write("config/nova/nova-api.conf", "[DEFAULT]\ndebug = True\n")
+        genconfig()
+        self.assertEqual(2, mock_run.call_count)
+        self.assertEqual("nova", mock_run.call_args[1]["tags"])
+
+        # Inventory membership changed.
+        write("inventory/overcloud",
+              "[control]\nhost1\n[compute]\nhost2\n[nova:children]\n"
+              "control\ncompute\n[glance:children]\ncontrol\n")
+        genconfig()
+        self.assertEqual(3, mock_run.call_count)
+        self.assertEqual("nova", mock_run.call_args[1]["tags"])
+
+        # Globals changed.
+        write("globals.yml", "var: value2\n")
+        genconfig()
+        self.assertEqual(4, mock_run.call_count)
+        self.assertIsNone(mock_run.call_args[1]["tags"])
+
+    @mock.patch.object(lordoftheflies_ansible, "run")
+    @mock.patch.object(lordoftheflies_ansible, "_validate_args")
+    def test_run_genconfig_incremental_limit(self, mock_validate, mock_run):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        lordoftheflies_ansible.add_args(parser)
+        vault.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", tmp_dir,
+                                         "--lordoftheflies-limit", "host1"])
+        for _ in range(2):
+            lordoftheflies_ansible.run_genconfig(parsed_args, "overcloud",
+                                                 incremental=True)
+        self.assertEqual(2, mock_run.call_count)
+        self.assertFalse(os.path.exists(os.path.join(tmp_dir, ".cache",
+                                                     "genconfig")))
@@ -0,0 +1,87 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+
+from java_role import ansible
+from java_role import retry
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config_path = tempfile.mkdtemp()
+        self.cache_path = retry.get_cache_path(self.config_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.config_path)
+
+    def _write_retry(self, name, content):
+        if not os.path.isdir(self.cache_path):
+            os.makedirs(self.cache_path)
+        with open(os.path.join(self.cache_path, name), "w") as f:
+            f.write(content)
+
+    def test_build_env(self):
+        parser = argparse.ArgumentParser()
+        ansible.add_args(parser)
+        parsed_args = parser.parse_args(["--config-path", "/path/to/config"])
+        expected = {
+            "ANSIBLE_RETRY_FILES_ENABLED": "True",
+            "ANSIBLE_RETRY_FILES_SAVE_PATH": "/path/to/config/.cache/retry",
+        }
+        self.assertEqual(expected, retry.build_env(parsed_args))
+
+    def test_build_env_no_config_path(self):
+        parsed_args = argparse.Namespace()
+        self.assertEqual({}, retry.build_env(parsed_args))
+
+    def test_collect_failed_hosts(self):
+        self._write_retry("playbook1.retry", "host1\nhost2\n")
+        self._write_retry("playbook2.retry", "host2\nhost3\n")
+        self._write_retry("playbook3.retry", "host4\n")
+        result = retry.collect_failed_hosts(
+            self.config_path, ["/path/to/playbook1.yml", "playbook2.yml"])
+        self.assertEqual(["host1", "host2", "host3"], result)
+        self.assertEqual(["playbook3.retry"], os.listdir(self.cache_path))
+
+    def test_collect_failed_hosts_none(self):
+        result = retry.collect_failed_hosts(self.config_path,
+                                            ["playbook1.yml"])
+        self.assertEqual([], result)
+
+    def test_record_failed_hosts(self):
+        retry.record_failed_hosts(self.config_path, ["host1", "host2"])
+        path = retry.get_failed_hosts_file(self.config_path)
+        with open(path) as f:
+            self.assertEqual("host1\nhost2\n", f.read())
+        self.assertEqual("@" + path,
+                         retry.get_failed_hosts_limit(self.config_path))
+
+    def test_record_failed_hosts_empty(self):
+        retry.record_failed_hosts(self.config_path, ["host1"])
+        retry.record_failed_hosts(self.config_path, [])
+        self.assertFalse(os.path.exists(
+            retry.get_failed_hosts_file(self.config_path)))
+        self.assertIsNone(retry.get_failed_hosts_limit(self.config_path))
+
+    def test_get_delay(self):
+        parsed_args = argparse.Namespace(retry_delay=10)
+        self.assertEqual([10, 20, 40],
+                         [retry.get_delay(parsed_args, attempt)
+                          for attempt in range(3)])
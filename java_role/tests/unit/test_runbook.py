@@ -0,0 +1,83 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from java_role import runbook
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.plan_path = os.path.join(self.tmp_dir, "plan.yml")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write_plan(self, content):
+        with open(self.plan_path, "w") as f:
+            f.write(content)
+
+    def test_load_plan(self):
+        self._write_plan("""
+steps:
+  - overcloud host configure --limit 'host 1'
+  - [overcloud, service, deploy]
+  - name: dump
+    command: configuration dump
+""")
+        expected = [
+            {"name": "overcloud host configure --limit host 1",
+             "argv": ["overcloud", "host", "configure", "--limit",
+                      "host 1"]},
+            {"name": "overcloud service deploy",
+             "argv": ["overcloud", "service", "deploy"]},
+            {"name": "dump", "argv": ["configuration", "dump"]},
+        ]
+        self.assertEqual(expected, runbook.load_plan(self.plan_path))
+
+    def test_load_plan_list(self):
+        self._write_plan("- facts prune\n")
+        self.assertEqual([{"name": "facts prune",
+                           "argv": ["facts", "prune"]}],
+                         runbook.load_plan(self.plan_path))
+
+    def test_load_plan_invalid(self):
+        for content in ["steps: []\n", "key: value\n", "- name: step\n"]:
+            self._write_plan(content)
+            self.assertRaises(ValueError, runbook.load_plan, self.plan_path)
+
+    def test_checkpoint(self):
+        steps = [{"name": "step", "argv": ["facts", "prune"]}]
+        fingerprint = runbook.get_fingerprint(steps)
+        checkpoint_file = runbook.get_checkpoint_file(self.tmp_dir,
+                                                      self.plan_path)
+        self.assertEqual(0, runbook.read_checkpoint(checkpoint_file,
+                                                    fingerprint))
+        runbook.write_checkpoint(checkpoint_file, fingerprint, 1)
+        self.assertEqual(1, runbook.read_checkpoint(checkpoint_file,
+                                                    fingerprint))
+        # Changed plan.
+        self.assertEqual(0, runbook.read_checkpoint(checkpoint_file,
+                                                    "other"))
+        runbook.clear_checkpoint(checkpoint_file)
+        self.assertFalse(os.path.exists(checkpoint_file))
+
+    def test_get_checkpoint_file_no_config_path(self):
+        self.assertIsNone(runbook.get_checkpoint_file("/path/does/not/exist",
+                                                      self.plan_path))
@@ -0,0 +1,69 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import argparse
+import os
+import shutil
+import tempfile
+import unittest
+
+from java_role import stages
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config_path = tempfile.mkdtemp()
+        self.state_file = stages.get_state_file(self.config_path, "Command")
+
+    def tearDown(self):
+        shutil.rmtree(self.config_path)
+
+    def _get_args(self, **kwargs):
+        return argparse.Namespace(config_path=self.config_path, **kwargs)
+
+    def _write(self, name, content):
+        with open(os.path.join(self.config_path, name), "w") as f:
+            f.write(content)
+
+    def test_get_fingerprint(self):
+        fingerprint = stages.get_fingerprint(self._get_args(resume=False))
+        # Resume flag and caches are ignored.
+        self.assertEqual(fingerprint,
+                         stages.get_fingerprint(self._get_args(resume=True)))
+        self._write(".cache/Command.json", "{}")
+        self.assertEqual(fingerprint,
+                         stages.get_fingerprint(self._get_args(resume=True)))
+        # As are version control metadata and editor temporary files.
+        os.makedirs(os.path.join(self.config_path, ".git"))
+        self._write(".git/index", "index")
+        self._write(".globals.yml.swp", "swap")
+        self._write("globals.yml~", "backup")
+        self.assertEqual(fingerprint,
+                         stages.get_fingerprint(self._get_args(resume=True)))
+        # Arguments and configuration are not.
+        self.assertNotEqual(fingerprint, stages.get_fingerprint(
+            self._get_args(resume=False, tags="nova")))
+        self._write("globals.yml", "var: value\n")
+        self.assertNotEqual(fingerprint,
+                            stages.get_fingerprint(self._get_args()))
+
+    def test_completed(self):
+        self.assertEqual([], stages.read_completed(self.state_file, "fp"))
+        stages.write_completed(self.state_file, "fp", ["config", "deploy"])
+        self.assertEqual(["config", "deploy"],
+                         stages.read_completed(self.state_file, "fp"))
+        self.assertEqual([], stages.read_completed(self.state_file, "other"))
+        stages.clear(self.state_file)
+        self.assertFalse(os.path.exists(self.state_file))
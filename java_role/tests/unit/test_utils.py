@@ -12,10 +12,14 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import os
+import shutil
 import subprocess
+import tempfile
 import unittest
 
 import mock
+import six
 
 from java_role import utils
 
@@ -68,6 +72,23 @@ key2: value2
         mock_read.return_value = "[1{!"
         self.assertRaises(SystemExit, utils.read_yaml_file, "/path/to/file")
 
+    @mock.patch.object(utils, "read_file")
+    def test_read_yaml_file_unsafe(self, mock_read):
+        mock_read.return_value = "key1: !!python/name:os.system"
+        self.assertRaises(SystemExit, utils.read_yaml_file, "/path/to/file")
+
+    @mock.patch.object(utils, "read_file")
+    def test_read_json_file(self, mock_read):
+        mock_read.return_value = '{"key1": "value1", "key2": "value2"}'
+        result = utils.read_json_file("/path/to/file")
+        self.assertEqual(result, {"key1": "value1", "key2": "value2"})
+        mock_read.assert_called_once_with("/path/to/file")
+
+    @mock.patch.object(utils, "read_file")
+    def test_read_json_file_not_json(self, mock_read):
+        mock_read.return_value = "[1{!"
+        self.assertRaises(SystemExit, utils.read_json_file, "/path/to/file")
+
     @mock.patch.object(subprocess, "check_call")
     def test_run_command(self, mock_call):
         output = utils.run_command(["command", "to", "run"])
@@ -96,3 +117,147 @@ key2: value2
         mock_call.side_effect = subprocess.CalledProcessError(1, "command")
         self.assertRaises(subprocess.CalledProcessError, utils.run_command,
                           ["command", "to", "run"])
+
+    def test_write_file_atomic(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, "file")
+        utils.write_file_atomic(path, "content", mode=0o600)
+        with open(path) as f:
+            self.assertEqual(f.read(), "content")
+        self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+        self.assertEqual(os.listdir(tmp_dir), ["file"])
+
+    def test_get_cache_dir(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        result = utils.get_cache_dir(tmp_dir, "name")
+        self.assertEqual(result, os.path.join(tmp_dir, ".cache", "name"))
+        self.assertTrue(os.path.isdir(result))
+
+    def test_get_cache_dir_no_config_path(self):
+        result = utils.get_cache_dir("/path/does/not/exist", "name")
+        self.assertIsNone(result)
+
+    def test_hash_paths(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        os.makedirs(os.path.join(tmp_dir, "excluded"))
+        with open(os.path.join(tmp_dir, "file"), "w") as f:
+            f.write("content")
+        before = utils.hash_paths([tmp_dir], exclude=["excluded"])
+        with open(os.path.join(tmp_dir, "excluded", "file"), "w") as f:
+            f.write("content")
+        self.assertEqual(before,
+                         utils.hash_paths([tmp_dir], exclude=["excluded"]))
+        with open(os.path.join(tmp_dir, "file"), "w") as f:
+            f.write("changed")
+        self.assertNotEqual(before,
+                            utils.hash_paths([tmp_dir], exclude=["excluded"]))
+
+    def test_hash_paths_exclude_pattern(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        with open(os.path.join(tmp_dir, "file"), "w") as f:
+            f.write("content")
+        before = utils.hash_paths([tmp_dir], exclude=["*.swp"])
+        with open(os.path.join(tmp_dir, ".file.swp"), "w") as f:
+            f.write("swap")
+        self.assertEqual(before,
+                         utils.hash_paths([tmp_dir], exclude=["*.swp"]))
+        self.assertNotEqual(before, utils.hash_paths([tmp_dir]))
+
+    def test_parse_projection(self):
+        result = utils.parse_projection("var1.key1[0][1].key2")
+        self.assertEqual(["var1", "key1", 0, 1, "key2"], result)
+
+    def test_parse_projection_invalid(self):
+        self.assertRaises(ValueError, utils.parse_projection, "var1..key1")
+        self.assertRaises(ValueError, utils.parse_projection, "var1[key1]")
+
+    def test_project_vars(self):
+        hvars = {"var1": {"key1": ["value1"]}, "var2": "value2"}
+        result = utils.project_vars(
+            hvars, ["var1.key1[0]", "var2", "var1.key1[1]", "var3"])
+        self.assertEqual({"var1.key1[0]": "value1", "var2": "value2"}, result)
+
+    def test_check_path(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, "file")
+        open(path, "w").close()
+        self.assertEqual({"result": True}, utils.check_path(tmp_dir, "dir"))
+        self.assertEqual({"result": True}, utils.check_path(path, "file"))
+        self.assertEqual(
+            {"result": False, "message": "Path is not a directory"},
+            utils.check_path(path, "dir"))
+        self.assertEqual({"result": False, "message": "Path is not a file"},
+                         utils.check_path(tmp_dir, "file"))
+        self.assertEqual({"result": False, "message": "Path does not exist"},
+                         utils.check_path(path + "2", "file"))
+        self.assertEqual(
+            {"result": False, "message": "File is not executable"},
+            utils.check_path(path, "executable"))
+        os.chmod(path, 0o755)
+        self.assertEqual({"result": True},
+                         utils.check_path(path, "executable"))
+
+    @mock.patch.object(os, "access")
+    @mock.patch.object(os, "stat")
+    def test_check_path_cached(self, mock_stat, mock_access):
+        utils.clear_path_cache()
+        self.addCleanup(utils.clear_path_cache)
+        mock_stat.return_value = os.stat_result((0o40755,) + (0,) * 9)
+        mock_access.return_value = True
+        for _ in range(2):
+            result = utils.check_path("/path/to/cached/dir", "dir")
+            self.assertEqual({"result": True}, result)
+        mock_stat.assert_called_once_with("/path/to/cached/dir")
+        # Access is not cached.
+        self.assertEqual(2, mock_access.call_count)
+        mock_access.return_value = False
+        self.assertEqual(
+            {"result": False, "message": "Directory is not readable"},
+            utils.check_path("/path/to/cached/dir", "dir"))
+        utils.clear_path_cache()
+        utils.check_path("/path/to/cached/dir", "dir")
+        self.assertEqual(2, mock_stat.call_count)
+
+    def test_check_path_removed(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.addCleanup(utils.clear_path_cache)
+        path = os.path.join(tmp_dir, "file")
+        open(path, "w").close()
+        self.assertEqual({"result": True}, utils.check_path(path, "file"))
+        os.unlink(path)
+        utils.clear_path_cache()
+        self.assertEqual({"result": False, "message": "Path does not exist"},
+                         utils.check_path(path, "file"))
+
+    def test_validate_paths(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        checks = [
+            ("Directory", tmp_dir, "dir"),
+            ("File", tmp_dir, "file"),
+            ("Other file", "/path/does/not/exist", "file"),
+        ]
+        result = utils.validate_paths(checks)
+        expected = [
+            "File %s is invalid: Path is not a file" % tmp_dir,
+            "Other file /path/does/not/exist is invalid: Path does not exist",
+        ]
+        self.assertEqual(expected, result)
+
+    def test_run_command_prefixed(self):
+        with mock.patch("sys.stdout", new=six.StringIO()) as mock_stdout:
+            utils.run_command_prefixed(["sh", "-c", "echo a; echo b >&2"],
+                                       "[prefix]")
+        self.assertEqual("[prefix] a\n[prefix] b\n", mock_stdout.getvalue())
+
+    def test_run_command_prefixed_failure(self):
+        with mock.patch("sys.stdout", new=six.StringIO()):
+            self.assertRaises(subprocess.CalledProcessError,
+                              utils.run_command_prefixed,
+                              ["sh", "-c", "exit 3"], "[prefix]")
@@ -0,0 +1,286 @@
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import argparse
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import time
+import unittest
+
+import mock
+
+from java_role import vault
+
+try:
+    import cryptography  # noqa
+except ImportError:
+    HAS_CRYPTOGRAPHY = False
+else:
+    HAS_CRYPTOGRAPHY = True
+
+# "secret" encrypted by ansible-vault with the password "password".
+ANSIBLE_VAULT_CONTENT = (
+    b"$ANSIBLE_VAULT;1.1;AES256\n"
+    b"3263626261643762366662333830386435323365"
+    b"3065393839643330343938356365333232663539\n"
+    b"6636663964626465323434343735346635306563"
+    b"616266340a326339616164383133653265336166\n"
+    b"6565613238376665393137313635613239326137"
+    b"6639363735383961363461336266373733653739\n"
+    b"6535633534323165380a37656362303437653832"
+    b"3765666438633638303939353234333932646361\n"
+    b"3937\n")
+
+
+class TestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, "agent.sock")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _start_agent(self, ttl=60):
+        thread = threading.Thread(target=vault.run_agent,
+                                  args=("secret", self.socket_path, ttl))
+        thread.daemon = True
+        thread.start()
+        for _ in range(100):
+            if os.path.exists(self.socket_path):
+                break
+            time.sleep(0.01)
+        return thread
+
+    def _get_args(self, *args):
+        parser = argparse.ArgumentParser()
+        vault.add_args(parser)
+        return parser.parse_args(list(args))
+
+    def test_agent(self):
+        thread = self._start_agent()
+        mode = stat.S_IMODE(os.stat(self.socket_path).st_mode)
+        self.assertEqual(0o600, mode)
+        self.assertEqual("secret", vault.get_agent_password(self.socket_path))
+        self.assertTrue(vault.ping_agent(self.socket_path))
+        self.assertRaises(RuntimeError, vault.run_agent, "other",
+                          self.socket_path)
+        self.assertTrue(vault.stop_agent(self.socket_path))
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(self.socket_path))
+        self.assertIsNone(vault.get_agent_password(self.socket_path))
+        self.assertFalse(vault.stop_agent(self.socket_path))
+        self.assertFalse(vault.ping_agent(self.socket_path))
+
+    def test_agent_untrusted_dir(self):
+        thread = self._start_agent()
+        os.chmod(self.tmp_dir, 0o777)
+        try:
+            self.assertIsNone(vault.get_agent_password(self.socket_path))
+            self.assertFalse(vault.ping_agent(self.socket_path))
+            self.assertRaises(RuntimeError, vault.run_agent, "other",
+                              os.path.join(self.tmp_dir, "other.sock"))
+        finally:
+            os.chmod(self.tmp_dir, 0o700)
+            vault.stop_agent(self.socket_path)
+            thread.join(5)
+
+    def test_agent_not_socket(self):
+        open(self.socket_path, "w").close()
+        self.assertIsNone(vault.get_agent_password(self.socket_path))
+
+    def test_agent_creates_private_dir(self):
+        socket_dir = os.path.join(self.tmp_dir, "private")
+        self.socket_path = os.path.join(socket_dir, "agent.sock")
+        thread = self._start_agent()
+        mode = stat.S_IMODE(os.stat(socket_dir).st_mode)
+        self.assertEqual(0o700, mode)
+        self.assertTrue(vault.stop_agent(self.socket_path))
+        thread.join(5)
+
+    def test_agent_ttl(self):
+        thread = self._start_agent(ttl=0.1)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    @mock.patch.dict(os.environ, {vault.VAULT_AGENT_SOCKET_ENV: "/sock"})
+    def test_agent_session(self):
+        with vault.agent_session("secret") as socket_path:
+            self.assertEqual(socket_path,
+                             os.environ[vault.VAULT_AGENT_SOCKET_ENV])
+            self.assertEqual("secret", vault.get_agent_password())
+        self.assertEqual("/sock", os.environ[vault.VAULT_AGENT_SOCKET_ENV])
+        self.assertFalse(os.path.exists(socket_path))
+
+    @mock.patch.dict(os.environ, {vault.VAULT_AGENT_SOCKET_ENV: "/sock"})
+    def test_get_agent_socket_path_env(self):
+        self.assertEqual("/sock", vault.get_agent_socket_path())
+
+    @mock.patch.object(tempfile, "gettempdir", return_value="/tmp")
+    def test_get_agent_socket_path_tmp(self, mock_tmp):
+        with mock.patch.dict(os.environ, clear=True):
+            path = vault.get_agent_socket_path()
+        expected = "/tmp/java_role-vault-%d/java_role-vault-agent.sock" % (
+            os.getuid())
+        self.assertEqual(expected, path)
+
+    @mock.patch.object(vault, "ping_agent")
+    def test_build_args_no_agent(self, mock_agent):
+        mock_agent.return_value = False
+        self.assertEqual([], vault.build_args(self._get_args()))
+        self.assertEqual(["--ask-vault-pass"],
+                         vault.build_args(self._get_args("--ask-vault-pass")))
+
+    @mock.patch.object(vault, "_find_password_helper")
+    @mock.patch.object(vault, "ping_agent")
+    def test_build_args_agent(self, mock_agent, mock_helper):
+        mock_agent.return_value = True
+        mock_helper.return_value = "/path/to/helper"
+        expected = ["--vault-password-file", "/path/to/helper"]
+        self.assertEqual(expected, vault.build_args(self._get_args()))
+        self.assertEqual(expected,
+                         vault.build_args(self._get_args("--ask-vault-pass")))
+        # An explicit password file takes precedence.
+        parsed_args = self._get_args("--vault-password-file", "/path/to/pw")
+        self.assertEqual(["--vault-password-file", "/path/to/pw"],
+                         vault.build_args(parsed_args))
+
+    def test_find_files(self):
+        os.makedirs(os.path.join(self.tmp_dir, "dir", ".hidden"))
+        for name in ["a", "dir/b", "dir/.c", "dir/.hidden/d"]:
+            with open(os.path.join(self.tmp_dir, name), "w") as f:
+                f.write("content")
+        paths = [os.path.join(self.tmp_dir, "dir"),
+                 os.path.join(self.tmp_dir, "a")]
+        expected = [os.path.join(self.tmp_dir, "a"),
+                    os.path.join(self.tmp_dir, "dir", "b")]
+        self.assertEqual(expected, vault.find_files(paths))
+
+    def test_is_encrypted(self):
+        self.assertTrue(vault.is_encrypted(ANSIBLE_VAULT_CONTENT))
+        self.assertFalse(vault.is_encrypted(b"var: value\n"))
+
+    def test_parse_envelope_invalid(self):
+        self.assertRaises(ValueError, vault._parse_envelope,
+                          b"$ANSIBLE_VAULT;1.1;AES\n0123\n")
+
+    @mock.patch.object(vault, "get_password_file")
+    def test_get_password(self, mock_file):
+        path = os.path.join(self.tmp_dir, "password")
+        with open(path, "w") as f:
+            f.write("secret\n")
+        mock_file.return_value = path
+        self.assertEqual(b"secret", vault.get_password(mock.Mock()))
+
+    @mock.patch.object(vault, "get_password_file")
+    def test_get_password_executable(self, mock_file):
+        path = os.path.join(self.tmp_dir, "password")
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\necho secret\n")
+        os.chmod(path, 0o700)
+        mock_file.return_value = path
+        self.assertEqual(b"secret", vault.get_password(mock.Mock()))
+
+
+@unittest.skipUnless(HAS_CRYPTOGRAPHY, "cryptography is not installed")
+class TestCrypto(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _write(self, name, content):
+        path = os.path.join(self.tmp_dir, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def _read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def test_decrypt_ansible_vault(self):
+        self.assertEqual(b"secret",
+                         vault.decrypt(ANSIBLE_VAULT_CONTENT, b"password"))
+
+    def test_decrypt_wrong_password(self):
+        self.assertRaises(ValueError, vault.decrypt, ANSIBLE_VAULT_CONTENT,
+                          b"wrong")
+
+    def test_encrypt_decrypt(self):
+        content = vault.encrypt(b"var: value\n", b"password")
+        self.assertTrue(content.startswith(b"$ANSIBLE_VAULT;1.1;AES256\n"))
+        self.assertTrue(all(len(line) <= 80 for line in content.splitlines()))
+        self.assertEqual(b"var: value\n", vault.decrypt(content, b"password"))
+
+    def test_encrypt_vault_id(self):
+        content = vault.encrypt(b"secret", b"password", vault_id=b"prod")
+        self.assertTrue(content.startswith(b"$ANSIBLE_VAULT;1.2;AES256;prod"))
+        self.assertEqual(b"secret", vault.decrypt(content, b"password"))
+
+    def test_encrypt_unique_salt(self):
+        self.assertNotEqual(vault.encrypt(b"secret", b"password"),
+                            vault.encrypt(b"secret", b"password"))
+
+    def _process_files(self, workers):
+        plain = self._write("plain", b"var: value\n")
+        encrypted = self._write("encrypted", ANSIBLE_VAULT_CONTENT)
+        os.chmod(encrypted, 0o640)
+        paths = [encrypted, plain]
+
+        results = list(vault.process_files("rekey", paths, b"password",
+                                           new_password=b"new",
+                                           workers=workers))
+        self.assertEqual([(encrypted, True, None), (plain, False, None)],
+                         results)
+        self.assertEqual(0o640, stat.S_IMODE(os.stat(encrypted).st_mode))
+
+        results = list(vault.process_files("view", paths, b"new",
+                                           workers=workers))
+        self.assertEqual([(encrypted, True, b"secret"), (plain, False, None)],
+                         results)
+
+        results = list(vault.process_files("encrypt", paths, b"new",
+                                           workers=workers))
+        self.assertEqual([(encrypted, False, None), (plain, True, None)],
+                         results)
+
+        results = list(vault.process_files("decrypt", paths, b"new",
+                                           workers=workers))
+        self.assertEqual([(encrypted, True, None), (plain, True, None)],
+                         results)
+        self.assertEqual(b"secret", self._read(encrypted))
+        self.assertEqual(b"var: value\n", self._read(plain))
+
+    def test_process_files(self):
+        self._process_files(workers=1)
+
+    def test_process_files_pool(self):
+        self._process_files(workers=2)
+
+    def test_process_files_failure(self):
+        path = self._write("encrypted", ANSIBLE_VAULT_CONTENT)
+        results = list(vault.process_files("decrypt", [path], b"wrong"))
+        self.assertEqual(1, len(results))
+        self.assertEqual(path, results[0][0])
+        self.assertFalse(results[0][1])
+        self.assertIsInstance(results[0][2], ValueError)
+        self.assertEqual(ANSIBLE_VAULT_CONTENT, self._read(path))
@@ -12,16 +12,33 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import errno
+import fnmatch
+import hashlib
+import json
 import logging
 import os
+import re
+import stat
 import subprocess
 import sys
-
-import six
-import yaml
+import tempfile
+import threading
 
 LOG = logging.getLogger(__name__)
 
+# yaml and six are imported lazily, to reduce CLI startup time.
+
+
+def get_yaml_loader():
+    """Return the fastest available safe YAML loader class.
+
+    The libyaml C loader is significantly faster than the pure Python loader.
+    """
+    import yaml
+
+    return getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 
 def yum_install(packages):
     """Install a list of packages via Yum."""
@@ -64,34 +81,282 @@ def read_yaml_file(path):
         print("Failed to open config dump file %s: %s" %
               (path, repr(e)))
         sys.exit(1)
+    import yaml
+
     try:
-        return yaml.load(content)
+        return yaml.load(content, Loader=get_yaml_loader())
     except yaml.YAMLError as e:
         print("Failed to decode config dump YAML file %s: %s" %
               (path, repr(e)))
         sys.exit(1)
 
 
+def read_json_file(path):
+    """Read and decode a JSON file."""
+    try:
+        content = read_file(path)
+    except IOError as e:
+        print("Failed to open config dump file %s: %s" %
+              (path, repr(e)))
+        sys.exit(1)
+    try:
+        return json.loads(content)
+    except ValueError as e:
+        print("Failed to decode config dump JSON file %s: %s" %
+              (path, repr(e)))
+        sys.exit(1)
+
+
+def write_yaml_file(path, data):
+    """Encode and write data to a YAML file."""
+    import yaml
+
+    with open(path, "w") as f:
+        yaml.safe_dump(data, f, default_flow_style=False)
+
+
+def write_file_atomic(path, content, mode=None):
+    """Write the content of a file atomically.
+
+    The content is written to a temporary file in the same directory, which
+    is then renamed over the destination.
+
+    :param mode: Optional file mode. By default the mode of an existing file
+                 is preserved.
+    """
+    if mode is None and os.path.exists(path):
+        mode = os.stat(path).st_mode & 0o7777
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".",
+                                    prefix=".%s." % os.path.basename(path))
+    try:
+        with os.fdopen(fd, "wb" if isinstance(content, bytes) else "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def get_cache_dir(config_path, name):
+    """Return a cache directory under a JavaRole configuration path.
+
+    The directory is created if necessary.
+
+    :returns: The path to the cache directory, or None if the configuration
+              path does not exist or the directory could not be created.
+    """
+    if not os.path.isdir(config_path):
+        return None
+    path = os.path.join(config_path, ".cache", name)
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path)
+    except OSError as e:
+        LOG.warning("Failed to create cache directory %s: %s", path, e)
+        return None
+    return path
+
+
+def hash_paths(paths, exclude=None):
+    """Return a digest of the names and content of files under some paths.
+
+    :param paths: A list of paths to files or directories. Directories are
+                  traversed recursively. Missing paths are included by name.
+    :param exclude: Optional list of names or shell-style patterns of
+                    directories and files to skip.
+    :returns: A hexadecimal SHA-256 digest.
+    """
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(path.encode("utf-8") + b"\0")
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs[:] = sorted(d for d in dirs
+                                 if not _is_excluded(d, exclude))
+                for name in sorted(files):
+                    if _is_excluded(name, exclude):
+                        continue
+                    file_path = os.path.join(root, name)
+                    rel_path = os.path.relpath(file_path, path)
+                    digest.update(rel_path.encode("utf-8") + b"\0")
+                    _hash_file(digest, file_path)
+        elif os.path.isfile(path):
+            _hash_file(digest, path)
+    return digest.hexdigest()
+
+
+def _is_excluded(name, exclude):
+    """Return whether a file name matches any of a list of patterns."""
+    return any(fnmatch.fnmatchcase(name, pattern)
+               for pattern in exclude or ())
+
+
+def _hash_file(digest, path):
+    """Update a digest with the content of a file."""
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            digest.update(chunk)
+    digest.update(b"\0")
+
+
+def parse_projection(expression):
+    """Parse a variable projection into a list of keys.
+
+    Projections consist of a variable name followed by any number of
+    dictionary keys (.key) and list indices ([0]), for example
+    "var.key[0].other".
+
+    :raises ValueError: If the projection is invalid.
+    """
+    keys = []
+    for part in expression.split("."):
+        match = re.match(r"^([^\[\]]+)((?:\[\d+\])*)$", part)
+        if not match:
+            raise ValueError("Invalid variable projection %s" % expression)
+        keys.append(match.group(1))
+        keys += [int(i) for i in re.findall(r"\[(\d+)\]", match.group(2))]
+    return keys
+
+
+def project_vars(hvars, projections):
+    """Apply variable projections to a dict of variables.
+
+    :returns: A dict mapping projections to their values. Projections which
+              do not resolve are omitted.
+    """
+    result = {}
+    for projection in projections:
+        value = hvars
+        try:
+            for key in parse_projection(projection):
+                value = value[key]
+        except (IndexError, KeyError, TypeError):
+            continue
+        result[projection] = value
+    return result
+
+
+# File types of paths known to exist. Commands run in the same process, such
+# as in a shell or runbook, may remove paths, so this is cleared by
+# clear_path_cache at the start of each command.
+_PATH_TYPE_CACHE = {}
+
+
+def _get_path_type(path, cache=False):
+    """Return the file type of a path, as the S_IFMT bits of its mode.
+
+    :param cache: Whether to use and update the path type cache.
+    :raises: OSError if the path could not be stat'd.
+    """
+    if cache and path in _PATH_TYPE_CACHE:
+        return _PATH_TYPE_CACHE[path]
+    path_type = stat.S_IFMT(os.stat(path).st_mode)
+    if cache:
+        _PATH_TYPE_CACHE[path] = path_type
+    return path_type
+
+
+def _check_path(path, kind, cache=False):
+    """Check whether a path references a readable file or directory.
+
+    :param kind: "file", "dir" or "executable".
+    :param cache: Whether to use and update the path type cache.
+    """
+    try:
+        path_type = _get_path_type(path, cache=cache)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            return {"result": False, "message": "Path does not exist"}
+        return {"result": False, "message": e.strerror}
+    if kind == "dir":
+        if not stat.S_ISDIR(path_type):
+            return {"result": False, "message": "Path is not a directory"}
+        if not os.access(path, os.R_OK):
+            return {"result": False, "message": "Directory is not readable"}
+    else:
+        if not stat.S_ISREG(path_type):
+            return {"result": False, "message": "Path is not a file"}
+        if not os.access(path, os.R_OK):
+            return {"result": False, "message": "File is not readable"}
+        if kind == "executable" and not os.access(path, os.X_OK):
+            return {"result": False, "message": "File is not executable"}
+    return {"result": True}
+
+
+def check_path(path, kind):
+    """Check whether a path references a readable file or directory.
+
+    The types of existing paths are cached until clear_path_cache is called.
+    Access is checked on every call.
+
+    :param kind: "file", "dir" or "executable".
+    """
+    return _check_path(path, kind, cache=True)
+
+
+def clear_path_cache():
+    """Clear the cache of path types used by check_path."""
+    _PATH_TYPE_CACHE.clear()
+
+
+def validate_paths(checks):
+    """Check a list of paths, collecting all problems.
+
+    :param checks: A list of (description, path, kind) tuples, where kind is
+                   "file", "dir" or "executable".
+    :returns: A list of error messages, empty if all paths are valid.
+    """
+    errors = []
+    for description, path, kind in checks:
+        result = check_path(path, kind)
+        if not result["result"]:
+            errors.append("%s %s is invalid: %s" %
+                          (description, path, result["message"]))
+    return errors
+
+
 def is_readable_dir(path):
     """Check whether a path references a readable directory."""
-    if not os.path.exists(path):
-        return {"result": False, "message": "Path does not exist"}
-    if not os.path.isdir(path):
-        return {"result": False, "message": "Path is not a directory"}
-    if not os.access(path, os.R_OK):
-        return {"result": False, "message": "Directory is not readable"}
-    return {"result": True}
+    return _check_path(path, "dir")
 
 
 def is_readable_file(path):
     """Check whether a path references a readable file."""
-    if not os.path.exists(path):
-        return {"result": False, "message": "Path does not exist"}
-    if not os.path.isfile(path):
-        return {"result": False, "message": "Path is not a file"}
-    if not os.access(path, os.R_OK):
-        return {"result": False, "message": "File is not readable"}
-    return {"result": True}
+    return _check_path(path, "file")
+
+
+# Serialises output from commands run concurrently.
+_OUTPUT_LOCK = threading.Lock()
+
+
+def run_command_prefixed(cmd, prefix, quiet=False, **kwargs):
+    """Run a command, prefixing each line of its output.
+
+    Lines of output from commands run concurrently in different threads are
+    not interleaved.
+
+    :param prefix: String with which to prefix each line of output.
+    :param quiet: Redirect output to /dev/null
+    :raises subprocess.CalledProcessError: If the command fails.
+    """
+    if quiet:
+        return run_command(cmd, quiet=True, **kwargs)
+    LOG.debug("Running command: %s", " ".join(cmd))
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, **kwargs)
+    with proc.stdout:
+        for line in iter(proc.stdout.readline, b""):
+            line = line.decode("utf-8", "replace").rstrip("\n")
+            with _OUTPUT_LOCK:
+                sys.stdout.write("%s %s\n" % (prefix, line))
+                sys.stdout.flush()
+    returncode = proc.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd)
 
 
 def run_command(cmd, quiet=False, check_output=False, **kwargs):
@@ -101,6 +366,8 @@ def run_command(cmd, quiet=False, check_output=False, **kwargs):
     :param check_output: Whether to return the output of the command
     :returns: The output of the command if check_output is true
     """
+    import six
+
     if isinstance(cmd, six.string_types):
         cmd_string = cmd
     else:
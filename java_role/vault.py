@@ -12,46 +12,539 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import binascii
+import concurrent.futures
+import contextlib
+import getpass
+import logging
 import os
+import shutil
+import socket
+import stat
+import struct
 import subprocess
+import sys
+import tempfile
+import threading
+import time
 
 from java_role import utils
 
+LOG = logging.getLogger(__name__)
+
 VAULT_PASSWORD_ENV = "JAVA_ROLE_VAULT_PASSWORD"
 
+VAULT_AGENT_SOCKET_ENV = "JAVA_ROLE_VAULT_AGENT_SOCK"
 
-def _get_default_vault_password_file():
-    """Return the default value for the vault password file argument.
+VAULT_PASSWORD_HELPER = "java_role-vault-password-helper"
 
-    It is possible to use an environment variable to avoid typing the vault
-    password.
-    """
-    if not os.getenv(VAULT_PASSWORD_ENV):
-        return None
-    cmd = ["which", "java_role-vault-password-helper"]
-    try:
-        output = utils.run_command(cmd, check_output=True)
-    except subprocess.CalledProcessError:
-        return None
-    return output.strip()
+# Default time to live of the vault agent, in seconds.
+DEFAULT_AGENT_TTL = 3600
+
+# Timeout for requests to the vault agent, in seconds.
+AGENT_TIMEOUT = 5
+
+# Cache of the path to the vault password helper, resolved on first use.
+_PASSWORD_HELPER_CACHE = {}
 
 
 def add_args(parser):
     """Add arguments required for running Ansible playbooks to a parser."""
-    default_vault_password_file = _get_default_vault_password_file()
     vault = parser.add_mutually_exclusive_group()
     vault.add_argument("--ask-vault-pass", action="store_true",
                        help="ask for vault password")
     vault.add_argument("--vault-password-file", metavar="VAULT_PASSWORD_FILE",
-                       default=default_vault_password_file,
-                       help="vault password file")
+                       help="vault password file (default "
+                            "java_role-vault-password-helper if $%s is set "
+                            "or a vault agent is running)" %
+                            VAULT_PASSWORD_ENV)
+
+
+def get_agent_socket_path():
+    """Return the path to the vault agent's UNIX socket.
+
+    Without $XDG_RUNTIME_DIR, which is private to the user, the socket is
+    placed in a per-user directory under the temporary directory, which the
+    agent creates with mode 0700.
+    """
+    path = os.getenv(VAULT_AGENT_SOCKET_ENV)
+    if path:
+        return path
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if not runtime_dir:
+        runtime_dir = os.path.join(tempfile.gettempdir(),
+                                   "java_role-vault-%d" % os.getuid())
+    return os.path.join(runtime_dir, "java_role-vault-agent.sock")
+
+
+def _is_private_dir(path):
+    """Return whether a directory is owned by and only writable by us."""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        return False
+    return not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+
+def _is_trusted_socket(socket_path):
+    """Return whether a socket was created by our user in a private directory.
+
+    This prevents another user from planting a socket which collects or
+    serves vault passwords.
+    """
+    try:
+        st = os.lstat(socket_path)
+    except OSError:
+        return False
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        LOG.warning("Ignoring vault agent socket %s which is not a socket "
+                    "owned by the current user", socket_path)
+        return False
+    if not _is_private_dir(os.path.dirname(os.path.abspath(socket_path))):
+        LOG.warning("Ignoring vault agent socket %s in a directory which is "
+                    "not private to the current user", socket_path)
+        return False
+    return True
+
+
+def _agent_request(request, socket_path=None):
+    """Send a request to the vault agent and return its response, or None."""
+    socket_path = socket_path or get_agent_socket_path()
+    if not _is_trusted_socket(socket_path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(AGENT_TIMEOUT)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(request.encode("utf-8") + b"\n")
+        chunks = []
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    except (OSError, socket.error) as e:
+        LOG.debug("Failed to query vault agent at %s: %s", socket_path, e)
+        return None
+    finally:
+        sock.close()
+    return b"".join(chunks).decode("utf-8")
+
+
+def get_agent_password(socket_path=None):
+    """Return the vault password held by the vault agent, or None."""
+    return _agent_request("get", socket_path) or None
+
+
+def ping_agent(socket_path=None):
+    """Return whether a vault agent is running.
+
+    Unlike get_agent_password, this does not send the password over the
+    socket.
+    """
+    return _agent_request("ping", socket_path) == "pong"
+
+
+def stop_agent(socket_path=None):
+    """Stop a running vault agent.
+
+    :returns: Whether an agent was stopped.
+    """
+    return _agent_request("stop", socket_path) is not None
+
+
+def _is_peer_allowed(conn):
+    """Return whether the peer of a UNIX socket connection is our user."""
+    if not hasattr(socket, "SO_PEERCRED"):
+        # Rely on the permissions of the socket.
+        return True
+    creds = conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+                            struct.calcsize("3i"))
+    _, uid, _ = struct.unpack("3i", creds)
+    return uid == os.getuid()
+
+
+def run_agent(password, socket_path=None, ttl=DEFAULT_AGENT_TTL):
+    """Serve a vault password on a UNIX socket until the TTL expires.
+
+    The socket is only accessible to the current user, and is created in a
+    directory private to the user. The agent exits after ttl seconds, or
+    when it receives a stop request.
+
+    :param password: The vault password.
+    :param socket_path: Path to the socket. By default the path returned by
+                        get_agent_socket_path is used.
+    :param ttl: Time to live, in seconds, or None to run until stopped.
+    """
+    socket_path = socket_path or get_agent_socket_path()
+    socket_dir = os.path.dirname(os.path.abspath(socket_path))
+    if not os.path.exists(socket_dir):
+        os.makedirs(socket_dir, mode=0o700)
+    if not _is_private_dir(socket_dir):
+        raise RuntimeError("Vault agent socket directory %s must be owned "
+                           "by the current user and not writable by others" %
+                           socket_dir)
+    if ping_agent(socket_path):
+        raise RuntimeError("A vault agent is already listening on %s" %
+                           socket_path)
+    if os.path.lexists(socket_path):
+        os.unlink(socket_path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    old_umask = os.umask(0o177)
+    try:
+        sock.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    sock.listen(16)
+    deadline = time.time() + ttl if ttl is not None else None
+    if deadline is None:
+        LOG.debug("Vault agent listening on %s", socket_path)
+    else:
+        LOG.info("Vault agent listening on %s for %d seconds", socket_path,
+                 ttl)
+    try:
+        while True:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    LOG.info("Vault agent TTL expired")
+                    break
+            sock.settimeout(remaining)
+            try:
+                conn, _ = sock.accept()
+            except socket.timeout:
+                continue
+            with conn:
+                conn.settimeout(AGENT_TIMEOUT)
+                try:
+                    if not _is_peer_allowed(conn):
+                        continue
+                    request = conn.makefile("rb").readline().strip()
+                    if request == b"get":
+                        conn.sendall(password.encode("utf-8"))
+                    elif request == b"ping":
+                        conn.sendall(b"pong")
+                    elif request == b"stop":
+                        LOG.info("Vault agent stopped")
+                        break
+                except (OSError, socket.error) as e:
+                    LOG.debug("Vault agent request failed: %s", e)
+    finally:
+        sock.close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+@contextlib.contextmanager
+def agent_session(password):
+    """Serve a vault password from an agent thread for the duration.
+
+    The agent listens on a private socket, which is exported via
+    $JAVA_ROLE_VAULT_AGENT_SOCK so that the vault password helper, and
+    Ansible processes using it, read the password from the agent.
+
+    :param password: The vault password.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix="java_role-vault-")
+    socket_path = os.path.join(tmp_dir, "agent.sock")
+    thread = threading.Thread(target=run_agent,
+                              args=(password, socket_path, None))
+    thread.daemon = True
+    thread.start()
+    while thread.is_alive() and not os.path.exists(socket_path):
+        time.sleep(0.01)
+    old_socket_path = os.environ.get(VAULT_AGENT_SOCKET_ENV)
+    os.environ[VAULT_AGENT_SOCKET_ENV] = socket_path
+    try:
+        yield socket_path
+    finally:
+        if old_socket_path is None:
+            del os.environ[VAULT_AGENT_SOCKET_ENV]
+        else:
+            os.environ[VAULT_AGENT_SOCKET_ENV] = old_socket_path
+        stop_agent(socket_path)
+        thread.join(AGENT_TIMEOUT)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _find_password_helper():
+    """Return the path to the vault password helper script, or None.
+
+    The helper is looked up on $PATH, then alongside the Python interpreter,
+    where it is installed in a virtualenv which has not been activated.
+    """
+    path = _PASSWORD_HELPER_CACHE.get(VAULT_PASSWORD_HELPER)
+    if path:
+        return path
+    path = shutil.which(VAULT_PASSWORD_HELPER)
+    if not path:
+        path = shutil.which(VAULT_PASSWORD_HELPER,
+                            path=os.path.dirname(sys.executable))
+    if not path:
+        LOG.warning("Failed to find %s", VAULT_PASSWORD_HELPER)
+        return None
+    _PASSWORD_HELPER_CACHE[VAULT_PASSWORD_HELPER] = path
+    return path
+
+
+def get_password_file(parsed_args):
+    """Return the vault password file to pass to Ansible, or None.
+
+    Defaults are resolved here rather than when the argument parser is built,
+    so that commands which do not use the vault do not pay for them. If no
+    vault password file was specified and $JAVA_ROLE_VAULT_PASSWORD is set,
+    or a vault agent is running, the vault password helper is used. The
+    helper is also used in place of prompting when an agent is running.
+    """
+    if parsed_args.ask_vault_pass:
+        if ping_agent():
+            return _find_password_helper()
+        return None
+    if parsed_args.vault_password_file:
+        return parsed_args.vault_password_file
+    if os.getenv(VAULT_PASSWORD_ENV) or ping_agent():
+        return _find_password_helper()
+    return None
 
 
 def build_args(parsed_args):
     """Build a list of command line arguments for use with ansible-playbook."""
     cmd = []
-    if parsed_args.ask_vault_pass:
+    password_file = get_password_file(parsed_args)
+    if password_file:
+        cmd += ["--vault-password-file", password_file]
+    elif parsed_args.ask_vault_pass:
         cmd += ["--ask-vault-pass"]
-    elif parsed_args.vault_password_file:
-        cmd += ["--vault-password-file", parsed_args.vault_password_file]
     return cmd
+
+
+# Vault file format header.
+VAULT_HEADER = b"$ANSIBLE_VAULT"
+
+# Number of PBKDF2 iterations used by the Ansible vault AES256 cipher.
+_PBKDF2_ITERATIONS = 10000
+
+# Width of lines of vault-encrypted content.
+_VAULT_LINE_WIDTH = 80
+
+# Actions supported by process_files.
+FILE_ACTIONS = ("encrypt", "decrypt", "rekey", "view")
+
+
+def is_encrypted(content):
+    """Return whether some bytes are vault-encrypted content."""
+    return content.lstrip().startswith(VAULT_HEADER)
+
+
+def _derive_keys(password, salt):
+    """Derive the cipher key, HMAC key and counter from a password and salt.
+
+    Keys are not cached, so that passwords and keys are not kept in memory
+    after use. Each file has its own random salt, from which the initial
+    counter is also derived, so a salt must never be reused for encryption.
+    """
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=2 * 32 + 16,
+                     salt=salt, iterations=_PBKDF2_ITERATIONS,
+                     backend=default_backend())
+    derived = kdf.derive(password)
+    return derived[:32], derived[32:64], derived[64:]
+
+
+def _parse_envelope(content):
+    """Split vault-encrypted content into its header fields and body."""
+    lines = content.strip().splitlines()
+    header = lines[0].strip().split(b";")
+    if header[0] != VAULT_HEADER or len(header) < 3:
+        raise ValueError("Invalid vault header")
+    if header[2] != b"AES256":
+        raise ValueError("Unsupported vault cipher %s" %
+                         header[2].decode("utf-8"))
+    vault_id = header[3] if len(header) > 3 else None
+    return vault_id, b"".join(line.strip() for line in lines[1:])
+
+
+def decrypt(content, password):
+    """Decrypt vault-encrypted content.
+
+    :param content: Vault-encrypted bytes.
+    :param password: Vault password as bytes.
+    :returns: Decrypted bytes.
+    :raises: ValueError if the content is invalid or the password is wrong.
+    """
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives import hmac
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import algorithms
+    from cryptography.hazmat.primitives.ciphers import Cipher
+    from cryptography.hazmat.primitives.ciphers import modes
+    from cryptography.exceptions import InvalidSignature
+
+    _, body = _parse_envelope(content)
+    try:
+        salt, digest, ciphertext = binascii.unhexlify(body).split(b"\n", 2)
+        salt = binascii.unhexlify(salt)
+        digest = binascii.unhexlify(digest)
+        ciphertext = binascii.unhexlify(ciphertext)
+    except (binascii.Error, TypeError, ValueError):
+        raise ValueError("Invalid vault-encrypted content")
+    cipher_key, hmac_key, counter = _derive_keys(password, salt)
+    signer = hmac.HMAC(hmac_key, hashes.SHA256(), default_backend())
+    signer.update(ciphertext)
+    try:
+        signer.verify(digest)
+    except InvalidSignature:
+        raise ValueError("Decryption failed, the vault password may be "
+                         "incorrect")
+    decryptor = Cipher(algorithms.AES(cipher_key), modes.CTR(counter),
+                       default_backend()).decryptor()
+    padded = decryptor.update(ciphertext) + decryptor.finalize()
+    unpadder = padding.PKCS7(algorithms.AES.block_size).unpadder()
+    return unpadder.update(padded) + unpadder.finalize()
+
+
+def encrypt(plaintext, password, vault_id=None):
+    """Encrypt content in the Ansible vault format.
+
+    :param plaintext: Bytes to encrypt.
+    :param password: Vault password as bytes.
+    :param vault_id: Optional vault ID label as bytes.
+    :returns: Vault-encrypted bytes.
+    """
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives import hmac
+    from cryptography.hazmat.primitives import padding
+    from cryptography.hazmat.primitives.ciphers import algorithms
+    from cryptography.hazmat.primitives.ciphers import Cipher
+    from cryptography.hazmat.primitives.ciphers import modes
+
+    salt = os.urandom(32)
+    cipher_key, hmac_key, counter = _derive_keys(password, salt)
+    padder = padding.PKCS7(algorithms.AES.block_size).padder()
+    padded = padder.update(plaintext) + padder.finalize()
+    encryptor = Cipher(algorithms.AES(cipher_key), modes.CTR(counter),
+                       default_backend()).encryptor()
+    ciphertext = encryptor.update(padded) + encryptor.finalize()
+    signer = hmac.HMAC(hmac_key, hashes.SHA256(), default_backend())
+    signer.update(ciphertext)
+    body = binascii.hexlify(b"\n".join([
+        binascii.hexlify(salt),
+        binascii.hexlify(signer.finalize()),
+        binascii.hexlify(ciphertext)]))
+    if vault_id:
+        header = VAULT_HEADER + b";1.2;AES256;" + vault_id
+    else:
+        header = VAULT_HEADER + b";1.1;AES256"
+    lines = [header] + [body[i:i + _VAULT_LINE_WIDTH]
+                        for i in range(0, len(body), _VAULT_LINE_WIDTH)]
+    return b"\n".join(lines) + b"\n"
+
+
+def _process_file(action, path, password, new_password=None):
+    """Apply a vault action to a file.
+
+    :returns: A tuple of path, whether the file was processed, and the
+              decrypted content for the view action.
+    """
+    with open(path, "rb") as f:
+        content = f.read()
+    encrypted = is_encrypted(content)
+    if action == "encrypt":
+        if encrypted:
+            return path, False, None
+        utils.write_file_atomic(path, encrypt(content, password))
+        return path, True, None
+    if not encrypted:
+        return path, False, None
+    plaintext = decrypt(content, password)
+    if action == "view":
+        return path, True, plaintext
+    if action == "decrypt":
+        utils.write_file_atomic(path, plaintext)
+    elif action == "rekey":
+        vault_id, _ = _parse_envelope(content)
+        utils.write_file_atomic(path, encrypt(plaintext, new_password,
+                                              vault_id=vault_id))
+    return path, True, None
+
+
+def find_files(paths):
+    """Return a sorted list of the files at or under some paths."""
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+                files.update(os.path.join(root, name) for name in names
+                             if not name.startswith("."))
+        else:
+            files.add(path)
+    return sorted(files)
+
+
+def process_files(action, paths, password, new_password=None, workers=None):
+    """Apply a vault action to many files in a process pool.
+
+    Files are written atomically. Files which are already encrypted are not
+    encrypted, and files which are not encrypted are skipped by the other
+    actions.
+
+    :param action: One of FILE_ACTIONS.
+    :param paths: List of paths to files.
+    :param password: Vault password as bytes.
+    :param new_password: New vault password as bytes, for the rekey action.
+    :param workers: Number of worker processes. Default is the number of
+                    CPUs.
+    :returns: An iterator over tuples of path, whether the file was
+              processed, and the decrypted content for the view action, in
+              the order of paths. Failures are returned in place of the
+              decrypted content as ValueError or EnvironmentError exceptions.
+    """
+    workers = min(workers or os.cpu_count() or 1, len(paths))
+    if workers < 2:
+        for path in paths:
+            yield _try_process_file(action, path, password, new_password)
+        return
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(_try_process_file, action, path, password,
+                                   new_password)
+                   for path in paths]
+        for future in futures:
+            yield future.result()
+
+
+def _try_process_file(action, path, password, new_password):
+    try:
+        return _process_file(action, path, password, new_password)
+    except (EnvironmentError, ValueError) as e:
+        return path, False, e
+
+
+def read_password_file(path):
+    """Read a vault password file, running it if it is executable."""
+    if os.access(path, os.X_OK):
+        password = subprocess.check_output([path])
+    else:
+        with open(path, "rb") as f:
+            password = f.read()
+    return password.strip()
+
+
+def get_password(parsed_args, prompt="Vault password: "):
+    """Return the vault password as bytes.
+
+    The password is read from the vault password file, including the vault
+    password helper, and is prompted for otherwise.
+    """
+    password_file = get_password_file(parsed_args)
+    if password_file:
+        return read_password_file(password_file)
+    return getpass.getpass(prompt).encode("utf-8")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Compare the wall-clock time taken to parse synthetic configuration dump
+# files, using the pure Python and C YAML loaders, a process pool, and JSON.
+#
+# Usage: benchmark-config-dump.py [--hosts N [--hosts N ...]] [--workers N]
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import mock
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from java_role import ansible  # noqa
+from java_role import utils  # noqa
+
+
+def _host_vars(index):
+    """Return synthetic host variables, including facts."""
+    return {
+        "inventory_hostname": "host%d" % index,
+        "ansible_host": "10.0.%d.%d" % (index // 256, index % 256),
+        "ansible_facts": {
+            "interfaces": ["eth%d" % i for i in range(8)],
+            "mounts": [{"device": "/dev/sda%d" % i, "size_total": i * 2 ** 30}
+                       for i in range(16)],
+            "env": dict(("VAR%d" % i, "value%d" % i) for i in range(64)),
+            "packages": dict(("package%d" % i, [{"version": "1.%d" % i}])
+                             for i in range(256)),
+        },
+    }
+
+
+def _write_dumps(path, num_hosts, ext):
+    paths = []
+    for i in range(num_hosts):
+        dump_path = os.path.join(path, "host%d%s" % (i, ext))
+        hvars = _host_vars(i)
+        with open(dump_path, "w") as f:
+            if ext == ".json":
+                json.dump(hvars, f)
+            else:
+                yaml.safe_dump(hvars, f, default_flow_style=False)
+        paths.append(dump_path)
+    return paths
+
+
+def _time_parse(paths, workers):
+    start = time.time()
+    for _ in ansible._parse_dump_files(paths, workers=workers):
+        pass
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hosts", type=int, action="append")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    for num_hosts in args.hosts or [1000, 10000]:
+        dump_dir = tempfile.mkdtemp()
+        try:
+            yaml_paths = _write_dumps(dump_dir, num_hosts, ".yml")
+            json_paths = _write_dumps(dump_dir, num_hosts, ".json")
+            print("%d hosts" % num_hosts)
+            cases = [
+                ("yaml-python", yaml_paths, 1, yaml.SafeLoader),
+                ("yaml-libyaml", yaml_paths, 1, utils.get_yaml_loader()),
+                ("yaml-pool", yaml_paths, args.workers,
+                 utils.get_yaml_loader()),
+                ("json", json_paths, 1, None),
+                ("json-pool", json_paths, args.workers, None),
+            ]
+            for name, paths, workers, loader in cases:
+                if loader is None:
+                    elapsed = _time_parse(paths, workers)
+                else:
+                    with mock.patch.object(utils, "get_yaml_loader",
+                                           return_value=loader):
+                        elapsed = _time_parse(paths, workers)
+                print("%-14s %8.2fs" % (name, elapsed))
+        finally:
+            shutil.rmtree(dump_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Compare the wall-clock time taken to run a chain of playbooks using the
+# subprocess and in-process engines. Both engines load the inventory and
+# variables afresh for every run, so this measures only the overhead of
+# interpreter startup and the import of Ansible and its plugins.
+#
+# Usage: benchmark-engine.py [--hosts N] [--runs N]
+
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from java_role import ansible  # noqa
+from java_role import vault  # noqa
+
+PLAYBOOK = """---
+- hosts: all
+  gather_facts: false
+  tasks:
+    - debug:
+        msg: "{{ inventory_hostname }}"
+"""
+
+
+def _write_config(path, num_hosts):
+    """Write a configuration under path, and a playbook outside of it.
+
+    The playbook must not be in the configuration path, since YAML files
+    there are passed to Ansible as extra variables.
+
+    :returns: A tuple of the configuration path and the playbook path.
+    """
+    config_path = os.path.join(path, "config")
+    inventory = os.path.join(config_path, "inventory")
+    os.makedirs(inventory)
+    with open(os.path.join(inventory, "hosts"), "w") as f:
+        f.write("[benchmark]\n")
+        for i in range(num_hosts):
+            f.write("host%d ansible_connection=local\n" % i)
+    playbook = os.path.join(path, "benchmark.yml")
+    with open(playbook, "w") as f:
+        f.write(PLAYBOOK)
+    return config_path, playbook
+
+
+def _time_runs(config_path, playbook, engine, num_runs):
+    parser = argparse.ArgumentParser()
+    ansible.add_args(parser)
+    vault.add_args(parser)
+    parsed_args = parser.parse_args(["--config-path", config_path,
+                                     "--engine", engine])
+    start = time.time()
+    for _ in range(num_runs):
+        ansible.run_playbook(parsed_args, playbook, quiet=True)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hosts", type=int, default=100)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    path = tempfile.mkdtemp()
+    try:
+        config_path, playbook = _write_config(path, args.hosts)
+        print("%d runs against %d hosts" % (args.runs, args.hosts))
+        for engine in ansible.ENGINES:
+            elapsed = _time_runs(config_path, playbook, engine, args.runs)
+            print("%-12s %8.2fs total %8.2fs per run" %
+                  (engine, elapsed, elapsed / args.runs))
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    main()
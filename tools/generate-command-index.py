@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 StackHPC Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+# Generate the JavaRole command index from the entry points in setup.cfg.
+# This should be run whenever a command is added, removed or renamed.
+#
+# Usage: generate-command-index.py [--check]
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from java_role.cli import manager  # noqa
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--check", action="store_true",
+                        help="check that the index is up to date")
+    parsed_args = parser.parse_args()
+    setup_cfg = os.path.join(os.path.dirname(__file__), os.pardir,
+                             "setup.cfg")
+    index = manager.build_index(setup_cfg)
+    if parsed_args.check:
+        if manager.load_index() != index:
+            print("Command index %s is out of date" % manager.INDEX_FILE)
+            sys.exit(1)
+        return
+    with open(manager.INDEX_FILE, "w") as f:
+        json.dump(index, f, indent=4, sort_keys=True)
+        f.write("\n")
+
+
+if __name__ == "__main__":
+    main()